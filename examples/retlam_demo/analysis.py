@@ -0,0 +1,240 @@
+'''
+    Streaming analysis of retina and lamina input and output files.
+
+    Only the columns of the requested neurons and the requested time
+    window are read from a file, in chunks of steps, so reductions over
+    long runs need memory proportional to the chunk and not to the run.
+
+    Output files of FileOutputProcessor store uids next to the data and
+    neurons are looked up by name and element (ommatidium or cartridge);
+    input files written by gen_input have the photoreceptor columns of
+    each ommatidium in order R1-R6.
+
+    Usage: python analysis.py [-i index] [-s suffix] [-t step] [-o file]
+    writes R1 inputs, R1 outputs, average R1-R6 terminal outputs of
+    cartridges and L1, L2 outputs to one file, like visualize_result.m.
+'''
+from __future__ import division
+
+import argparse
+
+import h5py
+import numpy as np
+
+from naming import PHOTOR_NAMES, data_file, parse_uid, photoreceptor_uids
+
+# steps read at a time
+CHUNK_STEPS = 1000
+
+
+class NeuronFile(object):
+    '''
+        Read access to a (steps, neurons) dataset by neuron name and
+        element.
+
+        --
+        filename: name of input or output file
+        var: recorded variable of output files
+    '''
+    def __init__(self, filename, var='V'):
+        self.filename = filename
+        self.h5file = h5py.File(filename, 'r')
+        if var + '/data' in self.h5file:
+            self.dataset = self.h5file[var + '/data']
+            uids = self.h5file[var + '/uids'][:]
+        else:
+            # input file of gen_input
+            self.dataset = self.h5file['array']
+            num_elements = self.dataset.shape[1] // len(PHOTOR_NAMES)
+            uids = photoreceptor_uids(num_elements)
+        self.columns = dict((parse_uid(uid), i) for i, uid in enumerate(uids))
+        self.num_steps = self.dataset.shape[0]
+
+    def elements(self, name):
+        ''' sorted elements that have a neuron named `name` '''
+        return sorted(e for n, e in self.columns if n == name)
+
+    def get_columns(self, name, elements=None):
+        '''
+            Columns of neurons named `name` of `elements`,
+            None for all elements that have such a neuron
+        '''
+        if elements is None:
+            elements = self.elements(name)
+        try:
+            return np.array([self.columns[(name, e)] for e in elements],
+                            dtype=np.int64)
+        except KeyError as e:
+            raise KeyError('No neuron {} of element {} in {}'.format(
+                name, e.args[0][1], self.filename))
+
+    def read(self, columns, start, stop, step=1):
+        '''
+            Rows start:stop:step of `columns`, reading only a hyperslab
+            that contains them
+        '''
+        order = np.argsort(columns)
+        sorted_columns = columns[order]
+        first, last = sorted_columns[0], sorted_columns[-1] + 1
+        if len(columns) > (last - first) // 2:
+            # dense selection, read the column range
+            data = self.dataset[start:stop:step, first:last]
+            data = data[:, sorted_columns - first]
+        else:
+            data = self.dataset[start:stop:step, sorted_columns.tolist()]
+        result = np.empty_like(data)
+        result[:, order] = data
+        return result
+
+    def iter_chunks(self, columns, start=0, stop=None, step=1,
+                    chunk_steps=CHUNK_STEPS):
+        '''
+            Yields (first row, data) of consecutive chunks of rows
+            start:stop:step of `columns`, each chunk has at most
+            `chunk_steps` rows
+        '''
+        stop = self.num_steps if stop is None else min(stop, self.num_steps)
+        span = chunk_steps*step
+        for chunk_start in range(start, stop, span):
+            chunk_stop = min(chunk_start + span, stop)
+            yield ((chunk_start - start)//step,
+                   self.read(columns, chunk_start, chunk_stop, step))
+
+    def num_rows(self, start=0, stop=None, step=1):
+        stop = self.num_steps if stop is None else min(stop, self.num_steps)
+        return len(range(start, stop, step))
+
+    def close(self):
+        self.h5file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+def iter_neurons(nfile, name, elements=None, **kwargs):
+    '''
+        Yields (first row, data) chunks of outputs of neurons `name`,
+        one column per element; keyword arguments are those of
+        `NeuronFile.iter_chunks`
+    '''
+    columns = nfile.get_columns(name, elements)
+    return nfile.iter_chunks(columns, **kwargs)
+
+
+def iter_average(nfile, names, elements=None, **kwargs):
+    '''
+        Yields (first row, data) chunks of the average of neurons `names`
+        of each element, e.g. of R1-R6 terminals of each cartridge
+    '''
+    if elements is None:
+        elements = nfile.elements(names[0])
+    num_elements = len(elements)
+    columns = np.concatenate([nfile.get_columns(name, elements)
+                              for name in names])
+    for row, data in nfile.iter_chunks(columns, **kwargs):
+        yield row, data.reshape(len(data), len(names),
+                                num_elements).mean(axis=1)
+
+
+def value_range(chunks):
+    '''
+        (minimum, maximum) over all chunks of an iterator
+    '''
+    vmin, vmax = np.inf, -np.inf
+    for _, data in chunks:
+        if data.size:
+            vmin = min(vmin, np.nanmin(data))
+            vmax = max(vmax, np.nanmax(data))
+    return vmin, vmax
+
+
+def collect(chunks, num_rows=None):
+    '''
+        Concatenates chunks of an iterator into one array,
+        preallocated if the number of rows is known
+    '''
+    if num_rows is None:
+        return np.concatenate([data for _, data in chunks])
+    result = None
+    for row, data in chunks:
+        if result is None:
+            result = np.empty((num_rows, data.shape[1]), data.dtype)
+        result[row:row + len(data)] = data
+    return result
+
+
+def save(chunks, h5file, name, num_rows):
+    '''
+        Writes chunks of an iterator to dataset `name` of
+        an open HDF5 file one chunk at a time
+    '''
+    dataset = None
+    for row, data in chunks:
+        if dataset is None:
+            dataset = h5file.create_dataset(
+                name, (num_rows, data.shape[1]), data.dtype,
+                chunks=(min(len(data), num_rows), data.shape[1]))
+        dataset[row:row + len(data)] = data
+    return dataset
+
+
+def summarize(index=0, suffix='', step=10, start=0, stop=None,
+              output_file=None, chunk_steps=CHUNK_STEPS,
+              input_file='retina_input', retina_file='retina_output',
+              lamina_file='lamina_output'):
+    '''
+        Writes the traces shown by visualize_result.m, sampled every
+        `step` steps, to `output_file` (default analysis<index><suffix>.h5):
+        R1input and R1 (retina), Rb (average R1-R6 terminals), L1 and L2
+        (lamina), one column per ommatidium or cartridge
+    '''
+    def name(base):
+        # names of the files of the demos and their output processors
+        return data_file(base, index, suffix)
+
+    if output_file is None:
+        output_file = name('analysis')
+    kwargs = {'start': start, 'stop': stop, 'step': step,
+              'chunk_steps': chunk_steps}
+    with h5py.File(output_file, 'w') as out:
+        out.attrs['step'] = step
+        out.attrs['start'] = start
+        with NeuronFile(name(input_file)) as nfile:
+            rows = nfile.num_rows(start, stop, step)
+            save(iter_neurons(nfile, 'R1', **kwargs), out, 'R1input', rows)
+        with NeuronFile(name(retina_file)) as nfile:
+            rows = nfile.num_rows(start, stop, step)
+            save(iter_neurons(nfile, 'R1', **kwargs), out, 'R1', rows)
+        with NeuronFile(name(lamina_file)) as nfile:
+            rows = nfile.num_rows(start, stop, step)
+            save(iter_average(nfile, PHOTOR_NAMES, **kwargs),
+                 out, 'Rb', rows)
+            for neuron in ['L1', 'L2']:
+                save(iter_neurons(nfile, neuron, **kwargs),
+                     out, neuron, rows)
+    return output_file
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-i', '--index', type=int, default=0,
+                        help='Eye index of files')
+    parser.add_argument('-s', '--suffix', default='',
+                        help='File suffix of the simulation')
+    parser.add_argument('-t', '--step', type=int, default=10,
+                        help='Keep every this many steps')
+    parser.add_argument('-o', '--output', default=None,
+                        help='Output file')
+    parser.add_argument('-c', '--chunk', type=int, default=CHUNK_STEPS,
+                        help='Steps read at a time')
+    args = parser.parse_args()
+
+    output_file = summarize(args.index, args.suffix, args.step,
+                            output_file=args.output, chunk_steps=args.chunk)
+    print('Wrote {}'.format(output_file))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,173 @@
+'''
+    Output processor that writes HDF5 output from a background thread.
+
+    Each recorded step is copied into a block in memory; full blocks go
+    through a bounded queue to a writer thread, so file system latency
+    does not stall the simulation unless the queue is full. The file has
+    the layout of FileOutputProcessor.
+'''
+import threading
+import time
+
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+import numpy as np
+
+from neurokernel.LPU.OutputProcessors.FileOutputProcessor import \
+    FileOutputProcessor
+
+# target size of HDF5 chunks in bytes
+CHUNK_BYTES = 2**20
+
+
+def get_chunk_shape(block_steps, num_uids, itemsize, layout='time'):
+    '''
+        Chunk shape of a (steps, uids) dataset for reading either all
+        neurons over a time window (layout 'time') or a single neuron
+        over the whole run (layout 'neuron')
+    '''
+    num_uids = max(num_uids, 1)
+    if layout == 'time':
+        rows = CHUNK_BYTES // (itemsize*num_uids)
+        return (int(max(1, min(block_steps, rows))), num_uids)
+    cols = CHUNK_BYTES // (itemsize*block_steps)
+    return (block_steps, int(max(1, min(num_uids, cols))))
+
+
+class AsyncFileOutputProcessor(FileOutputProcessor):
+    '''
+        --
+        var_list: list of (variable, uids) pairs to record
+        filename: name of output file
+        sample_interval: outputs are recorded every this many steps
+        block_steps: recorded steps per block given to the writer
+        queue_blocks: number of blocks that may wait to be written
+            before the simulation waits for the writer
+        complevel: gzip compression level, 0 for no compression
+        chunk_layout: 'time' or 'neuron' (see `get_chunk_shape`)
+
+        Attributes
+        ----------
+        stats: dictionary with number of blocks, maximum and mean queue
+            depth, total and maximum flush time and time the simulation
+            waited because the queue was full
+    '''
+    def __init__(self, var_list, filename, sample_interval=1,
+                 block_steps=1000, queue_blocks=4, complevel=0,
+                 chunk_layout='time'):
+        super(AsyncFileOutputProcessor, self).__init__(
+            var_list, filename, sample_interval=sample_interval)
+        self.block_steps = block_steps
+        self.queue_blocks = queue_blocks
+        self.complevel = complevel
+        self.chunk_layout = chunk_layout
+
+    def pre_run(self):
+        # metadata and uids as in FileOutputProcessor,
+        # data datasets are replaced with chunked ones
+        super(AsyncFileOutputProcessor, self).pre_run()
+        self.blocks = {}
+        for var, d in self.variables.items():
+            num_uids = len(d['uids'])
+            dtype = self.h5file[var + '/data'].dtype
+            del self.h5file[var + '/data']
+            kwargs = {}
+            if self.complevel > 0:
+                kwargs = {'compression': 'gzip',
+                          'compression_opts': self.complevel}
+            self.h5file.create_dataset(
+                var + '/data', (0, num_uids), dtype,
+                maxshape=(None, num_uids),
+                chunks=get_chunk_shape(self.block_steps, num_uids,
+                                       np.dtype(dtype).itemsize,
+                                       self.chunk_layout),
+                **kwargs)
+            self.blocks[var] = np.empty((self.block_steps, num_uids), dtype)
+        self.block_row = 0
+        self.written_rows = 0
+
+        self.stats = {'blocks': 0, 'max_queue_depth': 0, 'queue_depth': 0,
+                      'flush_time': 0., 'max_flush_time': 0.,
+                      'wait_time': 0.}
+        self._queue = queue.Queue(maxsize=self.queue_blocks)
+        self._error = None
+        self._thread = threading.Thread(target=self._run,
+                                        name='output-writer')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def process_output(self):
+        for var, d in self.variables.items():
+            self.blocks[var][self.block_row] = d['output'].reshape(-1)
+        self.block_row += 1
+        if self.block_row == self.block_steps:
+            self._submit_block()
+
+    def _submit_block(self):
+        if self._error is not None:
+            raise self._error
+        if self.block_row == 0:
+            return
+        block = dict((var, b[:self.block_row].copy())
+                     for var, b in self.blocks.items())
+        depth = self._queue.qsize()
+        self.stats['queue_depth'] += depth
+        self.stats['max_queue_depth'] = max(self.stats['max_queue_depth'],
+                                            depth)
+        start = time.time()
+        # blocks when the writer falls behind
+        self._queue.put(block)
+        self.stats['wait_time'] += time.time() - start
+        self.stats['blocks'] += 1
+        self.block_row = 0
+
+    def _run(self):
+        while True:
+            block = self._queue.get()
+            if block is None:
+                break
+            if self._error is not None:
+                # blocks are discarded after an error so that the
+                # simulation never waits on a full queue
+                continue
+            try:
+                start = time.time()
+                self._write_block(block)
+                flush_time = time.time() - start
+            except Exception as e:
+                self._error = e
+                continue
+            self.stats['flush_time'] += flush_time
+            self.stats['max_flush_time'] = max(self.stats['max_flush_time'],
+                                               flush_time)
+
+    def _write_block(self, block):
+        rows = 0
+        for var, data in block.items():
+            dataset = self.h5file[var + '/data']
+            rows = len(data)
+            dataset.resize((self.written_rows + rows, dataset.shape[1]))
+            dataset[self.written_rows:self.written_rows + rows] = data
+        self.written_rows += rows
+
+    def post_run(self):
+        try:
+            if self._error is None:
+                self._submit_block()
+        finally:
+            self._queue.put(None)
+            self._thread.join()
+        stats = self.stats
+        blocks = max(stats['blocks'], 1)
+        print('Output {}: {} blocks, queue depth max {} mean {:.2f}, '
+              'flush time total {:.3f}s max {:.3f}s, '
+              'waited {:.3f}s'.format(
+                  self.filename, stats['blocks'], stats['max_queue_depth'],
+                  stats['queue_depth']/blocks, stats['flush_time'],
+                  stats['max_flush_time'], stats['wait_time']))
+        super(AsyncFileOutputProcessor, self).post_run()
+        if self._error is not None:
+            raise self._error
@@ -0,0 +1,319 @@
+'''
+    SQLite catalog of simulation runs.
+
+    Every run registers its resolved configuration, the files it wrote
+    with their sizes, the duration of its phases and summary statistics
+    of its outputs, so that runs of a sweep can be found by configuration
+    values instead of file names, e.g.
+
+        catalog = Catalog('retlam_runs.sqlite')
+        for run in catalog.find({'General.dt': 1e-3, 'Retina.rings': 14}):
+            print(run['files']['retina_output'])
+
+    or from the command line
+
+        $ python catalog.py -w General.dt=1e-3 -w Retina.rings=14
+'''
+import argparse
+import ast
+import contextlib
+import datetime
+import json
+import os
+import sqlite3
+
+import h5py
+import numpy as np
+
+import naming
+import tracing as tr
+from export import BINARY_EXT, GEXF_EXT
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS runs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    created TEXT, directory TEXT, suffix TEXT, status TEXT, config TEXT);
+CREATE TABLE IF NOT EXISTS params (run_id INTEGER, name TEXT, value);
+CREATE INDEX IF NOT EXISTS params_name_value ON params (name, value);
+CREATE TABLE IF NOT EXISTS files (
+    run_id INTEGER, kind TEXT, path TEXT, size INTEGER);
+CREATE TABLE IF NOT EXISTS timings (
+    run_id INTEGER, phase TEXT, seconds REAL);
+CREATE TABLE IF NOT EXISTS metrics (run_id INTEGER, name TEXT, value REAL);
+'''
+
+OPERATORS = ['=', '!=', '<', '<=', '>', '>=']
+
+# rows of output files read at a time for summary metrics
+METRIC_CHUNK_STEPS = 1000
+
+
+@contextlib.contextmanager
+def timed(timings, name):
+    '''
+        Traces the block as a span and adds its duration
+        to `timings[name]`
+    '''
+    with tr.span(name) as record:
+        yield
+    timings[name] = timings.get(name, 0.) + record['wall']
+
+
+def flatten_config(config, prefix=''):
+    '''
+        Dictionary of 'Section.key' -> value of all options
+    '''
+    flat = {}
+    for key, value in config.items():
+        name = prefix + key
+        if hasattr(value, 'items'):
+            flat.update(flatten_config(value, name + '.'))
+        else:
+            flat[name] = value
+    return flat
+
+
+def _sql_value(value):
+    # lists are stored as json text, numbers and strings as themselves
+    if isinstance(value, (list, tuple)):
+        return json.dumps(list(value))
+    if isinstance(value, np.generic):
+        return value.item()
+    return value
+
+
+def run_files(config, index=0):
+    '''
+        Dictionary of kind -> name of the files of eye `index`
+        that a run with configuration `config` writes
+    '''
+    suffix = config['General']['file_suffix']
+
+    def name(base):
+        return naming.data_file(base, index, suffix)
+
+    files = {'retina_output': name(config['Retina']['output_file']),
+             'lamina_output': name(config['Lamina']['output_file'])}
+    if config['Retina']['inputmethod'] == 'read':
+        files['retina_input'] = name(config['Retina']['input_file'])
+        files['intensities'] = 'intensities{}{}.h5'.format(suffix, index)
+    for kind in ['retina_elev', 'retina_azim', 'grid_dima', 'grid_dimb',
+                 'retina_dima', 'retina_dimb']:
+        files[kind] = '{}{}.h5'.format(kind, index)
+    graphs = [('retina_graph', '{}{}{}'.format(config['Retina']['gexf_file'],
+                                               index, suffix)),
+              ('lamina_graph', '{}{}{}'.format(config['Lamina']['gexf_file'],
+                                               index, suffix)),
+              ('pattern', naming.pattern_id(index))]
+    for kind, base in graphs:
+        for ext in [GEXF_EXT, BINARY_EXT]:
+            if os.path.exists(base + ext):
+                files[kind] = base + ext
+    return files
+
+
+def output_metrics(filename, var='V', chunk_steps=METRIC_CHUNK_STEPS):
+    '''
+        Number of steps and neurons, mean, minimum and maximum of
+        the outputs in `filename`, read one chunk of steps at a time
+    '''
+    with h5py.File(filename, 'r') as f:
+        dataset = f[var + '/data']
+        steps, neurons = dataset.shape
+        total, vmin, vmax = 0., np.inf, -np.inf
+        for start in range(0, steps, chunk_steps):
+            data = dataset[start:start + chunk_steps]
+            total += float(np.sum(data, dtype=np.double))
+            vmin = min(vmin, float(np.min(data)))
+            vmax = max(vmax, float(np.max(data)))
+    metrics = {'steps': steps, 'neurons': neurons}
+    if steps*neurons > 0:
+        metrics.update({'mean': total/(steps*neurons), 'min': vmin,
+                        'max': vmax})
+    return metrics
+
+
+class _Transaction(object):
+    # commits on success and closes the connection in any case
+    def __init__(self, conn):
+        self.conn = conn
+
+    def __enter__(self):
+        return self.conn
+
+    def __exit__(self, exc_type, exc_value, tb):
+        try:
+            if exc_type is None:
+                self.conn.commit()
+            else:
+                self.conn.rollback()
+        finally:
+            self.conn.close()
+
+
+class Catalog(object):
+    '''
+        --
+        path: file of the SQLite database, created if it does not exist
+    '''
+    def __init__(self, path):
+        self.path = path
+        with self._connect() as conn:
+            conn.executescript(SCHEMA)
+
+    @classmethod
+    def from_config(cls, config):
+        return cls(config['Catalog']['path'])
+
+    def _connect(self):
+        # a connection per operation, so runs of a sweep can register
+        # from several threads
+        conn = sqlite3.connect(self.path, timeout=60)
+        conn.row_factory = sqlite3.Row
+        return _Transaction(conn)
+
+    def register(self, config, files=None, timings=None, metrics=None,
+                 status='completed'):
+        '''
+            Adds a run and returns its id
+
+            --
+            config: resolved configuration of the run
+            files: dictionary of kind -> file name, missing files
+                are skipped
+            timings: dictionary of phase -> seconds
+            metrics: dictionary of name -> number
+            status: 'completed' or 'failed'
+        '''
+        flat = flatten_config(config)
+        created = datetime.datetime.now().isoformat()
+        with self._connect() as conn:
+            cursor = conn.execute(
+                'INSERT INTO runs (created, directory, suffix, status, '
+                'config) VALUES (?, ?, ?, ?, ?)',
+                (created, os.getcwd(), config['General']['file_suffix'],
+                 status, json.dumps(flat, default=_sql_value)))
+            run_id = cursor.lastrowid
+            conn.executemany(
+                'INSERT INTO params VALUES (?, ?, ?)',
+                [(run_id, k, _sql_value(v)) for k, v in flat.items()])
+            conn.executemany(
+                'INSERT INTO files VALUES (?, ?, ?, ?)',
+                [(run_id, kind, os.path.abspath(path),
+                  os.path.getsize(path))
+                 for kind, path in (files or {}).items()
+                 if os.path.exists(path)])
+            conn.executemany(
+                'INSERT INTO timings VALUES (?, ?, ?)',
+                [(run_id, k, v) for k, v in (timings or {}).items()])
+            conn.executemany(
+                'INSERT INTO metrics VALUES (?, ?, ?)',
+                [(run_id, k, _sql_value(v))
+                 for k, v in (metrics or {}).items()])
+        return run_id
+
+    def find(self, where=None, status=None):
+        '''
+            Runs whose configuration matches `where`, a dictionary of
+            'Section.key' -> value or (operator, value) with operator
+            one of OPERATORS, e.g. {'Retina.rings': ('>=', 14)}.
+            Each run is a dictionary with id, created, directory,
+            suffix, status, config, files, timings and metrics.
+        '''
+        query = 'SELECT * FROM runs'
+        conditions, args = [], []
+        for name, condition in (where or {}).items():
+            if isinstance(condition, tuple):
+                op, value = condition
+            else:
+                op, value = '=', condition
+            if op not in OPERATORS:
+                raise ValueError('Invalid operator {}'.format(op))
+            conditions.append('id IN (SELECT run_id FROM params '
+                              'WHERE name = ? AND value {} ?)'.format(op))
+            args.extend([name, _sql_value(value)])
+        if status is not None:
+            conditions.append('status = ?')
+            args.append(status)
+        if conditions:
+            query += ' WHERE ' + ' AND '.join(conditions)
+        query += ' ORDER BY id'
+
+        with self._connect() as conn:
+            runs = [dict(row) for row in conn.execute(query, args)]
+            for run in runs:
+                run['config'] = json.loads(run['config'])
+                for table, key, value in [('files', 'kind', 'path'),
+                                          ('timings', 'phase', 'seconds'),
+                                          ('metrics', 'name', 'value')]:
+                    run[table] = dict(
+                        (row[0], row[1]) for row in conn.execute(
+                            'SELECT {}, {} FROM {} WHERE run_id = ?'.format(
+                                key, value, table), (run['id'],)))
+        return runs
+
+    def remove(self, run_id):
+        with self._connect() as conn:
+            for table in ['params', 'files', 'timings', 'metrics']:
+                conn.execute('DELETE FROM {} WHERE run_id = ?'.format(table),
+                             (run_id,))
+            conn.execute('DELETE FROM runs WHERE id = ?', (run_id,))
+
+
+def register_run(config, timings=None, status='completed', index=0):
+    '''
+        Registers a run in the catalog of the configuration, with
+        summary metrics of its outputs if enabled. Does nothing if
+        the catalog is disabled and returns the run id or None.
+    '''
+    cat_config = config['Catalog']
+    if not cat_config['enabled']:
+        return None
+    files = run_files(config, index)
+    metrics = {}
+    if cat_config['metrics'] and status == 'completed':
+        for kind in ['retina_output', 'lamina_output']:
+            if os.path.exists(files[kind]):
+                for name, value in output_metrics(files[kind]).items():
+                    metrics['{}.{}'.format(kind, name)] = value
+    return Catalog.from_config(config).register(
+        config, files=files, timings=timings, metrics=metrics, status=status)
+
+
+def parse_condition(text):
+    '''
+        'Section.key>=value' to ('Section.key', (operator, value))
+    '''
+    for op in sorted(OPERATORS, key=len, reverse=True):
+        name, found, value = text.partition(op)
+        if found:
+            try:
+                value = ast.literal_eval(value.strip())
+            except (ValueError, SyntaxError):
+                value = value.strip()
+            return name.strip(), (op, value)
+    raise ValueError('Expected Section.key<operator>value, '
+                     'got {}'.format(text))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-d', '--database', default='retlam_runs.sqlite',
+                        help='catalog file')
+    parser.add_argument('-w', '--where', action='append', default=[],
+                        help='condition on a configuration value, '
+                             'e.g. General.dt=1e-3 or Retina.rings>=14')
+    parser.add_argument('-s', '--status', default=None,
+                        help='only runs with this status')
+    args = parser.parse_args()
+
+    catalog = Catalog(args.database)
+    where = dict(parse_condition(c) for c in args.where)
+    for run in catalog.find(where, status=args.status):
+        print('{id} {created} {status} {directory} suffix={suffix!r}'.format(
+            **run))
+        for kind, path in sorted(run['files'].items()):
+            print('    {}: {}'.format(kind, path))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,271 @@
+'''
+    Content-addressed on-disk cache of compiled connectivity.
+
+    Entries are the (comp_dict, conns) pairs given to LPU, the
+    retina-lamina Pattern and the receptive fields of photoreceptors on
+    the screen, which depend only on geometry. Each entry is stored
+    under a hash of the configuration values it was built from, so a
+    change of geometry, model or composition simply produces a new key.
+    Old entries are evicted least recently used first once the cache
+    grows past its size bound.
+'''
+import hashlib
+import importlib
+import inspect
+import json
+import os
+import tempfile
+
+try:
+    import cPickle as pickle
+except ImportError:
+    import pickle
+
+# increase when the format of stored entries changes
+CACHE_VERSION = 1
+ENTRY_EXT = '.pkl'
+
+# configuration values each kind of entry depends on,
+# None means the whole section
+DEPENDENCIES = {
+    'retina': {'Retina': ['rings', 'radius', 'eulerangles', 'model',
+                          'micro', 'worker_num']},
+    'lamina': {'Retina': ['rings', 'radius', 'eulerangles'],
+               'Lamina': ['model', 'composition', 'relative_am',
+                          'number_am'],
+               'Composition': None},
+}
+DEPENDENCIES['pattern'] = {
+    'Retina': DEPENDENCIES['retina']['Retina'],
+    'Lamina': DEPENDENCIES['lamina']['Lamina'],
+    'Composition': None}
+# receptive field centers on screen and acceptance angles
+DEPENDENCIES['rf'] = {
+    'Retina': ['rings', 'radius', 'eulerangles', 'acceptance_factor',
+               'screentype'],
+    'Screen': None}
+# sparse receptive field weights of the nogpu filter
+DEPENDENCIES['rfweights'] = DEPENDENCIES['rf']
+
+# modules that build each kind of entry, a change of their
+# version or source invalidates the entries, 'model:<section>'
+# stands for the vision model of that section
+BUILDERS = {
+    'retina': ['retina', 'model:Retina'],
+    'lamina': ['lamina', 'model:Lamina'],
+    'pattern': ['retina', 'lamina', 'model:Retina', 'model:Lamina',
+                'superposition'],
+    'rf': ['retina', 'gen_input'],
+    'rfweights': ['retina', 'gen_input', 'sparse_rf'],
+}
+
+
+def _to_plain(value):
+    # configobj sections and lists to json serializable objects
+    if hasattr(value, 'items'):
+        return dict((k, _to_plain(v)) for k, v in value.items())
+    if isinstance(value, (list, tuple)):
+        return [_to_plain(v) for v in value]
+    return value
+
+
+def _module_fingerprint(name):
+    '''
+        Version (or source hash for local modules) of a module that
+        generates the cached structures. Returns None if the module
+        cannot be imported.
+    '''
+    try:
+        module = importlib.import_module(name)
+    except ImportError:
+        return None
+    version = getattr(module, '__version__', None)
+    if version is not None:
+        return str(version)
+    try:
+        source = inspect.getsource(module)
+    except (IOError, OSError, TypeError):
+        return None
+    return hashlib.sha1(source.encode('utf-8')).hexdigest()
+
+
+def builder_module(name, config):
+    '''
+        Module name of entry `name` of BUILDERS
+    '''
+    if name.startswith('model:'):
+        return 'vision_models.' + config[name[len('model:'):]]['model']
+    return name
+
+
+def config_digest(config, dependencies, extra=None):
+    '''
+        Hash of the configuration values listed in `dependencies`
+        (section -> list of keys or None for the whole section)
+        together with any `extra` json serializable object.
+    '''
+    selected = {}
+    for section, keys in dependencies.items():
+        values = config.get(section, {})
+        if keys is None:
+            selected[section] = _to_plain(values)
+        else:
+            selected[section] = dict((k, _to_plain(values.get(k)))
+                                     for k in keys)
+    text = json.dumps([CACHE_VERSION, selected, extra], sort_keys=True)
+    return hashlib.sha1(text.encode('utf-8')).hexdigest()
+
+
+def dump_pattern(pattern):
+    '''
+        Pattern to a picklable pair of DataFrames
+        (see `load_pattern`)
+    '''
+    return (pattern.interface.data, pattern.data)
+
+
+def load_pattern(state):
+    from neurokernel.pattern import Pattern
+    df_int, df_pat = state
+    return Pattern.from_df(df_int, df_pat)
+
+
+class ConnectivityCache(object):
+    '''
+        Cache of objects on disk, one pickle file per key.
+
+        --
+        directory: location of cache files, created if it does not exist
+        max_size: upper bound of total size of cache files in bytes,
+            None for no bound
+        enabled: if False every lookup misses and nothing is stored
+    '''
+    def __init__(self, directory, max_size=None, enabled=True):
+        self.directory = directory
+        self.max_size = max_size
+        self.enabled = enabled
+        self.hits = 0
+        self.misses = 0
+
+    @classmethod
+    def from_config(cls, config):
+        conf = config['Cache']
+        return cls(conf['directory'], max_size=int(conf['max_size']*2**20),
+                   enabled=conf['enabled'])
+
+    def key(self, kind, config, index=0):
+        '''
+            Key of entry `kind` (one of DEPENDENCIES)
+            of eye `index` under configuration `config`
+        '''
+        fingerprints = [_module_fingerprint(builder_module(name, config))
+                        for name in BUILDERS[kind]]
+        digest = config_digest(config, DEPENDENCIES[kind],
+                               extra=[index, fingerprints])
+        return '{}_{}'.format(kind, digest)
+
+    def _path(self, key):
+        return os.path.join(self.directory, key + ENTRY_EXT)
+
+    def get(self, key):
+        '''
+            Returns stored object or None if `key` is not in cache
+        '''
+        if not self.enabled:
+            return None
+        path = self._path(key)
+        try:
+            with open(path, 'rb') as f:
+                obj = pickle.load(f)
+        except (IOError, OSError):
+            self.misses += 1
+            return None
+        except (pickle.UnpicklingError, EOFError, AttributeError,
+                ImportError, ValueError):
+            # entry is corrupted or was written by incompatible code
+            self.invalidate(key)
+            self.misses += 1
+            return None
+        # access time drives eviction order
+        os.utime(path, None)
+        self.hits += 1
+        return obj
+
+    def put(self, key, obj):
+        if not self.enabled:
+            return
+        if not os.path.isdir(self.directory):
+            os.makedirs(self.directory)
+        # write to a temporary file first so that concurrent runs
+        # never read a partial entry
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory,
+                                        suffix=ENTRY_EXT + '.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                pickle.dump(obj, f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.rename(tmp_path, self._path(key))
+        except Exception:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        self.evict()
+
+    def get_or_build(self, key, build, dump=None, load=None):
+        '''
+            Returns cached object of `key` or calls `build()` and stores
+            its result. `dump` and `load` optionally convert the object
+            to and from the stored representation.
+        '''
+        stored = self.get(key)
+        if stored is not None:
+            return stored if load is None else load(stored)
+        obj = build()
+        self.put(key, obj if dump is None else dump(obj))
+        return obj
+
+    def _entries(self):
+        if not os.path.isdir(self.directory):
+            return []
+        entries = []
+        for name in os.listdir(self.directory):
+            if name.endswith(ENTRY_EXT):
+                path = os.path.join(self.directory, name)
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    continue
+                entries.append((st.st_mtime, st.st_size, path))
+        return entries
+
+    def size(self):
+        return sum(size for _, size, _ in self._entries())
+
+    def evict(self):
+        '''
+            Removes least recently used entries until the cache
+            fits in `max_size`
+        '''
+        if self.max_size is None:
+            return
+        entries = sorted(self._entries())
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in entries:
+            if total <= self.max_size:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            total -= size
+
+    def invalidate(self, key=None):
+        '''
+            Removes entry `key` or every entry if `key` is None
+        '''
+        if key is not None:
+            paths = [self._path(key)]
+        else:
+            paths = [path for _, _, path in self._entries()]
+        for path in paths:
+            if os.path.exists(path):
+                os.remove(path)
@@ -0,0 +1,170 @@
+'''
+    Export of LPU graphs and connection patterns for inspection.
+
+    The exported files are not used by the simulation, so they are
+    written off the critical path depending on configured mode:
+
+    none: nothing is written
+    sync: GEXF files are written immediately (slowest)
+    async: GEXF files are written by a background thread
+    binary: pickled graphs and pattern tables are written by
+        a background thread, they can be read with `load_graph`
+        and `load_pattern`
+'''
+import threading
+import traceback
+
+try:
+    import cPickle as pickle
+except ImportError:
+    import pickle
+
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+import networkx as nx
+
+import conncache as cc
+
+EXPORT_MODES = ['none', 'sync', 'async', 'binary']
+GEXF_EXT = '.gexf.gz'
+BINARY_EXT = '.gpickle'
+
+
+def _write_pickle(obj, filename):
+    with open(filename, 'wb') as f:
+        pickle.dump(obj, f, protocol=pickle.HIGHEST_PROTOCOL)
+
+
+def _read_pickle(filename):
+    with open(filename, 'rb') as f:
+        return pickle.load(f)
+
+
+def load_graph(filename):
+    '''
+        Reads graph written in binary mode
+    '''
+    return _read_pickle(filename)
+
+
+def dicts_to_graph(comp_dict, conns):
+    '''
+        Graph of components `comp_dict` and connections `conns`
+        as returned by LPU.graph_to_dicts
+    '''
+    G = nx.MultiDiGraph()
+    for model, attrs in comp_dict.items():
+        names = [k for k in attrs if k != 'id']
+        for i, uid in enumerate(attrs['id']):
+            data = dict((k, attrs[k][i]) for k in names)
+            data['class'] = model
+            G.add_node(uid, **data)
+    for conn in conns:
+        G.add_edge(conn[0], conn[1], **(conn[2] if len(conn) > 2 else {}))
+    return G
+
+
+def load_pattern(filename):
+    '''
+        Reads pattern written in binary mode
+    '''
+    return cc.load_pattern(_read_pickle(filename))
+
+
+class GraphExporter(object):
+    '''
+        Writes graphs and patterns according to `mode`
+        (one of EXPORT_MODES). In background modes files are
+        written in order of submission by a single daemon thread;
+        call `wait` before the process exits.
+    '''
+    def __init__(self, mode='async'):
+        if mode not in EXPORT_MODES:
+            raise ValueError('Invalid export mode: {}'.format(mode))
+        self.mode = mode
+        self.errors = []
+        self._queue = None
+        self._thread = None
+
+    @classmethod
+    def from_config(cls, config):
+        return cls(config['General']['export'])
+
+    @property
+    def background(self):
+        return self.mode in ['async', 'binary']
+
+    def export_graph(self, G, file_base):
+        '''
+            Exports graph `G` to `file_base` with the
+            extension of the format of current mode
+        '''
+        if self.mode == 'none':
+            return
+        if self.mode == 'binary':
+            self._submit(_write_pickle, G, file_base + BINARY_EXT)
+        else:
+            self._submit(nx.write_gexf, G, file_base + GEXF_EXT)
+
+    def export_dicts(self, comp_dict, conns, file_base):
+        '''
+            Exports the graph of `comp_dict` and `conns`, e.g. of
+            connectivity taken from the cache, to `file_base`
+        '''
+        if self.mode == 'none':
+            return
+        # conversion to graph is also kept off the critical path
+        if self.mode == 'binary':
+            self._submit(lambda d, f: _write_pickle(dicts_to_graph(*d), f),
+                         (comp_dict, conns), file_base + BINARY_EXT)
+        else:
+            self._submit(lambda d, f: nx.write_gexf(dicts_to_graph(*d), f),
+                         (comp_dict, conns), file_base + GEXF_EXT)
+
+    def export_pattern(self, pattern, file_base):
+        if self.mode == 'none':
+            return
+        if self.mode == 'binary':
+            self._submit(_write_pickle, cc.dump_pattern(pattern),
+                         file_base + BINARY_EXT)
+        else:
+            # conversion to graph is also kept off the critical path
+            self._submit(lambda p, f: nx.write_gexf(p.to_graph(), f),
+                         pattern, file_base + GEXF_EXT)
+
+    def _submit(self, func, obj, filename):
+        if not self.background:
+            func(obj, filename)
+            return
+        if self._thread is None:
+            self._queue = queue.Queue()
+            self._thread = threading.Thread(target=self._run,
+                                            name='graph-export')
+            self._thread.daemon = True
+            self._thread.start()
+        self._queue.put((func, obj, filename))
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                break
+            func, obj, filename = item
+            try:
+                func(obj, filename)
+            except Exception:
+                self.errors.append((filename, traceback.format_exc()))
+
+    def wait(self):
+        '''
+            Blocks until all submitted exports are written
+        '''
+        if self._thread is not None:
+            self._queue.put(None)
+            self._thread.join()
+            self._thread = None
+        for filename, error in self.errors:
+            print('Export of {} failed:\n{}'.format(filename, error))
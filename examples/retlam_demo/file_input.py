@@ -0,0 +1,176 @@
+'''
+    Input processor that feeds the retina from a pregenerated input file.
+
+    Inputs written by `gen_input` are read in chunks of steps that a
+    background thread reads ahead while the current chunk is consumed,
+    so the LPU does not wait on the disk at step boundaries.
+'''
+import threading
+import time
+
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+import h5py
+import numpy as np
+
+from neurokernel.LPU.InputProcessors.BaseInputProcessor import \
+    BaseInputProcessor
+
+import naming
+
+
+def get_photoreceptor_uids(retina):
+    '''
+        uids of photoreceptors in the order of columns of input files
+    '''
+    return naming.photoreceptor_uids(retina.num_elements)
+
+
+class ChunkPrefetcher(object):
+    '''
+        Reads consecutive chunks of rows with `read_chunk(start, end)`
+        in a background thread, keeping up to `depth` chunks ahead of
+        the consumer.
+
+        --
+        read_chunk: function that returns rows start to end-1,
+            called in order from the background thread
+        num_rows: total number of rows
+        chunk_rows: rows per chunk
+        depth: number of chunks read ahead (2 is double buffering)
+        on_start, on_exit: functions called by the background thread
+            before the first and after the last chunk (e.g. to make a
+            CUDA context current) or None
+
+        Attributes
+        ----------
+        hits: number of chunks that were ready when requested
+        stalls: number of chunks the consumer had to wait for
+        stall_time: total time in seconds spent waiting
+    '''
+    def __init__(self, read_chunk, num_rows, chunk_rows, depth=2,
+                 on_start=None, on_exit=None):
+        self.read_chunk = read_chunk
+        self.on_start = on_start
+        self.on_exit = on_exit
+        self.num_rows = num_rows
+        self.chunk_rows = chunk_rows
+        self.hits = 0
+        self.stalls = 0
+        self.stall_time = 0.
+        self._queue = queue.Queue(maxsize=max(depth-1, 1))
+        self._stop = threading.Event()
+        self._chunk = None
+        self._row = 0
+        self._thread = threading.Thread(target=self._run,
+                                        name='input-prefetch')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def _put(self, item):
+        # gives up when the consumer has stopped
+        while not self._stop.is_set():
+            try:
+                self._queue.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def _run(self):
+        started = False
+        try:
+            if self.on_start is not None:
+                self.on_start()
+            started = True
+            for start in range(0, self.num_rows, self.chunk_rows):
+                end = min(start + self.chunk_rows, self.num_rows)
+                chunk = np.ascontiguousarray(self.read_chunk(start, end))
+                if not self._put(chunk):
+                    return
+        except Exception as e:
+            # reported to the consumer on its next request
+            self._put(e)
+        finally:
+            if started and self.on_exit is not None:
+                self.on_exit()
+
+    def _next_chunk(self):
+        try:
+            chunk = self._queue.get_nowait()
+            self.hits += 1
+        except queue.Empty:
+            start = time.time()
+            chunk = self._queue.get()
+            self.stall_time += time.time() - start
+            self.stalls += 1
+        if isinstance(chunk, Exception):
+            raise chunk
+        return chunk
+
+    def next_row(self):
+        if self._chunk is None or self._row == len(self._chunk):
+            self._chunk = self._next_chunk()
+            self._row = 0
+        row = self._chunk[self._row]
+        self._row += 1
+        return row
+
+    def stats(self):
+        return {'hits': self.hits, 'stalls': self.stalls,
+                'stall_time': self.stall_time}
+
+    def close(self):
+        self._stop.set()
+        self._thread.join()
+
+
+class RetinaFileInputProcessor(BaseInputProcessor):
+    '''
+        Provides photoreceptor inputs from file
+        `<input_file><eye index><file_suffix>.h5` written by gen_input.
+
+        --
+        config: configuration dictionary like object
+        retina: retina array object
+        index: identifier of eye
+    '''
+    def __init__(self, config, retina, index=0):
+        input_filename = config['Retina']['input_file']
+        suffix = config['General']['file_suffix']
+        self.input_file = naming.data_file(input_filename, index, suffix)
+        self.chunk_steps = config['Retina']['read_chunk']
+
+        uids = get_photoreceptor_uids(retina)
+        super(RetinaFileInputProcessor, self).__init__(
+            [('photon', uids)], mode=0)
+
+        self.h5file = None
+        self.prefetcher = None
+        self.num_steps = 0
+        self.pointer = 0
+
+    def pre_run(self):
+        self.h5file = h5py.File(self.input_file, 'r')
+        dataset = self.h5file['array']
+        self.num_steps = dataset.shape[0]
+        self.prefetcher = ChunkPrefetcher(
+            lambda start, end: dataset[start:end], self.num_steps,
+            self.chunk_steps)
+
+    def is_input_available(self):
+        return self.pointer < self.num_steps
+
+    def update_input(self):
+        self.variables['photon']['input'] = self.prefetcher.next_row()
+        self.pointer += 1
+
+    def post_run(self):
+        stats = self.prefetcher.stats()
+        print('Input prefetch: {hits} hits, {stalls} stalls, '
+              '{stall_time:.3f}s waiting'.format(**stats))
+        self.prefetcher.close()
+        self.h5file.close()
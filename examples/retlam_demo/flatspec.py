@@ -0,0 +1,419 @@
+'''
+    Flat serialization of LPU specifications.
+
+    The components (comp_dict), connections (conns) and Patterns given to
+    the Manager are pickled when they are sent to the MPI ranks of LPUs.
+    Pickling them as nested Python and pandas objects is slow, needs a
+    lot of memory and, at large ring counts, a raised recursion limit.
+    This module converts them to a few flat NumPy arrays instead: numeric
+    attributes of one type become columns of their dtype, strings become
+    a table of distinct values and an array of indices into it, and other
+    attributes (mixed types, arrays, dictionaries) are pickled as one
+    value per column. Depending on [Transfer] mode
+
+        buffer: the arrays are pickled as contiguous buffers
+        mmap: the arrays are written as .npy files to [Transfer] directory
+            and ranks memory-map them, only the path is pickled
+        pickle: objects are pickled as they are (with a raised
+            recursion limit)
+
+    Numeric attributes are unpacked as arrays, in mmap mode as arrays
+    mapped from the files; strings and other attributes are unpacked
+    into lists.
+
+    Components and connections are wrapped with `pack` and Patterns with
+    `pack_pattern`, which keep them usable as the original objects; other
+    objects are pickled as usual.
+'''
+from __future__ import division
+
+import hashlib
+import json
+import numbers
+import os
+import resource
+import sys
+import time
+
+try:
+    import cPickle as pickle
+except ImportError:
+    import pickle
+
+import numpy as np
+
+import tracing as tr
+
+# needed to pickle nested objects when mode is 'pickle'
+RECURSION_LIMIT = 80000
+META_FILE = 'meta.json'
+
+_string_types = (str, type(u''))
+_stats = {'objects': 0, 'bytes': 0, 'seconds': 0.}
+_mode = {'mode': 'buffer', 'directory': '.retlam_specs'}
+
+
+# columns
+
+def _number_array(values):
+    # array of numbers of a single type, None for other values
+    types = set(type(v) for v in values)
+    if len(types) > 1 or not all(issubclass(t, numbers.Number)
+                                 for t in types):
+        return None
+    array = np.asarray(values)
+    return array if array.dtype.kind in 'biufc' else None
+
+
+def _encode_column(values, name, arrays, columns):
+    # numbers as arrays, strings as table and indices, other values pickled
+    # dtype of pandas columns and index levels, None for lists
+    dtype = getattr(values, 'dtype', None)
+    values = list(values)
+    array = _number_array(values)
+    if array is not None:
+        arrays[name] = array
+        kind = 'number'
+    elif all(isinstance(v, _string_types) for v in values):
+        table, codes = np.unique(np.array(values, dtype=str),
+                                 return_inverse=True)
+        arrays[name + '/table'] = table
+        arrays[name + '/codes'] = codes.astype(np.int32)
+        kind = 'string'
+    else:
+        arrays[name + '/pickle'] = np.frombuffer(
+            pickle.dumps(values, protocol=pickle.HIGHEST_PROTOCOL),
+            dtype=np.uint8)
+        kind = 'pickle'
+    columns[name] = {'kind': kind,
+                     'dtype': None if dtype is None else str(dtype)}
+
+
+def _decode_column(name, column, arrays):
+    kind, dtype = column['kind'], column['dtype']
+    if kind == 'number':
+        values = arrays[name]
+    elif kind == 'string':
+        values = arrays[name + '/table'][arrays[name + '/codes']].tolist()
+    else:
+        values = pickle.loads(arrays[name + '/pickle'].tobytes())
+    if dtype == 'object':
+        # e.g. ports of a Pattern, numbers stay Python objects
+        objects = np.empty(len(values), dtype=object)
+        for i, value in enumerate(values):
+            objects[i] = value.item() if kind == 'number' else value
+        return objects
+    if dtype is not None and kind == 'number':
+        return values.astype(dtype, copy=False)
+    return values
+
+
+# components and connections
+
+def flatten_components(comp_dict):
+    '''
+        comp_dict (model -> attribute -> values) to (arrays, meta)
+    '''
+    arrays, meta = {}, {'models': []}
+    for m, (model, attrs) in enumerate(sorted(comp_dict.items())):
+        columns = {}
+        for attr, values in attrs.items():
+            _encode_column(values, 'c{}/{}'.format(m, attr), arrays, columns)
+        meta['models'].append({'name': model, 'columns': columns})
+    return arrays, meta
+
+
+def unflatten_components(arrays, meta):
+    comp_dict = {}
+    for m, model in enumerate(meta['models']):
+        prefix = 'c{}/'.format(m)
+        comp_dict[model['name']] = dict(
+            (name[len(prefix):], _decode_column(name, column, arrays))
+            for name, column in model['columns'].items())
+    return comp_dict
+
+
+def flatten_connections(conns):
+    '''
+        conns (sequences of pre, post and optionally a dictionary of
+        attributes) to (arrays, meta)
+    '''
+    arrays, columns = {}, {}
+    _encode_column([c[0] for c in conns], 'pre', arrays, columns)
+    _encode_column([c[1] for c in conns], 'post', arrays, columns)
+    keys = sorted(set(k for c in conns if len(c) > 2 for k in c[2]))
+    for key in keys:
+        present = np.array([len(c) > 2 and key in c[2] for c in conns])
+        arrays['present/' + key] = present
+        _encode_column([c[2][key] for c in conns
+                        if len(c) > 2 and key in c[2]],
+                       'a/' + key, arrays, columns)
+    meta = {'columns': columns, 'keys': keys,
+            'with_attrs': bool(conns) and len(conns[0]) > 2,
+            'tuples': bool(conns) and isinstance(conns[0], tuple)}
+    return arrays, meta
+
+
+def unflatten_connections(arrays, meta):
+    columns = meta['columns']
+    pre = _decode_column('pre', columns['pre'], arrays)
+    post = _decode_column('post', columns['post'], arrays)
+    if not meta['with_attrs']:
+        conns = [[a, b] for a, b in zip(pre, post)]
+    else:
+        attrs = [{} for _ in pre]
+        for key in meta['keys']:
+            rows = np.flatnonzero(arrays['present/' + key])
+            for row, value in zip(rows, _decode_column(
+                    'a/' + key, columns['a/' + key], arrays)):
+                attrs[row][key] = value
+        conns = [[a, b, d] for a, b, d in zip(pre, post, attrs)]
+    return [tuple(c) for c in conns] if meta['tuples'] else conns
+
+
+# patterns
+
+def flatten_pattern(pattern):
+    '''
+        Pattern to (arrays, meta): interface ports as index levels and
+        columns, connections as row indices of their ports
+    '''
+    df_int = pattern.interface.data
+    df_pat = pattern.data
+    arrays, columns = {}, {}
+    levels = df_int.index.nlevels
+    for level in range(levels):
+        _encode_column(df_int.index.get_level_values(level),
+                       'l{}'.format(level), arrays, columns)
+    for column in df_int.columns:
+        _encode_column(df_int[column], 'i/' + str(column), arrays, columns)
+    rows = dict((port, i) for i, port in enumerate(df_int.index))
+
+    def row(port):
+        return rows[port[0] if levels == 1 else tuple(port)]
+    arrays['from'] = np.array([row(p[:levels]) for p in df_pat.index],
+                              dtype=np.int64)
+    arrays['to'] = np.array([row(p[levels:]) for p in df_pat.index],
+                            dtype=np.int64)
+    for column in df_pat.columns:
+        _encode_column(df_pat[column], 'p/' + str(column), arrays, columns)
+    meta = {'columns': columns, 'levels': levels,
+            'interface_columns': [str(c) for c in df_int.columns],
+            'pattern_columns': [str(c) for c in df_pat.columns],
+            'index_names': list(df_int.index.names),
+            'pattern_index_names': list(df_pat.index.names)}
+    return arrays, meta
+
+
+def unflatten_pattern(arrays, meta):
+    import pandas as pd
+    from neurokernel.pattern import Pattern
+
+    columns = meta['columns']
+    levels = [_decode_column('l{}'.format(l), columns['l{}'.format(l)],
+                             arrays) for l in range(meta['levels'])]
+    index = pd.MultiIndex.from_arrays(levels, names=meta['index_names'])
+    df_int = pd.DataFrame(
+        dict((c, _decode_column('i/' + c, columns['i/' + c], arrays))
+             for c in meta['interface_columns']),
+        index=index, columns=meta['interface_columns'])
+
+    from_rows, to_rows = arrays['from'], arrays['to']
+    pattern_levels = [[level[r] for r in from_rows] for level in levels] + \
+        [[level[r] for r in to_rows] for level in levels]
+    pattern_index = pd.MultiIndex.from_arrays(
+        pattern_levels, names=meta['pattern_index_names'])
+    df_pat = pd.DataFrame(
+        dict((c, _decode_column('p/' + c, columns['p/' + c], arrays))
+             for c in meta['pattern_columns']),
+        index=pattern_index, columns=meta['pattern_columns'])
+    return Pattern.from_df(df_int, df_pat)
+
+
+# storage
+
+def write_arrays(directory, arrays, meta):
+    '''
+        Writes `arrays` as .npy files and `meta` to `directory`
+    '''
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+    names = {}
+    for i, (name, array) in enumerate(sorted(arrays.items())):
+        names[name] = '{}.npy'.format(i)
+        np.save(os.path.join(directory, names[name]), array)
+    with open(os.path.join(directory, META_FILE), 'w') as f:
+        json.dump({'meta': meta, 'files': names}, f)
+
+
+def read_arrays(directory):
+    '''
+        Memory-maps the arrays written by `write_arrays`
+    '''
+    with open(os.path.join(directory, META_FILE)) as f:
+        stored = json.load(f)
+    arrays = dict((name, np.load(os.path.join(directory, filename),
+                                 mmap_mode='r'))
+                  for name, filename in stored['files'].items())
+    return arrays, stored['meta']
+
+
+# transfer
+
+def _record(arrays, seconds):
+    _stats['objects'] += 1
+    _stats['bytes'] += sum(a.nbytes for a in arrays.values())
+    _stats['seconds'] += seconds
+
+
+def _digest(arrays):
+    sha = hashlib.sha1()
+    for name, array in sorted(arrays.items()):
+        sha.update(name.encode('utf-8'))
+        sha.update(np.ascontiguousarray(array).tobytes())
+    return sha.hexdigest()
+
+
+def _flat_state(kind, flatten, obj, name=None):
+    # arrays for buffer mode, a directory for mmap mode
+    start = time.time()
+    with tr.span('flattening', kind=kind):
+        arrays, meta = flatten(obj)
+        if _mode['mode'] == 'mmap':
+            key = name or _digest(arrays)
+            directory = os.path.join(_mode['directory'],
+                                     '{}_{}'.format(kind, key))
+            write_arrays(directory, arrays, meta)
+            state = ('mmap', directory)
+        else:
+            state = ('buffer', (arrays, meta))
+    _record(arrays, time.time() - start)
+    return state
+
+
+def _load(kind, state):
+    mode, data = state
+    with tr.span('unflattening', kind=kind):
+        arrays, meta = read_arrays(data) if mode == 'mmap' else data
+        return UNFLATTEN[kind](arrays, meta)
+
+
+def load_components(state):
+    return _load('components', state)
+
+
+def load_connections(state):
+    return _load('connections', state)
+
+
+def load_pattern(state):
+    return _load('pattern', state)
+
+
+UNFLATTEN = {'components': unflatten_components,
+             'connections': unflatten_connections,
+             'pattern': unflatten_pattern}
+
+
+class FlatComponents(dict):
+    '''
+        comp_dict that is pickled as flat arrays
+    '''
+    name = None
+
+    def __reduce__(self):
+        return (load_components,
+                (_flat_state('components', flatten_components, dict(self),
+                             self.name),))
+
+
+class FlatConnections(list):
+    '''
+        conns that are pickled as flat arrays
+    '''
+    name = None
+
+    def __reduce__(self):
+        return (load_connections,
+                (_flat_state('connections', flatten_connections, list(self),
+                             self.name),))
+
+
+class _FlatPattern(object):
+    # mixed into the class of a Pattern by `pack_pattern`
+    name = None
+
+    def __reduce__(self):
+        return (load_pattern, (_flat_state('pattern', flatten_pattern, self,
+                                           self.name),))
+
+
+_flat_pattern_classes = {}
+
+
+def _flat_pattern_class(cls):
+    if cls not in _flat_pattern_classes:
+        _flat_pattern_classes[cls] = type('Flat' + cls.__name__,
+                                          (_FlatPattern, cls), {})
+    return _flat_pattern_classes[cls]
+
+
+def setup_transfer(config):
+    '''
+        Sets how LPU specifications are sent to ranks according
+        to [Transfer], call before LPUs are added
+    '''
+    _mode['mode'] = config['Transfer']['mode']
+    _mode['directory'] = config['Transfer']['directory']
+    if _mode['mode'] == 'pickle':
+        # default limit is low for pickling
+        # the data structures passed through mpi
+        sys.setrecursionlimit(RECURSION_LIMIT)
+        resource.setrlimit(resource.RLIMIT_STACK,
+                           (resource.RLIM_INFINITY, resource.RLIM_INFINITY))
+
+
+def pack(config, lpu_id, comp_dict, conns):
+    '''
+        Components and connections of LPU `lpu_id` to be pickled
+        as flat arrays, unchanged in 'pickle' mode
+    '''
+    if _mode['mode'] == 'pickle':
+        return comp_dict, conns
+    comp_dict = FlatComponents(comp_dict)
+    conns = FlatConnections(conns)
+    # files of runs with different suffixes do not overwrite each other
+    comp_dict.name = conns.name = '{}{}'.format(
+        lpu_id, config['General']['file_suffix'])
+    return comp_dict, conns
+
+
+def pack_pattern(config, name, pattern):
+    '''
+        Pattern `name` (e.g. 'retina0_lamina0') to be pickled as
+        flat arrays, unchanged in 'pickle' mode. The packed pattern
+        shares the data of `pattern`, which is pickled as usual.
+    '''
+    if _mode['mode'] == 'pickle':
+        return pattern
+    cls = type(pattern)
+    if not issubclass(cls, _FlatPattern):
+        cls = _flat_pattern_class(cls)
+    packed = cls.__new__(cls)
+    packed.__dict__.update(pattern.__dict__)
+    packed.name = '{}{}'.format(name, config['General']['file_suffix'])
+    return packed
+
+
+def report():
+    '''
+        Prints the size and time of flattened specifications
+        and starts counting them again for the next run
+    '''
+    if _stats['objects'] == 0:
+        return
+    print('Transferred {} LPU specifications as flat arrays ({}): '
+          '{:.1f} MB, {:.2f}s to flatten'.format(
+              _stats['objects'], _mode['mode'], _stats['bytes']/2**20,
+              _stats['seconds']))
+    _stats.update(objects=0, bytes=0, seconds=0.)
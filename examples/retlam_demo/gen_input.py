@@ -1,10 +1,12 @@
 from __future__ import division
 
 import atexit
+import collections
+import multiprocessing
 import os
 
+import h5py
 import numpy as np
-import pycuda.driver as cuda
 
 import neurokernel.LPU.utils.simpleio as sio
 
@@ -13,97 +15,374 @@ import retina.geometry.hexagon as hx
 import retina.classmapper as cls_map
 from retina.screen.map.mapimpl import AlbersProjectionMap
 
+import conncache as cc
+import naming
+import tracing as tr
+from sparse_rf import SparseReceptiveFields
 
-def gen_input(config):
+# default rows per chunk of written arrays
+STEPS_BATCH = 100
+# batches held at once during input generation: one being generated,
+# the others being filtered or waiting to be written
+BATCHES_IN_FLIGHT = 8
+# bytes per value of screen intensities and of inputs
+VALUE_SIZE = np.dtype(np.double).itemsize
+
+
+class ArrayWriter(object):
+    '''
+        Writes an array of known length to the '/array' dataset of an
+        HDF5 file (the layout of simpleio.write_array) a few rows at a
+        time. The dataset is chunked along the first dimension and is
+        allocated on the first write, when the row shape and type are
+        known, and the file stays open until `close`.
+
+        --
+        filename: output file name
+        rows: total number of rows that will be written
+        chunk_rows: rows per chunk
+        complevel: gzip compression level or None
+    '''
+    def __init__(self, filename, rows, chunk_rows=STEPS_BATCH,
+                 complevel=None):
+        self.rows = rows
+        self.chunk_rows = max(1, min(chunk_rows, rows))
+        self.complevel = complevel
+        self.pointer = 0
+        self.h5file = h5py.File(filename, 'w')
+        self.dataset = None
+
+    def write(self, data, start=None):
+        '''
+            Writes `data` at row `start` or after the last written row
+        '''
+        if start is None:
+            start = self.pointer
+        if len(data) == 0:
+            return
+        if self.dataset is None:
+            kwargs = {}
+            if self.complevel is not None:
+                kwargs = {'compression': 'gzip',
+                          'compression_opts': self.complevel}
+            self.dataset = self.h5file.create_dataset(
+                'array', (self.rows,) + data.shape[1:], dtype=data.dtype,
+                chunks=(self.chunk_rows,) + data.shape[1:], **kwargs)
+        end = start + len(data)
+        self.dataset[start:end] = data
+        self.pointer = end
+
+    def close(self):
+        self.h5file.close()
+
+
+_cuda_context = None
+
+
+def _init_cuda():
+    # once per process, input generation and prewarming share it
+    global _cuda_context
+    if _cuda_context is not None:
+        return
+    import pycuda.driver as cuda
     cuda.init()
-    ctx = cuda.Device(0).make_context()
-    atexit.register(ctx.pop)
+    _cuda_context = cuda.Device(0).make_context()
+    atexit.register(_cuda_context.pop)
+
+
+def get_batch_steps(config, num_pixels, num_photoreceptors):
+    '''
+        Number of steps per batch such that BATCHES_IN_FLIGHT batches
+        fit in the configured memory budget. It does not depend on the
+        number of workers, so neither do the written inputs.
+    '''
+    budget = config['Retina']['input_memory']*2**20
+    step_size = VALUE_SIZE*(num_pixels + num_photoreceptors)
+    return max(1, int(budget // (step_size*BATCHES_IN_FLIGHT)))
+
+
+_worker_rfs = None
 
-    suffix = config['General']['file_suffix']
 
+def _init_filter_worker(rfs):
+    global _worker_rfs
+    _worker_rfs = rfs
+
+
+def _filter_batch(start, im):
+    return start, _worker_rfs.filter(im)
+
+
+def filter_batches(rfs, batches, workers=1):
+    '''
+        Applies receptive fields `rfs` to batches of screen intensities.
+
+        Parameters
+        ----------
+        rfs: receptive field object
+        batches: iterable of (start step, screen intensities) pairs
+        workers: number of processes, with 1 batches are filtered in
+            the calling process
+
+        Returns
+        -------
+        generator of (start step, photoreceptor inputs) pairs in the
+        order of `batches`. Filtering is deterministic per batch so the
+        result does not depend on the number of workers.
+    '''
+    if workers <= 1:
+        for start, im in batches:
+            yield start, rfs.filter(im)
+        return
+
+    pool = multiprocessing.Pool(workers, initializer=_init_filter_worker,
+                                initargs=(rfs,))
+    # two per worker, one being filtered and one waiting, within the
+    # batches in flight; the next one is being generated
+    max_pending = min(2*workers, BATCHES_IN_FLIGHT - 1)
+    try:
+        pending = collections.deque()
+        for start, im in batches:
+            pending.append(pool.apply_async(_filter_batch, (start, im)))
+            # bounds the number of batches held in memory
+            while len(pending) >= max_pending:
+                yield pending.popleft().get()
+        while pending:
+            yield pending.popleft().get()
+        pool.close()
+    finally:
+        pool.terminate()
+        pool.join()
+
+
+def _screen_batches(screen, steps, batch_steps, screen_writer,
+                    screen_write_step):
+    '''
+        Generates screen intensities batch by batch and stores
+        every `screen_write_step`th frame
+    '''
+    step = 0
+    while step < steps:
+        steps_batch = min(batch_steps, steps - step)
+        im = screen.get_screen_intensity_steps(steps_batch)
+        # first frame in batch whose global index is a multiple
+        # of screen_write_step
+        first = (-step) % screen_write_step
+        screen_writer.write(im[first::screen_write_step],
+                            start=(step + first) // screen_write_step)
+        yield step, im
+        step += steps_batch
+
+
+class EyeFilters(object):
+    '''
+        Receptive fields of several eyes applied to the same screen,
+        `filter` returns the list of inputs of each eye
+    '''
+    def __init__(self, rfs_list):
+        self.rfs_list = rfs_list
+
+    def filter(self, im):
+        return [rfs.filter(im) for rfs in self.rfs_list]
+
+
+def get_eulerangles(config, index=0):
+    '''
+        Euler angles of eye `index`, 3 consecutive values of
+        [Retina] eulerangles
+    '''
+    eulerangles = config['Retina']['eulerangles']
     eye_num = config['General']['eye_num']
+    if len(eulerangles) < 3*eye_num:
+        raise ValueError('{} eyes need {} euler angles, got {}'.format(
+            eye_num, 3*eye_num, len(eulerangles)))
+    return eulerangles[3*index:3*(index+1)]
+
+
+def _link(source, target):
+    if os.path.lexists(target):
+        os.remove(target)
+    os.symlink(os.path.basename(source), target)
 
-    rings = config['Retina']['rings']
-    steps = config['General']['steps']
 
+def gen_input(config):
+    '''
+        Writes input, screen and coordinate files of all eyes. The
+        screen is generated once per batch of steps and filtered
+        through the receptive fields of each eye, since all eyes see
+        the same world.
+    '''
+    filtermethod = config['Retina']['filtermethod']
+    workers = config['Retina']['input_workers']
+    if filtermethod == 'gpu':
+        if workers > 1:
+            print('Parallel input generation needs nogpu filter method, '
+                  'using a single process')
+            workers = 1
+        _init_cuda()
+
+    eye_num = config['General']['eye_num']
+    suffix = config['General']['file_suffix']
+    steps = config['General']['steps']
     input_filename = config['Retina']['input_file']
-    
     screen_write_step = config['Retina']['screen_write_step']
-    config['Retina']['screen_write_step'] = 1
-    
+
     screen_type = config['Retina']['screentype']
     screen_cls = cls_map.get_screen_cls(screen_type)
-    eulerangles = config['Retina']['eulerangles']
-    radius = config['Retina']['radius']
 
-    for i in range(eye_num):
-        screen = screen_cls(config)
-        screen_file = 'intensities_tmp{}.h5'.format(i)
-        screen.setup_file(screen_file)
-    
-        retina_elev_file = 'retina_elev{}.h5'.format(i)
-        retina_azim_file = 'retina_azim{}.h5'.format(i)
+    cache = cc.ConnectivityCache.from_config(config)
 
-        screen_dima_file = 'grid_dima{}.h5'.format(i)
-        screen_dimb_file = 'grid_dimb{}.h5'.format(i)
+    screen = screen_cls(config)
+    screen_file = 'intensities{}{}.h5'.format(suffix, 0)
 
-        retina_dima_file = 'retina_dima{}.h5'.format(i)
-        retina_dimb_file = 'retina_dimb{}.h5'.format(i)
+    retinas, rfs_list = [], []
+    for i in range(eye_num):
+        with tr.span('eye geometry', eye=i):
+            with tr.span('retina array'):
+                retina = get_retina(config, i)
+            print('Acceptance angle: {}'.format(retina.acceptance_angle))
+            print('Neurons: {}'.format(retina.num_photoreceptors))
+            with tr.span('receptive fields'):
+                rfs = get_receptive_fields(config, retina, screen, i, cache)
+        retinas.append(retina)
+        rfs_list.append(rfs)
 
-        input_file = '{}{}{}.h5'.format(input_filename, i, suffix)
+    batch_steps = get_batch_steps(
+        config, screen.grid[0].size,
+        sum(r.num_photoreceptors for r in retinas))
 
-        transform = AlbersProjectionMap(radius,
-                                        eulerangles[3*i:3*(i+1)]).invmap
-        hexagon = hx.HexagonArray(num_rings=rings, radius=radius,
-                                  transform=transform)
-        retina = ret.RetinaArray(hexagon, config=config)
-        print('Acceptance angle: {}'.format(retina.acceptance_angle))
-        print('Neurons: {}'.format(retina.num_photoreceptors))
+    # screen intensities are generated in order, since the state of
+    # the stimulus carries over between steps, and subsampled while
+    # they are generated; batches are filtered by `workers` processes
+    # through the receptive fields of all eyes and written to their
+    # rows as they arrive
+    input_writers = [ArrayWriter(naming.data_file(input_filename, i, suffix),
+                                 steps)
+                     for i in range(eye_num)]
+    screen_writer = ArrayWriter(screen_file,
+                                (steps - 1) // screen_write_step + 1,
+                                chunk_rows=1, complevel=9)
+    try:
+        with tr.span('screen and filtering', steps=steps, eyes=eye_num,
+                     batch_steps=batch_steps, workers=workers):
+            batches = _screen_batches(screen, steps, batch_steps,
+                                      screen_writer, screen_write_step)
+            for start, eye_inputs in filter_batches(EyeFilters(rfs_list),
+                                                    batches, workers):
+                for writer, photor_inputs in zip(input_writers, eye_inputs):
+                    writer.write(photor_inputs, start=start)
+    finally:
+        for writer in input_writers:
+            writer.close()
+        screen_writer.close()
 
+    for i, (retina, rfs) in enumerate(zip(retinas, rfs_list)):
+        if i > 0:
+            _link(screen_file, 'intensities{}{}.h5'.format(suffix, i))
         elev_v, azim_v = retina.get_ommatidia_pos()
+        for data, filename in [(elev_v, 'retina_elev{}.h5'),
+                               (azim_v, 'retina_azim{}.h5'),
+                               (screen.grid[0], 'grid_dima{}.h5'),
+                               (screen.grid[1], 'grid_dimb{}.h5'),
+                               (rfs.refa, 'retina_dima{}.h5'),
+                               (rfs.refb, 'retina_dimb{}.h5')]:
+            sio.write_array(data, filename.format(i))
+
 
-        rfs = _get_receptive_fields(retina, screen, screen_type)
-        steps_count = steps
-        write_mode = 'w'
-        while (steps_count > 0):
-            steps_batch = min(100, steps_count)
-            im = screen.get_screen_intensity_steps(steps_batch)
-            photor_inputs = rfs.filter(im)
-            sio.write_array(photor_inputs, filename=input_file, mode=write_mode)
-            steps_count -= steps_batch
-            write_mode = 'a'
-        
-        tmp = sio.read_array(screen_file)
-        sio.write_array(tmp[::screen_write_step],
-                        'intensities{}{}.h5'.format(suffix, i),
-                        complevel = 9)
-        del tmp
-        os.remove(screen_file)
-
-        for data, filename in [(elev_v, retina_elev_file),
-                               (azim_v, retina_azim_file),
-                               (screen.grid[0], screen_dima_file),
-                               (screen.grid[1], screen_dimb_file),
-                               (rfs.refa, retina_dima_file),
-                               (rfs.refb, retina_dimb_file)]:
-            sio.write_array(data, filename)
-
-
-def _get_receptive_fields(retina, screen, screen_type):
+def get_retina(config, index=0):
+    '''
+        Retina array of eye `index`
+    '''
+    rings = config['Retina']['rings']
+    radius = config['Retina']['radius']
+
+    transform = AlbersProjectionMap(
+        radius, get_eulerangles(config, index)).invmap
+    hexagon = hx.HexagonArray(num_rings=rings, radius=radius,
+                              transform=transform)
+    return ret.RetinaArray(hexagon, config=config)
+
+
+def _get_rf_parameters(retina, screen, screen_type):
     mapdr_cls = cls_map.get_mapdr_cls(screen_type)
     projection_map = mapdr_cls.from_retina_screen(retina, screen)
 
     rf_params = projection_map.map(*retina.get_all_photoreceptors_dir())
     if np.isnan(np.sum(rf_params)):
         print('Warning, Nan entry in array of receptive field centers')
-    vrf_cls = cls_map.get_vrf_cls(screen_type)
-    rfs = vrf_cls(screen.grid)
-    rfs.load_parameters(refa=rf_params[0], refb=rf_params[1],
-                        acceptance_angle=retina.get_angle(),
-                        radius=screen.radius)
+    return {'refa': rf_params[0], 'refb': rf_params[1],
+            'acceptance_angle': retina.get_angle()}
+
+
+def get_receptive_fields(config, retina, screen, index=0, cache=None):
+    '''
+        Receptive fields of photoreceptors of eye `index` on `screen`
+        using the configured filter method. Receptive field centers
+        and acceptance angles, and the weights of the nogpu filter,
+        depend only on geometry and screen, so they are taken from
+        `cache` when they were computed before.
+
+        --
+        config: configuration dictionary like object
+        retina: retina array object of eye `index`
+        screen: screen object
+        index: identifier of eye
+        cache: connectivity cache object or None
+    '''
+    screen_type = config['Retina']['screentype']
+    filtermethod = config['Retina']['filtermethod']
+    if cache is None:
+        cache = cc.ConnectivityCache.from_config(config)
+
+    params = cache.get_or_build(
+        cache.key('rf', config, index),
+        lambda: _get_rf_parameters(retina, screen, screen_type))
+
+    if filtermethod == 'nogpu':
+        rfs = SparseReceptiveFields(screen.grid, screen_type)
+        weights_key = cache.key('rfweights', config, index)
+        weights = cache.get(weights_key)
+        rfs.load_parameters(radius=screen.radius, weights=weights, **params)
+        if weights is None:
+            cache.put(weights_key, rfs.weights)
+    else:
+        vrf_cls = cls_map.get_vrf_cls(screen_type)
+        rfs = vrf_cls(screen.grid)
+        rfs.load_parameters(radius=screen.radius, **params)
     return rfs
 
 
+def prewarm_receptive_fields(config, geometries):
+    '''
+        Computes and caches receptive fields of a list of geometries
+        so that later runs with any of them skip the projection.
+
+        --
+        config: configuration dictionary like object, used for all
+            values that are not in a geometry
+        geometries: list of dictionaries with values of [Retina]
+            section that override those of config e.g.
+            [{'rings': 14}, {'rings': 20, 'acceptance_factor': 1.5}]
+    '''
+    cache = cc.ConnectivityCache.from_config(config)
+    if not cache.enabled:
+        raise ValueError('Prewarming receptive fields needs a cache, '
+                         'set enabled = true in [Cache]')
+    if config['Retina']['filtermethod'] == 'gpu':
+        _init_cuda()
+    screen_cls = cls_map.get_screen_cls(config['Retina']['screentype'])
+    for geometry in geometries:
+        previous = dict((k, config['Retina'][k]) for k in geometry)
+        config['Retina'].update(geometry)
+        try:
+            screen = screen_cls(config)
+            for i in range(config['General']['eye_num']):
+                retina = get_retina(config, i)
+                get_receptive_fields(config, retina, screen, i, cache)
+        finally:
+            config['Retina'].update(previous)
+
+
 def main():
     # TODO read configuration and call function
     # for input generation
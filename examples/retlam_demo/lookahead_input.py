@@ -0,0 +1,84 @@
+'''
+    Input processor that generates retina inputs ahead of the simulation.
+
+    A background thread advances the screen and filters it through the
+    receptive fields of photoreceptors, keeping a bounded buffer of
+    upcoming inputs filled, so that a simulation step only copies its
+    input instead of computing the stimulus.
+'''
+import numpy as np
+
+import retina.classmapper as cls_map
+from neurokernel.LPU.InputProcessors.BaseInputProcessor import \
+    BaseInputProcessor
+
+import gen_input as gi
+from file_input import ChunkPrefetcher, get_photoreceptor_uids
+
+
+class LookaheadRetinaInputProcessor(BaseInputProcessor):
+    '''
+        Provides photoreceptor inputs generated up to `lookahead` steps
+        ahead of the simulation ([Retina] lookahead).
+
+        --
+        config: configuration dictionary like object
+        retina: retina array object
+        index: identifier of eye
+    '''
+    def __init__(self, config, retina, index=0):
+        self.config = config
+        self.retina = retina
+        self.index = index
+        self.steps = config['General']['steps']
+        self.lookahead = config['Retina']['lookahead']
+        # producer works in batches, a few of them fill the buffer
+        self.batch_steps = max(1, min(self.lookahead // 4, gi.STEPS_BATCH))
+
+        uids = get_photoreceptor_uids(retina)
+        super(LookaheadRetinaInputProcessor, self).__init__(
+            [('photon', uids)], mode=0)
+
+        self.producer = None
+        self.pointer = 0
+
+    def pre_run(self):
+        config = self.config
+        screen_cls = cls_map.get_screen_cls(config['Retina']['screentype'])
+        self.screen = screen_cls(config)
+        self.rfs = gi.get_receptive_fields(config, self.retina, self.screen,
+                                           self.index)
+
+        on_start = on_exit = None
+        if config['Retina']['filtermethod'] == 'gpu':
+            # the producer thread filters in the context of the LPU
+            import pycuda.driver as cuda
+            context = cuda.Context.get_current()
+            on_start = context.push
+            on_exit = cuda.Context.pop
+
+        depth = max(2, -(-self.lookahead // self.batch_steps))
+        self.producer = ChunkPrefetcher(self._produce, self.steps,
+                                        self.batch_steps, depth=depth,
+                                        on_start=on_start, on_exit=on_exit)
+
+    def _produce(self, start, end):
+        im = self.screen.get_screen_intensity_steps(end - start)
+        # filters may return the same output buffer on every call,
+        # batches in the buffer of the prefetcher need their own copy
+        return np.array(self.rfs.filter(im))
+
+    def is_input_available(self):
+        return self.pointer < self.steps
+
+    def update_input(self):
+        self.variables['photon']['input'] = self.producer.next_row()
+        self.pointer += 1
+
+    def post_run(self):
+        stats = self.producer.stats()
+        batches = stats['hits'] + stats['stalls']
+        print('Input look-ahead: waited on producer for {} of {} batches, '
+              '{:.3f}s in total'.format(stats['stalls'], batches,
+                                        stats['stall_time']))
+        self.producer.close()
@@ -0,0 +1,70 @@
+'''
+    Names shared by the demos and the modules that read their files.
+
+    Neurons of the retina and lamina packages have uids
+    '<prefix>_<name>_<element>' (e.g. 'ret_R1_12' is photoreceptor R1 of
+    ommatidium 12), neurons that belong to no element, such as amacrine
+    cells, end without an element. Input files of the retina have the
+    photoreceptor columns of each ommatidium in order R1-R6.
+'''
+
+PHOTOR_NAMES = ['R{}'.format(i+1) for i in range(6)]
+RETINA_PREFIX = 'ret'
+
+
+def retina_id(index):
+    return 'retina{}'.format(index)
+
+
+def lamina_id(index):
+    return 'lamina{}'.format(index)
+
+
+def pattern_id(index):
+    '''
+        Base name of the exported pattern between retina and lamina
+        of eye `index`, e.g. 'retina0_lamina0'
+    '''
+    return '{}_{}'.format(retina_id(index), lamina_id(index))
+
+
+def photoreceptor_uids(elements, names=PHOTOR_NAMES):
+    '''
+        uids of photoreceptors `names` of ommatidia `elements` (a number
+        of ommatidia or a sequence of them) in the order of columns of
+        input files
+    '''
+    if isinstance(elements, int):
+        elements = range(elements)
+    return ['{}_{}_{}'.format(RETINA_PREFIX, name, i) for i in elements
+            for name in names]
+
+
+def parse_uid(uid):
+    '''
+        (name, element) of a neuron uid e.g. 'ret_R1_12' -> ('R1', 12),
+        element is -1 for neurons that belong to no element
+    '''
+    if isinstance(uid, bytes):
+        uid = uid.decode()
+    parts = str(uid).split('_')
+    if len(parts) > 1 and parts[-1].isdigit():
+        return parts[-2], int(parts[-1])
+    return parts[-1], -1
+
+
+def uid_element(uid):
+    '''
+        Element of a neuron uid, -1 for neurons that belong to no element
+    '''
+    return parse_uid(uid)[1]
+
+
+def data_file(base, index=0, suffix='', worker=None):
+    '''
+        Name of an input or output file of eye `index` of a run with
+        file suffix `suffix`, e.g. 'retina_output0__1.h5', or of worker
+        `worker` of an LPU that is split among workers
+    '''
+    worker = '' if worker is None else '_{}'.format(worker)
+    return '{}{}{}{}.h5'.format(base, index, worker, suffix)
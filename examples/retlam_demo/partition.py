@@ -0,0 +1,571 @@
+'''
+    Cost-aware spatial partition of a hexagonal array of elements.
+
+    Elements (ommatidia or cartridges) are weighted by the cost of their
+    neurons, dominated by the number of microvilli of photoreceptors, and
+    split into compact regions of similar load by recursive bisection of
+    their positions on the eye. A refinement pass then moves boundary
+    elements to the neighboring region they are most connected to, as
+    long as loads stay within the tolerance of the mean and no region
+    is left empty, to shorten the boundaries between regions.
+
+    RetinaPartition applies such a partition to the photoreceptors of the
+    multiworker retina: each worker gets the part of the single worker
+    graph of the retina package that belongs to its ommatidia, and the
+    matching part of the master-worker pattern. LaminaPartition splits
+    the lamina into workers of contiguous cartridges that exchange the
+    outputs of neurons connected across workers through halo ports.
+'''
+from __future__ import division
+
+import collections
+import importlib
+import json
+import re
+
+import networkx as nx
+import numpy as np
+import pandas as pd
+from scipy.spatial import cKDTree
+
+from neurokernel.pattern import Pattern
+
+# neighbors are closer than this many times the typical
+# distance between neighboring elements
+NEIGHBOR_FACTOR = 1.5
+REFINE_PASSES = 10
+
+_ELEMENT_RE = re.compile(r'_(\d+)$')
+
+# neurons that belong to no cartridge
+AMACRINE_NAMES = ['Am']
+
+
+def element_points(elev, azim):
+    '''
+        Unit vectors of elements at elevation `elev` and azimuth `azim`
+    '''
+    elev = np.asarray(elev, dtype=np.double)
+    azim = np.asarray(azim, dtype=np.double)
+    return np.column_stack([np.cos(elev)*np.cos(azim),
+                            np.cos(elev)*np.sin(azim),
+                            np.sin(elev)])
+
+
+def hex_edges(points):
+    '''
+        Array of (i, j), i < j, of neighboring elements of a hexagonal
+        array with positions `points`
+    '''
+    if len(points) < 2:
+        return np.zeros((0, 2), dtype=np.int64)
+    tree = cKDTree(points)
+    k = min(7, len(points))
+    dist, idx = tree.query(points, k=k)
+    spacing = np.median(dist[:, 1])
+    pairs = set()
+    for i in range(len(points)):
+        for d, j in zip(dist[i, 1:], idx[i, 1:]):
+            if d <= NEIGHBOR_FACTOR*spacing:
+                pairs.add((min(i, j), max(i, j)))
+    return np.array(sorted(pairs), dtype=np.int64).reshape(-1, 2)
+
+
+def _bisect(elements, points, weights, parts):
+    if parts == 1:
+        return [elements]
+    left_parts = parts // 2
+    coords = points[elements]
+    axis = np.argmax(coords.max(axis=0) - coords.min(axis=0))
+    order = elements[np.argsort(coords[:, axis], kind='mergesort')]
+    cumulative = np.cumsum(weights[order])
+    target = cumulative[-1]*left_parts/parts
+    split = int(np.searchsorted(cumulative, target))
+    # the side of the target with the smaller error
+    if split > 0 and target - cumulative[split-1] < cumulative[split] - target:
+        split -= 1
+    split = min(max(split + 1, left_parts), len(order) - (parts - left_parts))
+    return (_bisect(order[:split], points, weights, left_parts) +
+            _bisect(order[split:], points, weights, parts - left_parts))
+
+
+def _refine(assignment, edges, weights, parts, tolerance):
+    loads = np.bincount(assignment, weights=weights, minlength=parts)
+    sizes = np.bincount(assignment, minlength=parts)
+    mean = loads.sum()/parts
+    upper, lower = mean*(1 + tolerance), mean*(1 - tolerance)
+    neighbors = [[] for _ in range(len(assignment))]
+    for i, j in edges:
+        neighbors[i].append(j)
+        neighbors[j].append(i)
+    for _ in range(REFINE_PASSES):
+        moved = 0
+        for e in range(len(assignment)):
+            own = assignment[e]
+            counts = np.bincount(assignment[neighbors[e]], minlength=parts)
+            target = np.argmax(counts)
+            if target == own or counts[target] <= counts[own]:
+                continue
+            if loads[target] + weights[e] > upper:
+                continue
+            # regions keep at least one element and their lower bound
+            if sizes[own] == 1 or loads[own] - weights[e] < lower:
+                continue
+            loads[own] -= weights[e]
+            loads[target] += weights[e]
+            sizes[own] -= 1
+            sizes[target] += 1
+            assignment[e] = target
+            moved += 1
+        if moved == 0:
+            break
+    return assignment
+
+
+def partition_elements(points, weights, parts, edges=None, tolerance=0.05):
+    '''
+        Assigns elements to `parts` compact regions of similar load
+
+        --
+        points: positions of elements
+        weights: cost of each element
+        parts: number of regions
+        edges: neighboring elements (see `hex_edges`), None to compute
+            them from `points`
+        tolerance: allowed deviation of the load of a region from
+            the mean by the refinement, which also keeps every region
+            non-empty
+
+        returns: array with the region of each element
+    '''
+    points = np.asarray(points, dtype=np.double)
+    weights = np.asarray(weights, dtype=np.double)
+    if parts > len(points):
+        raise ValueError('Cannot split {} elements into {} parts'.format(
+            len(points), parts))
+    if edges is None:
+        edges = hex_edges(points)
+    assignment = np.empty(len(points), dtype=np.int64)
+    for part, elements in enumerate(_bisect(np.arange(len(points)), points,
+                                            weights, parts)):
+        assignment[elements] = part
+    return _refine(assignment, edges, weights, parts, tolerance)
+
+
+def cut_edges(edges, assignment):
+    '''
+        Number of neighboring elements in different regions
+    '''
+    if len(edges) == 0:
+        return 0
+    return int(np.sum(assignment[edges[:, 0]] != assignment[edges[:, 1]]))
+
+
+def node_elements(G):
+    '''
+        Element of each node of graph `G`: the number at the end of its
+        id (e.g. 'ret_R1_12' -> 12) or, for nodes without one such as
+        ports, the element of a neighboring node
+    '''
+    elements = {}
+    for node in G.nodes():
+        match = _ELEMENT_RE.search(str(node))
+        if match is not None:
+            elements[node] = int(match.group(1))
+    pending = [n for n in G.nodes() if n not in elements]
+    while pending:
+        remaining = []
+        for node in pending:
+            for neighbor in nx.all_neighbors(G, node):
+                if neighbor in elements:
+                    elements[node] = elements[neighbor]
+                    break
+            else:
+                remaining.append(node)
+        if len(remaining) == len(pending):
+            raise ValueError('Nodes {} belong to no element'.format(
+                remaining[:5]))
+        pending = remaining
+    return elements
+
+
+def node_cost(attrs):
+    '''
+        Relative compute cost of a graph node: ports cost nothing,
+        photoreceptors their number of microvilli, other models 1
+    '''
+    if attrs.get('class') == 'Port':
+        return 0
+    return attrs.get('num_microvilli', 1)
+
+
+def _as_tuple(port):
+    return port if isinstance(port, tuple) else (port,)
+
+
+def _port_key(port):
+    # interface index entry to selector string
+    return '/' + '/'.join(str(p) for p in _as_tuple(port) if p != '')
+
+
+def _selector_prefix(selector):
+    # format should be '/<lpu>/<id>/<neuronname>'
+    return selector.split('/')[1]
+
+
+def split_pattern(pattern, keep_ports, interface=1):
+    '''
+        Part of `pattern` that connects the ports of `keep_ports`
+        (selector strings) of `interface` with the other interface
+    '''
+    df_int = pattern.interface.data
+    df_pat = pattern.data
+    levels = df_int.index.nlevels
+
+    ports = [_as_tuple(p) for p in df_int.index]
+    keep = set(p for p, i in zip(ports, df_int['interface'].values)
+               if i == interface and _port_key(p) in keep_ports)
+    rows = [k for k, p in enumerate(df_pat.index)
+            if tuple(p[:levels]) in keep or tuple(p[levels:]) in keep]
+    df_pat = df_pat.iloc[rows]
+    used = set(tuple(p[:levels]) for p in df_pat.index) | \
+        set(tuple(p[levels:]) for p in df_pat.index)
+    df_int = df_int[np.array([p in used for p in ports], dtype=bool)]
+    return Pattern.from_df(df_int, df_pat)
+
+
+class RetinaPartition(object):
+    '''
+        Partition of the photoreceptors of the retina into worker LPUs
+
+        --
+        retina: retina array object
+        worker_num: number of workers
+        tolerance: allowed load above the mean of a worker
+
+        Attributes
+        ----------
+        assignment: worker of each ommatidium
+        report: predicted load and cut size of each worker
+    '''
+    def __init__(self, retina, worker_num, tolerance=0.05):
+        self.worker_num = worker_num
+        # one worker with all photoreceptors, split below
+        self.graph = retina.get_worker_graph(1, 1)
+        self.pattern = retina.update_pattern_master_worker(1, 1)
+
+        elements = node_elements(self.graph)
+        weights = np.zeros(retina.num_elements)
+        for node, attrs in self.graph.nodes(data=True):
+            weights[elements[node]] += node_cost(attrs)
+
+        points = element_points(*retina.get_ommatidia_pos())
+        edges = hex_edges(points)
+        self.assignment = partition_elements(points, weights, worker_num,
+                                             edges, tolerance)
+
+        self.nodes = [[] for _ in range(worker_num)]
+        self.ports = [set() for _ in range(worker_num)]
+        for node, attrs in self.graph.nodes(data=True):
+            j = self.assignment[elements[node]]
+            self.nodes[j].append(node)
+            if 'selector' in attrs:
+                self.ports[j].add(attrs['selector'])
+
+        loads = np.bincount(self.assignment, weights=weights,
+                            minlength=worker_num)
+        boundary = np.zeros(worker_num, dtype=np.int64)
+        for i, j in edges:
+            if self.assignment[i] != self.assignment[j]:
+                boundary[self.assignment[i]] += 1
+                boundary[self.assignment[j]] += 1
+        self.report = {
+            'worker_num': worker_num,
+            'loads': loads.tolist(),
+            'load_fractions': (loads/max(loads.sum(), 1)).tolist(),
+            'imbalance': float(loads.max()/max(loads.mean(), 1e-12)),
+            'ommatidia': np.bincount(self.assignment,
+                                     minlength=worker_num).tolist(),
+            'ports': [len(p) for p in self.ports],
+            'cut_edges': cut_edges(edges, self.assignment),
+            'boundary_edges': boundary.tolist()}
+
+    def worker_graph(self, j):
+        '''
+            Graph of worker `j` (0 based)
+        '''
+        return self.graph.subgraph(self.nodes[j]).copy()
+
+    def worker_pattern(self, j):
+        '''
+            Pattern between master (interface 0) and worker `j`
+        '''
+        return split_pattern(self.pattern, self.ports[j], interface=1)
+
+    def write_report(self, filename):
+        with open(filename, 'w') as f:
+            json.dump(self.report, f, indent=2)
+
+    def format_report(self):
+        r = self.report
+        lines = ['Retina partition: imbalance {:.3f}, {} cut edges'.format(
+            r['imbalance'], r['cut_edges'])]
+        for j in range(self.worker_num):
+            lines.append('    worker {}: {} ommatidia, load {:.1%}, '
+                         '{} ports, {} boundary edges'.format(
+                             j, r['ommatidia'][j], r['load_fractions'][j],
+                             r['ports'][j], r['boundary_edges'][j]))
+        return '\n'.join(lines)
+
+
+def synapse_classes(model):
+    '''
+        Classes of synapses of vision model `model`, those of the
+        entries of its *SYNAPSE_LIST lists
+    '''
+    module = importlib.import_module('vision_models.' + model)
+    classes = set()
+    for name in dir(module):
+        if name.endswith('SYNAPSE_LIST'):
+            classes.update(s['class'] for s in getattr(module, name)
+                           if 'class' in s)
+    return classes
+
+
+def halo_pattern(ports_0, ports_1):
+    '''
+        Pattern between two workers from lists of (output selector,
+        input selector) pairs: `ports_0` from interface 0 to 1 and
+        `ports_1` from interface 1 to 0
+    '''
+    groups = [(0, 1, ports_0), (1, 0, ports_1)]
+    int_rows, pat_rows = [], []
+    for source, target, ports in groups:
+        for out_sel, in_sel in ports:
+            # a port receiving data from an LPU is an input port of
+            # the pattern, see superposition.py
+            int_rows.append((out_sel, source, 'in'))
+            int_rows.append((in_sel, target, 'out'))
+            pat_rows.append(out_sel.split('/')[1:] + in_sel.split('/')[1:])
+    # an output port feeds every input port of the other worker
+    # that reads it, but is listed once
+    int_rows = list(collections.OrderedDict(
+        (row[0], row) for row in int_rows).values())
+    int_index = pd.MultiIndex.from_tuples(
+        [tuple(sel.split('/')[1:]) for sel, _, _ in int_rows],
+        names=[0, 1, 2])
+    df_int = pd.DataFrame({'interface': [r[1] for r in int_rows],
+                           'io': [r[2] for r in int_rows],
+                           'type': ['gpot']*len(int_rows)},
+                          index=int_index,
+                          columns=['interface', 'io', 'type'])
+    pat_index = pd.MultiIndex.from_tuples(
+        [tuple(r) for r in pat_rows],
+        names=['from_0', 'from_1', 'from_2', 'to_0', 'to_1', 'to_2'])
+    df_pat = pd.DataFrame({'conn': np.ones(len(pat_rows), dtype=np.int64)},
+                          index=pat_index)
+    return Pattern.from_df(df_int, df_pat)
+
+
+class LaminaPartition(object):
+    '''
+        Partition of the lamina into worker LPUs of contiguous regions
+        of cartridges. Synapses go to the worker of their postsynaptic
+        neuron, amacrine cells to the worker of most of the neurons they
+        are connected to. Every connection between workers, such as
+        synapses between neighboring cartridges and of amacrine cells,
+        is replaced by an output port in the worker of its source and a
+        halo input port in the worker of its target, connected by a
+        pattern between the two workers. Input ports from the retina are
+        repeated in every worker that reads them.
+
+        --
+        lamina: lamina array object
+        points: positions of cartridges, those of the ommatidia of the
+            same hexagonal array (see `element_points`)
+        worker_num: number of workers
+        model: vision model of the lamina
+        tolerance: allowed load above the mean of a worker
+
+        Attributes
+        ----------
+        assignment: worker of each cartridge
+        report: predicted load, halo ports and cut size of each worker
+    '''
+    def __init__(self, lamina, points, worker_num, model,
+                 tolerance=0.05):
+        self.worker_num = worker_num
+        self.graph = G = lamina.get_graph()
+        self.prefix = _selector_prefix(lamina.get_selector(0, 'R1'))
+        synapses = synapse_classes(model)
+
+        nodes = dict(G.nodes(data=True))
+        is_port = dict((n, a.get('class') == 'Port')
+                       for n, a in nodes.items())
+        is_synapse = dict((n, a.get('class') in synapses)
+                          for n, a in nodes.items())
+
+        # cartridge neurons by the number at the end of their id
+        elements = {}
+        for node, attrs in nodes.items():
+            match = _ELEMENT_RE.search(str(node))
+            if match is not None and not is_port[node] and \
+                    not is_synapse[node] and \
+                    attrs.get('name') not in AMACRINE_NAMES:
+                elements[node] = int(match.group(1))
+
+        num_cartridges = len(points)
+        weights = np.zeros(num_cartridges)
+        for node, element in elements.items():
+            weights[element] += node_cost(nodes[node])
+        # synapses count for the cartridge of their postsynaptic neuron
+        for node in nodes:
+            if is_synapse[node]:
+                for post in G.successors(node):
+                    if post in elements:
+                        weights[elements[post]] += 1
+                        break
+
+        edges = hex_edges(points)
+        self.assignment = partition_elements(points, weights, worker_num,
+                                             edges, tolerance)
+
+        owner = dict((n, self.assignment[e]) for n, e in elements.items())
+        # other neurons (amacrine cells) with most of their partners
+        for node in nodes:
+            if node in owner or is_port[node] or is_synapse[node]:
+                continue
+            counts = np.zeros(worker_num, dtype=np.int64)
+            for synapse in nx.all_neighbors(G, node):
+                for partner in nx.all_neighbors(G, synapse):
+                    if partner in owner:
+                        counts[owner[partner]] += 1
+            owner[node] = int(np.argmax(counts))
+        for node in nodes:
+            if is_synapse[node]:
+                posts = [p for p in G.successors(node) if p in owner]
+                pres = [p for p in G.predecessors(node) if p in owner]
+                owner[node] = owner[(posts or pres)[0]] \
+                    if posts or pres else 0
+
+        # workers of each node, several for input ports
+        self.members = [set() for _ in range(worker_num)]
+        for node in nodes:
+            if node in owner:
+                self.members[owner[node]].add(node)
+            elif nodes[node].get('port_io') == 'out':
+                for pre in G.predecessors(node):
+                    if pre in owner:
+                        self.members[owner[pre]].add(node)
+                        break
+            else:
+                for w in set(owner[s] for s in G.successors(node)
+                             if s in owner):
+                    self.members[w].add(node)
+        self.ports = [set(nodes[n]['selector'] for n in members
+                          if is_port[n] and 'selector' in nodes[n])
+                      for members in self.members]
+
+        # halo of each (source worker, target worker)
+        self.halo = {}
+        for u, v, data in G.edges(data=True):
+            if is_port[u] or u not in owner or v not in owner or \
+                    owner[u] == owner[v]:
+                continue
+            key = (owner[u], owner[v])
+            self.halo.setdefault(key, collections.OrderedDict())[
+                (u, v)] = data
+
+        loads = np.bincount(self.assignment, weights=weights,
+                            minlength=worker_num)
+        halo_in = np.zeros(worker_num, dtype=np.int64)
+        halo_out = np.zeros(worker_num, dtype=np.int64)
+        for (v, w), conns in self.halo.items():
+            sources = set(u for u, _ in conns)
+            halo_out[v] += len(sources)
+            halo_in[w] += len(sources)
+        self.report = {
+            'worker_num': worker_num,
+            'loads': loads.tolist(),
+            'load_fractions': (loads/max(loads.sum(), 1)).tolist(),
+            'imbalance': float(loads.max()/max(loads.mean(), 1e-12)),
+            'cartridges': np.bincount(self.assignment,
+                                      minlength=worker_num).tolist(),
+            'ports': [len(p) for p in self.ports],
+            'halo_in': halo_in.tolist(), 'halo_out': halo_out.tolist(),
+            'cut_edges': cut_edges(edges, self.assignment),
+            'halo_connections': sum(len(c) for c in self.halo.values())}
+
+    def _out_port(self, u):
+        return '{}_halo_{}'.format(self.prefix, u), \
+            '/{}/halo/{}'.format(self.prefix, u)
+
+    def _in_port(self, u, w):
+        return '{}_halo{}_{}'.format(self.prefix, w, u), \
+            '/{}/halo{}/{}'.format(self.prefix, w, u)
+
+    def worker_graph(self, w):
+        '''
+            Graph of worker `w` with its halo ports
+        '''
+        G = self.graph.subgraph(self.members[w]).copy()
+        for (source, target), conns in self.halo.items():
+            for (u, v), data in conns.items():
+                if source == w:
+                    node, selector = self._out_port(u)
+                    if node not in G:
+                        G.add_node(node, **{'class': 'Port', 'name': 'halo',
+                                            'port_type': 'gpot',
+                                            'port_io': 'out',
+                                            'selector': selector})
+                        G.add_edge(u, node, **data)
+                if target == w:
+                    node, selector = self._in_port(u, w)
+                    if node not in G:
+                        G.add_node(node, **{'class': 'Port', 'name': 'halo',
+                                            'port_type': 'gpot',
+                                            'port_io': 'in',
+                                            'selector': selector})
+                    G.add_edge(node, v, **data)
+        return G
+
+    def halo_patterns(self):
+        '''
+            Dictionary of (worker, worker) -> Pattern between them,
+            the first worker is interface 0
+        '''
+        pairs = {}
+        for (source, target), conns in self.halo.items():
+            key = (min(source, target), max(source, target))
+            sources = []
+            for u, _ in conns:
+                if u not in sources:
+                    sources.append(u)
+            pairs.setdefault(key, ([], []))[0 if source < target else 1]\
+                .extend((self._out_port(u)[1], self._in_port(u, target)[1])
+                        for u in sources)
+        return dict((key, halo_pattern(*ports))
+                    for key, ports in pairs.items())
+
+    def retina_pattern(self, pattern, w):
+        '''
+            Part of retina-lamina `pattern` (lamina interface 1)
+            with the ports of worker `w`
+        '''
+        return split_pattern(pattern, self.ports[w], interface=1)
+
+    def write_report(self, filename):
+        with open(filename, 'w') as f:
+            json.dump(self.report, f, indent=2)
+
+    def format_report(self):
+        r = self.report
+        lines = ['Lamina partition: imbalance {:.3f}, {} cut edges, '
+                 '{} halo connections'.format(
+                     r['imbalance'], r['cut_edges'], r['halo_connections'])]
+        for w in range(self.worker_num):
+            lines.append('    worker {}: {} cartridges, load {:.1%}, '
+                         '{} halo inputs, {} halo outputs'.format(
+                             w, r['cartridges'][w], r['load_fractions'][w],
+                             r['halo_in'][w], r['halo_out'][w]))
+        return '\n'.join(lines)
@@ -0,0 +1,312 @@
+'''
+    Placement of LPUs on GPUs.
+
+    Placement collects the `add` and `connect` calls of a Manager,
+    estimates the compute and memory cost of each LPU from its components
+    and the traffic between LPUs from the size of their patterns, assigns
+    LPUs to devices and then forwards the calls to the manager with the
+    chosen devices:
+
+        placement = Placement.from_config(config, manager,
+                                          baseline={'retina0': 0,
+                                                    'lamina0': 1})
+        add_retina_LPU(config, 0, retina, placement)
+        ...
+        placement.apply()
+
+    The assignment minimizes the load of the most loaded device plus
+    `traffic_weight` times the traffic between devices, both in values
+    per step, and keeps the memory of each device within `device_memory`.
+    A baseline placement, such as the fixed devices of the demos (retina
+    on the first, lamina on the second GPU), is kept unless the planned
+    one is better.
+'''
+from __future__ import division
+
+import itertools
+import subprocess
+import sys
+
+import tracing as tr
+
+# assignments searched exhaustively up to this number
+MAX_EXHAUSTIVE = 100000
+LOCAL_SEARCH_PASSES = 10
+
+# bytes of a parameter or state value, values of the state
+# of a microvillus
+VALUE_BYTES = 8
+MICROVILLUS_VALUES = 8
+
+_COUNT_DEVICES = 'import pycuda.driver as cuda; cuda.init(); ' \
+    'print(cuda.Device.count())'
+
+
+def lpu_cost(comp_dict):
+    '''
+        Compute cost and memory in bytes of an LPU with components
+        `comp_dict` (model -> attribute -> list of values).
+        The cost is the number of values read and updated in a step,
+        the parameters and states of components and the states of the
+        microvilli of photoreceptors, so that the models of all LPUs
+        are compared in the same units.
+    '''
+    cost = 0.
+    for attrs in comp_dict.values():
+        if not attrs:
+            continue
+        num = len(attrs['id'] if 'id' in attrs else next(iter(attrs.values())))
+        cost += num*len(attrs)
+        if 'num_microvilli' in attrs:
+            cost += sum(attrs['num_microvilli'])*MICROVILLUS_VALUES
+    return cost, cost*VALUE_BYTES
+
+
+def pattern_traffic(pattern):
+    '''
+        Bytes exchanged through `pattern` per step
+    '''
+    return len(pattern.data)*VALUE_BYTES
+
+
+def get_devices():
+    '''
+        GPUs of the host, [0, 1] if they cannot be listed. They are
+        counted in a subprocess, so that CUDA is not initialized in
+        the process that spawns the LPUs.
+    '''
+    try:
+        count = int(subprocess.check_output(
+            [sys.executable, '-c', _COUNT_DEVICES],
+            stderr=subprocess.STDOUT))
+    except (subprocess.CalledProcessError, OSError, ValueError) as e:
+        print('Warning, cannot list GPUs ({}), using devices 0 and 1, '
+              'set [Placement] devices to choose them'.format(e))
+        return [0, 1]
+    if count == 0:
+        print('Warning, no GPU found, using devices 0 and 1, '
+              'set [Placement] devices to choose them')
+        return [0, 1]
+    return list(range(count))
+
+
+def _objective(assignment, costs, traffic, num_devices, total,
+               weight, memory, device_memory):
+    # LPUs assigned None are not placed yet and ignored
+    loads = [0.]*num_devices
+    used = [0.]*num_devices
+    for i, d in enumerate(assignment):
+        if d is not None:
+            loads[d] += costs[i]
+            used[d] += memory[i]
+    if device_memory > 0 and max(used) > device_memory:
+        return float('inf')
+    cross = sum(t for (i, j), t in traffic.items()
+                if None not in (assignment[i], assignment[j]) and
+                assignment[i] != assignment[j])
+    return (max(loads) + weight*cross)/max(total, 1e-12)
+
+
+def plan_placement(costs, memory, traffic, num_devices, pinned=None,
+                   traffic_weight=0.1, device_memory=0, baseline=None):
+    '''
+        Assigns LPUs to devices
+
+        --
+        costs: compute cost of each LPU
+        memory: memory of each LPU in bytes
+        traffic: dictionary of (LPU index, LPU index) -> data sent per
+            step, in the units of `costs`
+        num_devices: number of devices
+        pinned: dictionary of LPU index -> device of LPUs
+            with a fixed device
+        traffic_weight: weight of traffic between devices against load
+        device_memory: memory of a device in bytes, 0 for no limit
+        baseline: device index of each LPU of a placement that is
+            returned unless the planned one is better, None for none
+
+        returns: list with the device index of each LPU
+    '''
+    n = len(costs)
+    pinned = pinned or {}
+    total = sum(costs)
+
+    def objective(assignment):
+        return _objective(assignment, costs, traffic, num_devices, total,
+                          traffic_weight, memory, device_memory)
+
+    choices = [[pinned[i]] if i in pinned else range(num_devices)
+               for i in range(n)]
+    size = 1
+    for c in choices:
+        size *= len(c)
+    if size <= MAX_EXHAUSTIVE:
+        best = min(itertools.product(*choices), key=objective)
+    else:
+        # largest first on the device that increases the objective least,
+        # then single moves while they improve it
+        best = [pinned.get(i) for i in range(n)]
+        for i in sorted(range(n), key=lambda i: -costs[i]):
+            if i in pinned:
+                continue
+
+            def partial(d):
+                best[i] = d
+                return objective(best)
+            best[i] = min(range(num_devices), key=partial)
+        current = objective(best)
+        for _ in range(LOCAL_SEARCH_PASSES):
+            improved = False
+            for i in range(n):
+                if i in pinned:
+                    continue
+                for d in range(num_devices):
+                    previous = best[i]
+                    best[i] = d
+                    value = objective(best)
+                    if value < current:
+                        current, improved = value, True
+                    else:
+                        best[i] = previous
+            if not improved:
+                break
+    if baseline is not None and \
+            all(baseline[i] == d for i, d in pinned.items()) and \
+            objective(baseline) <= objective(best):
+        best = baseline
+    if objective(best) == float('inf'):
+        raise ValueError('LPUs do not fit in the memory of {} devices'.format(
+            num_devices))
+    return list(best)
+
+
+class Placement(object):
+    '''
+        Stands in for a Manager while LPUs are added and connected
+        and adds them to `manager` on planned devices in `apply`
+
+        --
+        manager: Manager
+        devices: GPUs available to the LPUs
+        traffic_weight: weight of traffic between devices against load
+        device_memory: memory of a device in MB, 0 for no limit
+        baseline: dictionary of LPU id -> index in `devices` of
+            a placement that is kept unless the planned one is better,
+            used only if it covers every LPU
+    '''
+    def __init__(self, manager, devices, traffic_weight=0.1,
+                 device_memory=0, baseline=None):
+        self.manager = manager
+        self.devices = list(devices)
+        self.traffic_weight = traffic_weight
+        self.device_memory = device_memory
+        self.baseline = baseline or {}
+        self.lpus = []
+        self.connections = []
+        self.assignment = None
+
+    @classmethod
+    def from_config(cls, config, manager, devices=None, baseline=None):
+        '''
+            Placement with the options of [Placement], on `devices`
+            or the configured (by default all) GPUs
+        '''
+        pl_config = config['Placement']
+        if devices is None:
+            devices = pl_config['devices'] or get_devices()
+        return cls(manager, devices, pl_config['traffic_weight'],
+                   pl_config['device_memory'], baseline)
+
+    def add(self, lpu_cls, lpu_id, dt, comp_dict, conns, device=None,
+            **kwargs):
+        '''
+            Arguments of Manager.add, `device` fixes the device
+            of the LPU instead of planning it
+        '''
+        cost, memory = lpu_cost(comp_dict)
+        self.lpus.append({'args': (lpu_cls, lpu_id, dt, comp_dict, conns),
+                          'kwargs': kwargs, 'id': lpu_id, 'device': device,
+                          'cost': cost, 'memory': memory})
+
+    def connect(self, id_0, id_1, pattern, *args, **kwargs):
+        self.connections.append({'args': (id_0, id_1, pattern) + args,
+                                 'kwargs': kwargs, 'ids': (id_0, id_1),
+                                 'traffic': pattern_traffic(pattern)})
+
+    def plan(self):
+        '''
+            Dictionary of LPU id -> device
+        '''
+        index = dict((lpu['id'], i) for i, lpu in enumerate(self.lpus))
+        traffic = {}
+        for c in self.connections:
+            key = tuple(sorted(index[lpu_id] for lpu_id in c['ids']))
+            # values, the units of the costs of LPUs
+            traffic[key] = traffic.get(key, 0) + c['traffic']/VALUE_BYTES
+        pinned = {}
+        for i, lpu in enumerate(self.lpus):
+            if lpu['device'] is None:
+                continue
+            if lpu['device'] not in self.devices:
+                raise ValueError(
+                    'LPU {} is on device {}, which is not one of the '
+                    '[Placement] devices {}'.format(
+                        lpu['id'], lpu['device'], self.devices))
+            pinned[i] = self.devices.index(lpu['device'])
+        baseline = [self.baseline.get(lpu['id']) for lpu in self.lpus]
+        if None in baseline or \
+                any(d >= len(self.devices) for d in baseline):
+            baseline = None
+        self.assignment = plan_placement(
+            [lpu['cost'] for lpu in self.lpus],
+            [lpu['memory'] for lpu in self.lpus], traffic,
+            len(self.devices), pinned, self.traffic_weight,
+            self.device_memory*2**20, baseline)
+        return dict((lpu['id'], self.devices[d])
+                    for lpu, d in zip(self.lpus, self.assignment))
+
+    def apply(self):
+        '''
+            Adds and connects the LPUs in `manager`
+        '''
+        with tr.span('placement of LPUs', lpus=len(self.lpus),
+                     devices=len(self.devices)):
+            devices = self.plan()
+        print(self.format_report())
+        for lpu in self.lpus:
+            self.manager.add(*lpu['args'], device=devices[lpu['id']],
+                             **lpu['kwargs'])
+        for c in self.connections:
+            self.manager.connect(*c['args'], **c['kwargs'])
+        return devices
+
+    def report(self):
+        '''
+            Predicted load, memory and LPUs of each device
+            and the traffic between devices
+        '''
+        total = sum(lpu['cost'] for lpu in self.lpus) or 1.
+        device_of = dict((lpu['id'], self.devices[d])
+                         for lpu, d in zip(self.lpus, self.assignment))
+        devices = []
+        for d, device in enumerate(self.devices):
+            lpus = [lpu for lpu, a in zip(self.lpus, self.assignment)
+                    if a == d]
+            devices.append({
+                'device': device, 'lpus': [lpu['id'] for lpu in lpus],
+                'load': sum(lpu['cost'] for lpu in lpus)/total,
+                'memory_mb': sum(lpu['memory'] for lpu in lpus)/2**20})
+        cross = sum(c['traffic'] for c in self.connections
+                    if device_of[c['ids'][0]] != device_of[c['ids'][1]])
+        return {'devices': devices, 'traffic_between_devices': cross,
+                'traffic': sum(c['traffic'] for c in self.connections)}
+
+    def format_report(self):
+        r = self.report()
+        lines = ['Placement: {} of {} bytes per step between devices'.format(
+            r['traffic_between_devices'], r['traffic'])]
+        for d in r['devices']:
+            lines.append('    device {}: load {:.1%}, {:.0f} MB, {}'.format(
+                d['device'], d['load'], d['memory_mb'],
+                ', '.join(d['lpus']) or '-'))
+        return '\n'.join(lines)
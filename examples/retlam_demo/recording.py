@@ -0,0 +1,163 @@
+'''
+    Selection of recorded outputs from the [Recording] configuration.
+
+    Neurons are selected by name and by region of the hexagonal array
+    (ommatidia for the retina, cartridges for the lamina) and are
+    recorded every `sample_interval` steps. Outputs of an LPU simulated
+    by several workers are merged into one file with `merge_output_files`.
+'''
+import os
+
+import h5py
+import numpy as np
+
+from neurokernel.LPU.OutputProcessors.FileOutputProcessor import \
+    FileOutputProcessor
+
+import naming
+from async_output import AsyncFileOutputProcessor
+
+
+def num_elements_in_rings(rings):
+    '''
+        Number of elements of a hexagonal array within `rings` rings
+        of the center; elements are numbered ring by ring from 0
+    '''
+    return 3*rings*(rings+1) + 1
+
+
+def _element_mask(element_ids, rec_config):
+    elements = rec_config['elements']
+    mask = np.ones(len(element_ids), dtype=bool)
+    if rec_config['rings'] < 0 and len(elements) == 0:
+        return mask
+    if rec_config['rings'] >= 0:
+        mask &= element_ids < num_elements_in_rings(rec_config['rings'])
+    if len(elements) > 0:
+        mask &= np.in1d(element_ids, elements)
+    # neurons of no element (amacrine cells) are in no region,
+    # they are selected only with element -1
+    mask[element_ids < 0] = -1 in elements
+    return mask
+
+
+def records_all(rec_config):
+    return 'all' in rec_config['neurons']
+
+
+def retina_uids(rec_config, num_elements):
+    '''
+        uids of selected photoreceptors, named 'ret_<name>_<ommatidium>'
+    '''
+    elements = np.arange(num_elements)
+    elements = elements[_element_mask(elements, rec_config)]
+    return naming.photoreceptor_uids(elements, rec_config['neurons'])
+
+
+def component_uids(rec_config, comp_dict):
+    '''
+        uids of components in `comp_dict` with a selected name
+        that belong to a selected element
+    '''
+    names = set(rec_config['neurons'])
+    uids = []
+    for attrs in comp_dict.values():
+        if 'name' not in attrs:
+            continue
+        selected = np.in1d(np.asarray(attrs['name'], dtype=object),
+                           list(names))
+        if not selected.any():
+            continue
+        model_uids = np.asarray(attrs['id'], dtype=object)[selected]
+        element_ids = np.array([naming.uid_element(uid)
+                                for uid in model_uids],
+                               dtype=np.int64)
+        uids.extend(model_uids[_element_mask(element_ids, rec_config)])
+    return list(uids)
+
+
+def get_output_processors(config, lpu, output_file, uids=None,
+                          comp_dict=None, num_elements=None):
+    '''
+        Output processors of LPU `lpu` ('Retina' or 'Lamina') that record
+        the neurons selected in [Recording] section, an empty list if
+        recording of the LPU is disabled or no neuron is selected.
+
+        --
+        config: configuration dictionary like object
+        lpu: name of subsection in [Recording]
+        output_file: name of output file
+        uids: uids to record in case all neurons are selected,
+            None for all neurons of the LPU
+        comp_dict: components of the LPU, required to select lamina neurons
+        num_elements: number of ommatidia, required to select retina neurons
+    '''
+    rec_config = config['Recording'][lpu]
+    if not rec_config['enabled']:
+        return []
+    if not records_all(rec_config):
+        if lpu == 'Retina':
+            uids = retina_uids(rec_config, num_elements)
+        else:
+            uids = component_uids(rec_config, comp_dict)
+        if len(uids) == 0:
+            print('Warning, no {} neurons match the [Recording] selection, '
+                  'no output is written to {}'.format(lpu, output_file))
+            return []
+    sample_interval = rec_config['sample_interval']
+    if not config['Recording']['async_write']:
+        return [FileOutputProcessor([('V', uids)], output_file,
+                                    sample_interval=sample_interval)]
+    return [AsyncFileOutputProcessor(
+        [('V', uids)], output_file, sample_interval=sample_interval,
+        block_steps=config['Recording']['block_steps'],
+        queue_blocks=config['Recording']['queue_blocks'],
+        complevel=config['Recording']['complevel'],
+        chunk_layout=config['Recording']['chunk_layout'])]
+
+
+# rows of outputs copied at once when files are merged
+MERGE_ROWS = 10000
+
+
+def merge_output_files(filenames, output_file, remove=True):
+    '''
+        Merges output files of workers of one LPU into `output_file`,
+        uids and outputs of each variable in the order of `filenames`,
+        metadata of the first file
+
+        --
+        filenames: output files of the workers, missing files are
+            skipped (LPUs with disabled recording)
+        output_file: name of merged file
+        remove: if True remove the files of the workers
+    '''
+    filenames = [f for f in filenames if os.path.exists(f)]
+    if not filenames:
+        return
+    sources = [h5py.File(f, 'r') for f in filenames]
+    try:
+        with h5py.File(output_file, 'w') as out:
+            first = sources[0]
+            for key in first:
+                if 'data' not in first[key] or 'uids' not in first[key]:
+                    first.copy(key, out)
+                    continue
+                uids = np.concatenate([f[key + '/uids'][:] for f in sources])
+                out.create_dataset(key + '/uids', data=uids)
+                datasets = [f[key + '/data'] for f in sources]
+                rows = min(d.shape[0] for d in datasets)
+                data = out.create_dataset(
+                    key + '/data', (rows, len(uids)), datasets[0].dtype)
+                for start in range(0, rows, MERGE_ROWS):
+                    stop = min(start + MERGE_ROWS, rows)
+                    data[start:stop] = np.hstack(
+                        [d[start:stop] for d in datasets])
+            for name, value in first.attrs.items():
+                out.attrs[name] = value
+    finally:
+        for f in sources:
+            f.close()
+    if remove:
+        for f in filenames:
+            os.remove(f)
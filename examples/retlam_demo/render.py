@@ -0,0 +1,257 @@
+'''
+    Renders frames of a retina/lamina simulation into a movie.
+
+    The panels of visualize_result.m (screen intensity, inputs and outputs
+    of R1, average R1-R6 terminal outputs of cartridges, L1 and L2 outputs)
+    are drawn on the 3D positions of screen points and ommatidia, which are
+    computed once and shared with a pool of processes. Each process reads
+    only the rows of its own time slice from the screen file and from the
+    file written by analysis.py and saves its frames as images, which are
+    then assembled into a video if ffmpeg is available.
+
+    Usage: python render.py [-i index] [-s suffix] [-p processes] [-o file]
+'''
+from __future__ import division
+
+import argparse
+import multiprocessing
+import os
+import subprocess
+
+import h5py
+import numpy as np
+
+import analysis as an
+
+try:
+    from shutil import which
+except ImportError:
+    from distutils.spawn import find_executable as which
+
+# radius of the eye and of the screen in the rendered scene
+EYE_RADIUS = 1.
+SCREEN_RADIUS = 10.
+
+# traces of the analysis file shown in the panels below the screen
+PANELS = [('R1input', 'Inputs (Number of Photons) to R1s'),
+          ('R1', 'R1 Response'),
+          ('Rb', 'Average Cartridge\nPhotoreceptor Terminal Response'),
+          ('L1', 'L1 Response'),
+          ('L2', 'L2 Response')]
+
+FRAME_FORMAT = 'frame_{:05d}.png'
+
+_geometry = None
+_settings = None
+
+
+def read_array(filename):
+    with h5py.File(filename, 'r') as f:
+        return f['array'][:]
+
+
+def sphere_points(elev, azim, radius):
+    '''
+        Cartesian coordinates of points given in spherical coordinates,
+        oriented as in visualize_result.m
+    '''
+    return (-radius*np.cos(elev)*np.cos(azim),
+            -radius*np.cos(elev)*np.sin(azim),
+            radius*np.sin(elev))
+
+
+def get_geometry(index=0):
+    '''
+        3D positions of ommatidia and of the screen grid of eye `index`
+        from the coordinate files written by gen_input
+    '''
+    elev = read_array('retina_elev{}.h5'.format(index))
+    azim = read_array('retina_azim{}.h5'.format(index))
+    dima = read_array('grid_dima{}.h5'.format(index))
+    dimb = read_array('grid_dimb{}.h5'.format(index))
+    return {'ommatidia': sphere_points(elev, azim, EYE_RADIUS),
+            'screen': sphere_points(dima, dimb, SCREEN_RADIUS)}
+
+
+def get_color_limits(analysis_file, screen_file,
+                     chunk_steps=an.CHUNK_STEPS):
+    '''
+        Color limits of each panel over the whole run,
+        read one chunk of rows at a time
+    '''
+    limits = {}
+    with h5py.File(analysis_file, 'r') as f:
+        for name, _ in PANELS:
+            limits[name] = an.value_range(_iter_rows(f[name], chunk_steps))
+    with h5py.File(screen_file, 'r') as f:
+        vmin, vmax = an.value_range(_iter_rows(f['array'], chunk_steps))
+    limits['screen'] = (max(vmin, 0), vmax)
+    return limits
+
+
+def _iter_rows(dataset, chunk_steps):
+    for start in range(0, dataset.shape[0], chunk_steps):
+        yield start, dataset[start:start + chunk_steps]
+
+
+def _init_worker(geometry, settings):
+    global _geometry, _settings
+    import matplotlib
+    matplotlib.use('Agg')
+    _geometry = geometry
+    _settings = settings
+
+
+def _render_slice(frames):
+    '''
+        Renders frames (first, last) of the analysis file
+    '''
+    import matplotlib.pyplot as plt
+    from mpl_toolkits.mplot3d import Axes3D  # registers 3d projection
+
+    first, last = frames
+    settings = _settings
+    with h5py.File(settings['analysis_file'], 'r') as f:
+        traces = dict((name, f[name][first:last]) for name, _ in PANELS)
+        step = f.attrs['step']
+        start = f.attrs['start']
+    steps = start + step*np.arange(first, last)
+    # rows of the screen file with the last stored frame before each step
+    screen_rows = steps // settings['screen_write_step']
+    with h5py.File(settings['screen_file'], 'r') as f:
+        screen_rows = np.minimum(screen_rows, f['array'].shape[0] - 1)
+        row_first, row_last = screen_rows[0], screen_rows[-1] + 1
+        screens = f['array'][row_first:row_last]
+    screens = np.maximum(screens, 0)
+
+    x, y, z = _geometry['screen']
+    ox, oy, oz = _geometry['ommatidia']
+    limits = settings['limits']
+    cmap = plt.get_cmap('gray')
+
+    fig = plt.figure(figsize=settings['figsize'])
+    for frame, frame_step, screen_row in zip(range(first, last), steps,
+                                             screen_rows):
+        fig.clf()
+        ax = fig.add_subplot(2, 3, 1, projection='3d')
+        norm = plt.Normalize(*limits['screen'])
+        ax.plot_surface(x, y, z, rstride=1, cstride=1, linewidth=0,
+                        facecolors=cmap(norm(screens[screen_row -
+                                                     row_first])),
+                        shade=False)
+        ax.set_title('Screen Intensity')
+        ax.view_init(0, 180)
+        ax.set_axis_off()
+
+        for i, (name, title) in enumerate(PANELS):
+            ax = fig.add_subplot(2, 3, i + 2, projection='3d')
+            ax.scatter(ox, oy, oz, c=traces[name][frame - first],
+                       cmap=cmap, vmin=limits[name][0],
+                       vmax=limits[name][1], s=settings['marker_size'],
+                       depthshade=False)
+            ax.set_title(title)
+            ax.view_init(0, 180)
+            ax.set_axis_off()
+        fig.suptitle('{:.0f} ms'.format(frame_step*settings['dt']*1000))
+        fig.savefig(os.path.join(settings['frames_dir'],
+                                 FRAME_FORMAT.format(frame)))
+    plt.close(fig)
+    return last - first
+
+
+def render(analysis_file, screen_file, frames_dir, index=0, processes=None,
+           frames_per_task=10, screen_write_step=10, dt=1e-4,
+           first=0, last=None, figsize=(16, 9), marker_size=14):
+    '''
+        Renders frames `first` to `last`-1 of `analysis_file` as images
+        in `frames_dir`, `frames_per_task` consecutive frames at a time
+        in a pool of `processes` processes
+
+        returns: number of rendered frames
+    '''
+    if not os.path.isdir(frames_dir):
+        os.makedirs(frames_dir)
+    with h5py.File(analysis_file, 'r') as f:
+        num_frames = f['R1'].shape[0]
+    last = num_frames if last is None else min(last, num_frames)
+
+    geometry = get_geometry(index)
+    settings = {'analysis_file': analysis_file, 'screen_file': screen_file,
+                'frames_dir': frames_dir,
+                'screen_write_step': screen_write_step, 'dt': dt,
+                'limits': get_color_limits(analysis_file, screen_file),
+                'figsize': figsize, 'marker_size': marker_size}
+
+    tasks = [(start, min(start + frames_per_task, last))
+             for start in range(first, last, frames_per_task)]
+    pool = multiprocessing.Pool(processes, initializer=_init_worker,
+                                initargs=(geometry, settings))
+    try:
+        rendered = sum(pool.imap_unordered(_render_slice, tasks))
+    finally:
+        pool.close()
+        pool.join()
+    return rendered
+
+
+def make_video(frames_dir, output_file, fps=20, first=0):
+    '''
+        Assembles images of `frames_dir` into `output_file` with ffmpeg,
+        returns False if ffmpeg is not available
+    '''
+    ffmpeg = which('ffmpeg')
+    if ffmpeg is None:
+        return False
+    subprocess.check_call([ffmpeg, '-y', '-loglevel', 'error',
+                           '-framerate', str(fps),
+                           '-start_number', str(first),
+                           '-i', os.path.join(frames_dir, 'frame_%05d.png'),
+                           '-pix_fmt', 'yuv420p', output_file])
+    return True
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-i', '--index', type=int, default=0,
+                        help='Eye index of files')
+    parser.add_argument('-s', '--suffix', default='',
+                        help='File suffix of the simulation')
+    parser.add_argument('-t', '--step', type=int, default=10,
+                        help='Render every this many steps')
+    parser.add_argument('-w', '--screen-write-step', type=int, default=10,
+                        help='screen_write_step of the simulation')
+    parser.add_argument('--dt', type=float, default=1e-4,
+                        help='Time step of the simulation')
+    parser.add_argument('--first', type=int, default=0,
+                        help='First frame to render')
+    parser.add_argument('--last', type=int, default=None,
+                        help='Frame after the last one to render')
+    parser.add_argument('-p', '--processes', type=int, default=None,
+                        help='Rendering processes, default all CPUs')
+    parser.add_argument('-f', '--fps', type=int, default=20,
+                        help='Frames per second of the video')
+    parser.add_argument('-o', '--output', default=None,
+                        help='Video file, default retlam<index><suffix>.mp4')
+    args = parser.parse_args()
+
+    name = '{}{}{}'.format('{}', args.index, args.suffix)
+    analysis_file = name.format('analysis') + '.h5'
+    if not os.path.exists(analysis_file):
+        an.summarize(args.index, args.suffix, args.step,
+                     output_file=analysis_file)
+    screen_file = 'intensities{}{}.h5'.format(args.suffix, args.index)
+    frames_dir = name.format('frames')
+    output_file = args.output or name.format('retlam') + '.mp4'
+
+    rendered = render(analysis_file, screen_file, frames_dir, args.index,
+                      processes=args.processes,
+                      screen_write_step=args.screen_write_step, dt=args.dt,
+                      first=args.first, last=args.last)
+    print('Rendered {} frames to {}'.format(rendered, frames_dir))
+    if make_video(frames_dir, output_file, args.fps, args.first):
+        print('Wrote {}'.format(output_file))
+    else:
+        print('ffmpeg not found, frames are left as images')
+
+if __name__ == '__main__':
+    main()
@@ -1,15 +1,12 @@
 #!/usr/bin/env python
 
-import os, resource, sys
+import os
 import argparse
 
 import numpy as np
-import networkx as nx
 
 import neurokernel.core_gpu as core
-from neurokernel.pattern import Pattern
 from neurokernel.tools.logging import setup_logger
-from neurokernel.tools.timing import Timer
 from neurokernel.LPU.LPU import LPU
 
 import retina.retina as ret
@@ -18,17 +15,27 @@ import lamina.lamina as lam
 import retina.geometry.hexagon as r_hx
 import lamina.geometry.hexagon as l_hx
 from retina.InputProcessors.RetinaInputProcessor import RetinaInputProcessor
-from neurokernel.LPU.OutputProcessors.FileOutputProcessor import FileOutputProcessor
+from file_input import RetinaFileInputProcessor
+from lookahead_input import LookaheadRetinaInputProcessor
 from retina.screen.map.mapimpl import AlbersProjectionMap
 from retina.configreader import ConfigReader
 from retina.NDComponents.MembraneModels.PhotoreceptorModel import PhotoreceptorModel
 from retina.NDComponents.MembraneModels.BufferPhoton import BufferPhoton
 from retina.NDComponents.MembraneModels.BufferVoltage import BufferVoltage
 
+import catalog as ct
+import conncache as cc
+import export as ex
+import flatspec as fs
 import gen_input as gi
+import naming
+import placement as pl
+import recording as rec
+import runtime_profile as rp
+import superposition as sp
+import tracing as tr
 
 dtype = np.double
-RECURSION_LIMIT = 80000
 
 
 def setup_logging(config):
@@ -50,14 +57,15 @@ def setup_logging(config):
 
 
 def get_retina_id(i):
-    return 'retina{}'.format(i)
+    return naming.retina_id(i)
 
 
 def get_lamina_id(i):
-    return 'lamina{}'.format(i)
+    return naming.lamina_id(i)
 
 
-def add_retina_LPU(config, retina_index, retina, manager):
+def add_retina_LPU(config, retina_index, retina, manager, cache=None,
+                   exporter=None, device=None):
     '''
         This method adds Retina LPU and its parameters to the manager
         so that it can be initialized later. Depending on configuration
@@ -70,7 +78,9 @@ def add_retina_LPU(config, retina_index, retina, manager):
         retina: retina array object required for the generation of
             graph.
         manager: manager object to which LPU will be added
-        generator: generator object or None
+        cache: connectivity cache object or None
+        exporter: graph exporter object or None
+        device: GPU of the LPU, None to leave it to the placement
     '''
     dt = config['General']['dt']
     debug = config['Retina']['debug']
@@ -81,38 +91,41 @@ def add_retina_LPU(config, retina_index, retina, manager):
     gexf_filename = config['Retina']['gexf_file']
     suffix = config['General']['file_suffix']
 
-    output_file = '{}{}{}.h5'.format(output_filename, retina_index, suffix)
-    gexf_file = '{}{}{}.gexf.gz'.format(gexf_filename, retina_index, suffix)
+    output_file = naming.data_file(output_filename, retina_index, suffix)
+    graph_file = '{}{}{}'.format(gexf_filename, retina_index, suffix)
     
-    inputmethod = config['Retina']['inputmethod']
-    if inputmethod == 'read':
-        print('Generating input files')
-        with Timer('input generation'):
-            input_processor = RetinaFileInputProcessor(config, retina)
-    else:
-        print('Using input generating function')
-        input_processor = RetinaInputProcessor(config, retina)
+    input_processor = get_input_gen(config, retina, retina_index)
 
-    output_processor = FileOutputProcessor([('V',None)], output_file, sample_interval=1)
+    output_processors = rec.get_output_processors(
+        config, 'Retina', output_file, num_elements=retina.num_elements)
 
-    # retina also allows a subset of its graph to be taken
-    # in case it is needed later to split the retina model to more
-    # GPUs
-    G = retina.get_worker_nomaster_graph()
-    nx.write_gexf(G, gexf_file)
+    def build():
+        # retina also allows a subset of its graph to be taken
+        # in case it is needed later to split the retina model to more
+        # GPUs
+        G = retina.get_worker_nomaster_graph()
+        return LPU.graph_to_dicts(G)
 
-    (comp_dict, conns) = LPU.graph_to_dicts(G)
     retina_id = get_retina_id(retina_index)
+    with tr.span('LPU graph', lpu=retina_id):
+        (comp_dict, conns) = _get_cached(cache, 'retina', config,
+                                         retina_index, build)
+    if exporter is not None:
+        exporter.export_dicts(comp_dict, conns, graph_file)
 
     extra_comps = [PhotoreceptorModel, BufferPhoton]
 
-    manager.add(LPU, retina_id, dt, comp_dict, conns,
-                device = retina_index, input_processors = [input_processor],
-                output_processors = [output_processor],
-                debug=debug, time_sync=time_sync, extra_comps = extra_comps)
+    comp_dict, conns = fs.pack(config, retina_id, comp_dict, conns)
+    lpu_cls, profile_args = rp.get_lpu(config, retina_id)
+    manager.add(lpu_cls, retina_id, dt, comp_dict, conns,
+                device = device, input_processors = [input_processor],
+                output_processors = output_processors,
+                debug=debug, time_sync=time_sync, extra_comps = extra_comps,
+                **profile_args)
 
 
-def add_lamina_LPU(config, lamina_index, lamina, manager):
+def add_lamina_LPU(config, lamina_index, lamina, manager, cache=None,
+                   exporter=None, device=None):
     '''
         This method adds Lamina LPU and its parameters to the manager
         so that it can be initialized later.
@@ -123,7 +136,9 @@ def add_lamina_LPU(config, lamina_index, lamina, manager):
         lamina: lamina array object required for the generation of
             graph.
         manager: manager object to which LPU will be added
-        generator: generator object or None
+        cache: connectivity cache object or None
+        exporter: graph exporter object or None
+        device: GPU of the LPU, None to leave it to the placement
     '''
 
     output_filename = config['Lamina']['output_file']
@@ -134,27 +149,35 @@ def add_lamina_LPU(config, lamina_index, lamina, manager):
     debug = config['Lamina']['debug']
     time_sync = config['Lamina']['time_sync']
 
-    output_file = '{}{}{}.h5'.format(output_filename, lamina_index, suffix)
-    gexf_file = '{}{}{}.gexf.gz'.format(gexf_filename, lamina_index, suffix)
-    G = lamina.get_graph()
-    nx.write_gexf(G, gexf_file)
+    output_file = naming.data_file(output_filename, lamina_index, suffix)
+    graph_file = '{}{}{}'.format(gexf_filename, lamina_index, suffix)
+
+    def build():
+        G = lamina.get_graph()
+        return LPU.graph_to_dicts(G)
 
-    (comp_dict, conns) = LPU.graph_to_dicts(G)
     lamina_id = get_lamina_id(lamina_index)
+    with tr.span('LPU graph', lpu=lamina_id):
+        (comp_dict, conns) = _get_cached(cache, 'lamina', config,
+                                         lamina_index, build)
+    if exporter is not None:
+        exporter.export_dicts(comp_dict, conns, graph_file)
     
     extra_comps = [BufferVoltage]
     
-    output_processor = FileOutputProcessor(
-                            [('V', None)], output_file,
-                            sample_interval=1)
+    output_processors = rec.get_output_processors(
+        config, 'Lamina', output_file, comp_dict=comp_dict)
 
-    manager.add(LPU, lamina_id, dt, comp_dict, conns,
-                output_processors = [output_processor],
-                device=lamina_index+1, debug=debug, time_sync=time_sync,
-                extra_comps = extra_comps)
+    comp_dict, conns = fs.pack(config, lamina_id, comp_dict, conns)
+    lpu_cls, profile_args = rp.get_lpu(config, lamina_id)
+    manager.add(lpu_cls, lamina_id, dt, comp_dict, conns,
+                output_processors = output_processors,
+                device=device, debug=debug, time_sync=time_sync,
+                extra_comps = extra_comps, **profile_args)
 
 
-def connect_retina_lamina(config, index, retina, lamina, manager):
+def connect_retina_lamina(config, index, retina, lamina, manager,
+                          cache=None, exporter=None):
     '''
         The connections between Retina and Lamina follow
         the neural superposition rule of the fly's compound eye.
@@ -167,55 +190,50 @@ def connect_retina_lamina(config, index, retina, lamina, manager):
         retina: retina array object
         lamina: lamina array object
         manager: manager object to which connection pattern will be added
+        cache: connectivity cache object or None
+        exporter: graph exporter object or None
     '''
     retina_id = get_retina_id(index)
     lamina_id = get_lamina_id(index)
     print('Connecting {} and {}'.format(retina_id, lamina_id))
 
-    retina_selectors = retina.get_all_selectors()
-    lamina_selectors = []#lamina.get_all_selectors()
-    with Timer('creation of Pattern object'):
-        from_list = []
-        to_list = []
-
+    def build():
         # accounts neural superposition
-        rulemap = retina.rulemap
-        for ret_sel in retina_selectors:
-            if not ret_sel.endswith('agg'):
-                # format should be '/ret/<ommid>/<neuronname>'
-                _, lpu, ommid, n_name = ret_sel.split('/')
-                # find neighbor of neural superposition
-                neighborid = rulemap.neighbor_for_photor(int(ommid), n_name)
-                # format should be '/lam/<cartid>/<neuronname>'
-                lam_sel = lamina.get_selector(neighborid, n_name)
-
-                # setup connection from retina to lamina
-                from_list.append(ret_sel)
-                to_list.append(lam_sel)
-                
-                from_list.append(lam_sel+'_agg')
-                to_list.append(ret_sel+'_agg')
-                lamina_selectors.append(lam_sel)
-                lamina_selectors.append(lam_sel+'_agg')
-                
-        pattern = Pattern.from_concat(','.join(retina_selectors),
-                                      ','.join(lamina_selectors),
-                                      from_sel=','.join(from_list),
-                                      to_sel=','.join(to_list),
-                                      gpot_sel=','.join(from_list+to_list))
-        nx.write_gexf(pattern.to_graph(), retina_id+'_'+lamina_id+'.gexf.gz',
-                      prettyprint=True)
-
-    with Timer('update of connections in Manager'):
-        manager.connect(retina_id, lamina_id, pattern)
-
-
-def start_simulation(config, manager):
+        return sp.build_retina_lamina_pattern(retina, lamina, agg=True)
+
+    with tr.span('creation of Pattern object'):
+        pattern = _get_cached(cache, 'pattern', config, index, build,
+                              dump=cc.dump_pattern, load=cc.load_pattern)
+    if exporter is not None:
+        exporter.export_pattern(pattern, naming.pattern_id(index))
+
+    with tr.span('update of connections in Manager'):
+        manager.connect(retina_id, lamina_id, fs.pack_pattern(
+            config, naming.pattern_id(index), pattern))
+
+
+def _get_cached(cache, kind, config, index, build, dump=None, load=None):
+    '''
+        Looks up connectivity of `kind` in `cache` and builds it with
+        `build()` if it is missing or if there is no cache.
+    '''
+    if cache is None:
+        return build()
+    return cache.get_or_build(cache.key(kind, config, index), build,
+                              dump=dump, load=load)
+
+
+def start_simulation(config, manager, timings=None):
     steps = config['General']['steps']
-    with Timer('retina and lamina simulation'):
+    timings = {} if timings is None else timings
+    with ct.timed(timings, 'retina and lamina simulation'):
         manager.spawn()
         manager.start(steps=steps)
         manager.wait()
+    fs.report()
+    eyes = range(config['General']['eye_num'])
+    rp.summarize(config, [get_retina_id(i) for i in eyes] +
+                 [get_lamina_id(i) for i in eyes])
 
 
 def change_config(config, index):
@@ -241,7 +259,7 @@ def change_config(config, index):
         config['General']['dt'] = values[index]
 
 
-def get_input_gen(config, retina):
+def get_input_gen(config, retina, index=0):
     '''
         Depending on configuration input can either be created
         in advance and read from file or
@@ -251,15 +269,73 @@ def get_input_gen(config, retina):
     inputmethod = config['Retina']['inputmethod']
 
     if inputmethod == 'read':
-        print('Generating input files')
-        with Timer('input generation'):
-            gi.gen_input(config)
-        return None
+        return RetinaFileInputProcessor(config, retina, index)
     else:
         print('Using input generating function')
+        if config['Retina']['lookahead'] > 0:
+            return LookaheadRetinaInputProcessor(config, retina, index)
         return RetinaInputProcessor(config, retina)
 
 
+def prepare_input(config, timings=None):
+    '''
+        Writes the input files that are read during simulation
+        if inputs are not generated on the fly
+    '''
+    timings = {} if timings is None else timings
+    if config['Retina']['inputmethod'] == 'read':
+        print('Generating input files')
+        with ct.timed(timings, 'input generation'):
+            gi.gen_input(config)
+
+
+def get_arrays(config, index=0):
+    '''
+        Retina and lamina array objects of the configured geometry
+        of eye `index`
+    '''
+    num_rings = config['Retina']['rings']
+    eulerangles = gi.get_eulerangles(config, index)
+    radius = config['Retina']['radius']
+
+    transform = AlbersProjectionMap(radius, eulerangles).invmap
+    r_hexagon = r_hx.HexagonArray(num_rings=num_rings, radius=radius,
+                                  transform=transform)
+    l_hexagon = l_hx.HexagonArray(num_rings=num_rings, radius=radius,
+                                  transform=transform)
+
+    retina = ret.RetinaArray(r_hexagon, config)
+    lamina = lam.LaminaArray(l_hexagon, config)
+    return retina, lamina
+
+
+def add_LPUs(config, arrays, manager, cache=None, exporter=None):
+    '''
+        Adds retina and lamina LPUs of each eye and the patterns between
+        them to `manager`, placed on the GPUs of [Placement]
+
+        --
+        arrays: list of (retina, lamina) array objects of each eye
+    '''
+    # each eye on its own pair of GPUs unless the placement is better
+    baseline = {}
+    for i in range(len(arrays)):
+        baseline[get_retina_id(i)] = 2*i
+        baseline[get_lamina_id(i)] = 2*i + 1
+    placement = pl.Placement.from_config(config, manager, baseline=baseline)
+
+    for i, (retina, lamina) in enumerate(arrays):
+        with tr.span('LPUs of eye', eye=i):
+            add_retina_LPU(config, i, retina, placement, cache=cache,
+                           exporter=exporter)
+            add_lamina_LPU(config, i, lamina, placement, cache=cache,
+                           exporter=exporter)
+
+            connect_retina_lamina(config, i, retina, lamina, placement,
+                                  cache=cache, exporter=exporter)
+    placement.apply()
+
+
 def get_config_obj(args):
     '''
         Gets the configuration object that reads and
@@ -283,12 +359,6 @@ def get_config_obj(args):
 def main():
     import neurokernel.mpi_relaunch
 
-    # default limit is low for pickling
-    # the data structures passed through mpi
-    sys.setrecursionlimit(RECURSION_LIMIT)
-    resource.setrlimit(resource.RLIMIT_STACK,
-                       (resource.RLIM_INFINITY, resource.RLIM_INFINITY))
-
     parser = argparse.ArgumentParser()
     parser.add_argument('-c', '--config', default='default',
                         help='configuration file')
@@ -297,38 +367,45 @@ def main():
                              'by changing this script accordingly. '
                              'It is useful when need to run this script '
                              'repeatedly for different configuration')
+    parser.add_argument('--clear-cache', action='store_true',
+                        help='remove cached connectivity before running')
 
     args = parser.parse_args()
 
-    with Timer('getting configuration'):
+    with tr.span('getting configuration'):
         conf_obj = get_config_obj(args)
         config = conf_obj.conf
         change_config(config, args.value)
 
     setup_logging(config)
+    tr.configure(config)
+    fs.setup_transfer(config)
 
-    num_rings = config['Retina']['rings']
-    eulerangles = config['Retina']['eulerangles']
-    radius = config['Retina']['radius']
+    cache = cc.ConnectivityCache.from_config(config)
+    exporter = ex.GraphExporter.from_config(config)
+    if args.clear_cache:
+        cache.invalidate()
+
+    timings = {}
+    prepare_input(config, timings)
 
     manager = core.Manager()
     
-    with Timer('instantiation of retina and lamina'):
-        transform = AlbersProjectionMap(radius, eulerangles).invmap
-        r_hexagon = r_hx.HexagonArray(num_rings=num_rings, radius=radius,
-                                      transform=transform)
-        l_hexagon = l_hx.HexagonArray(num_rings=num_rings, radius=radius,
-                                      transform=transform)
-
-        retina = ret.RetinaArray(r_hexagon, config)
-        lamina = lam.LaminaArray(l_hexagon, config)
+    with ct.timed(timings, 'instantiation of retina and lamina'):
+        arrays = [get_arrays(config, i)
+                  for i in range(config['General']['eye_num'])]
+        add_LPUs(config, arrays, manager, cache=cache, exporter=exporter)
+    print('Connectivity cache hits: {}, misses: {}'.format(cache.hits,
+                                                          cache.misses))
 
-        add_retina_LPU(config, 0, retina, manager)
-        add_lamina_LPU(config, 0, lamina, manager)
+    start_simulation(config, manager, timings)
 
-        connect_retina_lamina(config, 0, retina, lamina, manager)
+    with ct.timed(timings, 'waiting for graph export'):
+        exporter.wait()
 
-    start_simulation(config, manager)
+    for i in range(config['General']['eye_num']):
+        ct.register_run(config, timings, index=i)
+    tr.write_trace(config)
 
 
 if __name__ == '__main__':
@@ -15,7 +15,6 @@ setattr(pyorient.ogm.graph, 'orientdb_version',
 import neurokernel.core_gpu as core
 from neurokernel.pattern import Pattern
 from neurokernel.tools.logging import setup_logger
-from neurokernel.tools.timing import Timer
 from neurokernel.LPU.LPU import LPU
 
 import neuroarch.models as models
@@ -35,6 +34,7 @@ from retina.NDComponents.MembraneModels.BufferPhoton import BufferPhoton
 from retina.NDComponents.MembraneModels.BufferVoltage import BufferVoltage
 
 import gen_input as gi
+import tracing as tr
 
 dtype = np.double
 RECURSION_LIMIT = 80000
@@ -110,7 +110,7 @@ def add_retina_LPU(config, retina_index, manager, graph):
     if inputmethod == 'read':
         print('Generating input files')
         print('Reading retina input from file is not supported yet')
-        with Timer('input generation'):
+        with tr.span('input generation'):
             input_processor = RetinaFileInputProcessor(config, retina)
     else:
         print('Using input generating function')
@@ -202,7 +202,7 @@ def connect_retina_lamina(config, index, manager, graph):
     nx.write_gexf(pattern.to_graph(), retina_id+'_'+lamina_id+'_new.gexf.gz',
                       prettyprint=True)
     
-    with Timer('update of connections in Manager'):
+    with tr.span('update of connections in Manager'):
         manager.connect(retina_id, lamina_id, pattern,
                         int_0 = key_order.index('retina'),
                         int_1 = key_order.index('lamina'))
@@ -210,7 +210,7 @@ def connect_retina_lamina(config, index, manager, graph):
 
 def start_simulation(config, manager):
     steps = config['General']['steps']
-    with Timer('retina and lamina simulation'):
+    with tr.span('retina and lamina simulation'):
         manager.spawn()
         manager.start(steps=steps)
         manager.wait()
@@ -250,7 +250,7 @@ def get_input_gen(config, retina):
 
     if inputmethod == 'read':
         print('Generating input files')
-        with Timer('input generation'):
+        with tr.span('input generation'):
             gi.gen_input(config)
         return None
     else:
@@ -298,12 +298,13 @@ def main():
 
     args = parser.parse_args()
 
-    with Timer('getting configuration'):
+    with tr.span('getting configuration'):
         conf_obj = get_config_obj(args)
         config = conf_obj.conf
         change_config(config, args.value)
 
     setup_logging(config)
+    tr.configure(config)
 
     num_rings = config['Retina']['rings']
     eulerangles = config['Retina']['eulerangles']
@@ -316,7 +317,7 @@ def main():
 
     manager = core.Manager()
     
-    with Timer('instantiation of retina and lamina'):
+    with tr.span('instantiation of retina and lamina'):
         add_retina_LPU(config, 0, manager, graph)
         add_lamina_LPU(config, 0, manager, graph)
 
@@ -324,6 +325,8 @@ def main():
 
     start_simulation(config, manager)
 
+    tr.write_trace(config)
+
 
 if __name__ == '__main__':
     main()
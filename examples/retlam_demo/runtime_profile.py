@@ -0,0 +1,182 @@
+'''
+    Per-step runtime profile of LPUs.
+
+    ProfiledLPU measures every `interval`th step of the simulation and
+    splits it into input processing, compute of the components, output
+    processing and the exchange of data with other LPUs. On measured
+    steps the GPU is synchronized, so that asynchronous kernels are
+    accounted to the step that launched them; other steps run untouched.
+    At the end of the run each LPU writes histograms of the components
+    and its slowest steps to profile_<LPU id><suffix>.json next to the
+    output files, and the demo prints a table over all LPUs.
+'''
+from __future__ import division
+
+import json
+import os
+import time
+
+import numpy as np
+
+from neurokernel.LPU.LPU import LPU
+
+_clock = getattr(time, 'perf_counter', time.time)
+
+COMPONENTS = ['input', 'compute', 'output', 'exchange']
+HISTOGRAM_BINS = 20
+
+
+def get_profile_file(lpu_id, suffix=''):
+    return 'profile_{}{}.json'.format(lpu_id, suffix)
+
+
+def get_lpu(config, lpu_id):
+    '''
+        LPU class and the keyword arguments to add to `manager.add`
+        for LPU `lpu_id` according to [General] profile_interval
+    '''
+    interval = config['General']['profile_interval']
+    if interval == 0:
+        return LPU, {}
+    return ProfiledLPU, {
+        'profile_interval': interval,
+        'profile_slowest': config['General']['profile_slowest'],
+        'profile_file': get_profile_file(
+            lpu_id, config['General']['file_suffix'])}
+
+
+class ProfiledLPU(LPU):
+    '''
+        LPU that profiles every `profile_interval`th step.
+        Takes the arguments of LPU and
+
+        --
+        profile_interval: steps between measured steps
+        profile_slowest: number of slowest steps in the report
+        profile_file: file of the report
+    '''
+    def __init__(self, *args, **kwargs):
+        self.profile_interval = kwargs.pop('profile_interval', 100)
+        self.profile_slowest = kwargs.pop('profile_slowest', 10)
+        self.profile_file = kwargs.pop('profile_file', None)
+        super(ProfiledLPU, self).__init__(*args, **kwargs)
+        self._profile_step = 0
+        self._sampling = False
+        self._sample = None
+        self._samples = []
+
+    def pre_run(self):
+        super(ProfiledLPU, self).pre_run()
+        for component, processors in [('input', self.input_processors),
+                                      ('output', self.output_processors)]:
+            for processor in processors:
+                processor.run_step = self._timed(processor.run_step,
+                                                 component)
+        try:
+            import pycuda.driver as cuda
+            self._synchronize = cuda.Context.synchronize
+        except ImportError:
+            self._synchronize = lambda: None
+
+    def _timed(self, method, component):
+        def timed(*args, **kwargs):
+            if not self._sampling:
+                return method(*args, **kwargs)
+            start = _clock()
+            try:
+                return method(*args, **kwargs)
+            finally:
+                self._synchronize()
+                self._sample[component] += _clock() - start
+        return timed
+
+    def run_step(self):
+        self._sampling = self._profile_step % self.profile_interval == 0
+        if not self._sampling:
+            self._profile_step += 1
+            return super(ProfiledLPU, self).run_step()
+
+        self._synchronize()
+        self._sample = dict((c, 0.) for c in COMPONENTS)
+        self._sample['step'] = self._profile_step
+        self._samples.append(self._sample)
+        start = _clock()
+        super(ProfiledLPU, self).run_step()
+        self._synchronize()
+        total = _clock() - start
+        self._sample['compute'] = total - self._sample['input'] - \
+            self._sample['output']
+        self._profile_step += 1
+
+    def _sync(self):
+        # exchange is accounted to the last measured step
+        if not self._sampling:
+            return super(ProfiledLPU, self)._sync()
+        start = _clock()
+        try:
+            return super(ProfiledLPU, self)._sync()
+        finally:
+            self._sample['exchange'] += _clock() - start
+
+    def post_run(self):
+        super(ProfiledLPU, self).post_run()
+        if self.profile_file is not None and self._samples:
+            report = profile_report(self.id, self._samples,
+                                    self.profile_interval,
+                                    self.profile_slowest)
+            with open(self.profile_file, 'w') as f:
+                json.dump(report, f, indent=2)
+
+
+def profile_report(lpu_id, samples, interval, slowest=10):
+    '''
+        Statistics, histograms and slowest steps of the measured steps
+    '''
+    components = {}
+    for component in COMPONENTS:
+        values = np.array([s[component] for s in samples])
+        counts, edges = np.histogram(values, bins=HISTOGRAM_BINS)
+        components[component] = {
+            'mean': float(values.mean()),
+            'p50': float(np.percentile(values, 50)),
+            'p90': float(np.percentile(values, 90)),
+            'p99': float(np.percentile(values, 99)),
+            'max': float(values.max()),
+            'histogram': {'edges': edges.tolist(),
+                          'counts': counts.tolist()}}
+    # copies, the samples of the caller are left unchanged
+    totals = [dict(s, total=sum(s[c] for c in COMPONENTS))
+              for s in samples]
+    slowest_steps = sorted(totals, key=lambda s: s['total'],
+                           reverse=True)[:slowest]
+    return {'lpu': lpu_id, 'interval': interval, 'samples': len(samples),
+            'components': components, 'slowest_steps': slowest_steps}
+
+
+def summarize(config, lpu_ids):
+    '''
+        Prints mean time per step of each component and the slowest
+        steps of the LPUs from their report files
+    '''
+    if config['General']['profile_interval'] == 0:
+        return
+    suffix = config['General']['file_suffix']
+    lines = ['{:<12} {:>8}'.format('LPU', 'samples') +
+             ''.join('{:>12}'.format(c + ' ms') for c in COMPONENTS) +
+             '{:>14}'.format('slowest step')]
+    for lpu_id in lpu_ids:
+        filename = get_profile_file(lpu_id, suffix)
+        if not os.path.exists(filename):
+            continue
+        with open(filename) as f:
+            report = json.load(f)
+        slowest = report['slowest_steps'][0]
+        lines.append('{:<12} {:>8}'.format(lpu_id, report['samples']) +
+                     ''.join('{:>12.3f}'.format(
+                         report['components'][c]['mean']*1e3)
+                         for c in COMPONENTS) +
+                     '{:>14}'.format('{} ({:.1f} ms)'.format(
+                         slowest['step'], slowest['total']*1e3)))
+    print('Runtime profile (every {} steps)'.format(
+        config['General']['profile_interval']))
+    print('\n'.join(lines))
@@ -0,0 +1,137 @@
+'''
+    Receptive field filter that runs on the CPU.
+
+    Receptive field weights of every photoreceptor over the screen grid
+    are computed once and kept as a sparse matrix, so that filtering a
+    batch of frames is a single sparse x dense product. It has the same
+    interface as the receptive field classes of the retina package
+    (`load_parameters`, `filter`, `refa`, `refb`) and needs no GPU.
+'''
+from __future__ import division
+
+import numpy as np
+import scipy.sparse as sp
+from scipy.spatial import cKDTree
+
+# receptive fields are truncated at this many standard deviations
+CUTOFF_SIGMAS = 3.0
+
+
+def screen_directions(dima, dimb, screen_type, radius=1.0):
+    '''
+        Unit vectors from the center of the eye to points of a screen.
+
+        For the sphere screen (dima, dimb) are elevation and azimuth,
+        for the cylinder screen they are height and azimuth.
+    '''
+    dima = np.asarray(dima, dtype=np.double).ravel()
+    dimb = np.asarray(dimb, dtype=np.double).ravel()
+    if screen_type == 'Sphere':
+        return np.column_stack([np.cos(dima)*np.cos(dimb),
+                                np.cos(dima)*np.sin(dimb),
+                                np.sin(dima)])
+    elif screen_type == 'Cylinder':
+        points = np.column_stack([radius*np.cos(dimb),
+                                  radius*np.sin(dimb),
+                                  dima])
+        return points/np.linalg.norm(points, axis=1)[:, None]
+    raise ValueError('Invalid screen type: {}'.format(screen_type))
+
+
+def screen_area_weights(dima, screen_type):
+    '''
+        Relative area of screen points, the grid of the sphere is
+        denser close to the poles
+    '''
+    dima = np.asarray(dima, dtype=np.double).ravel()
+    if screen_type == 'Sphere':
+        return np.abs(np.cos(dima))
+    return np.ones_like(dima)
+
+
+class SparseReceptiveFields(object):
+    '''
+        Gaussian receptive fields on a screen grid whose full width
+        at half maximum is the acceptance angle. Each row of the
+        weight matrix is normalized to sum to 1, so a uniform screen
+        gives every photoreceptor the screen intensity.
+
+        --
+        grid: (dima, dimb) arrays of screen grid coordinates
+        screen_type: 'Sphere' or 'Cylinder'
+        dtype: type of weights and of filtered output
+    '''
+    def __init__(self, grid, screen_type, dtype=np.double):
+        self.grid = grid
+        self.screen_type = screen_type
+        self.dtype = dtype
+        self.weights = None
+
+    def load_parameters(self, refa, refb, acceptance_angle, radius=1.0,
+                        weights=None):
+        '''
+            refa, refb: screen coordinates of receptive field centers
+            acceptance_angle: acceptance angle of photoreceptors in
+                radians, scalar or one per photoreceptor
+            radius: radius of screen
+            weights: precomputed weight matrix of the same parameters
+                (e.g. from a cache) or None to compute it
+        '''
+        self.refa = refa
+        self.refb = refb
+        self.acceptance_angle = acceptance_angle
+        self.radius = radius
+        if weights is None:
+            weights = self._compute_weights()
+        self.weights = weights
+
+    def _compute_weights(self):
+        dima, dimb = self.grid
+        grid_dirs = screen_directions(dima, dimb, self.screen_type,
+                                      self.radius)
+        area = screen_area_weights(dima, self.screen_type)
+
+        centers = screen_directions(self.refa, self.refb, self.screen_type,
+                                    self.radius)
+        num_rfs = len(centers)
+        sigma = np.broadcast_to(
+            np.asarray(self.acceptance_angle, dtype=np.double) /
+            (2*np.sqrt(2*np.log(2))), (num_rfs,))
+
+        # angular cutoff to chord length on the unit sphere
+        cutoff = np.minimum(CUTOFF_SIGMAS*sigma, np.pi)
+        chord = 2*np.sin(cutoff/2)
+
+        tree = cKDTree(grid_dirs)
+        rows, cols, values = [], [], []
+        for i in range(num_rfs):
+            # centers that fall outside the screen (nan) get no input
+            if not np.all(np.isfinite(centers[i])):
+                continue
+            idx = np.asarray(tree.query_ball_point(centers[i], chord[i]),
+                             dtype=np.int64)
+            if len(idx) == 0:
+                continue
+            cos_angle = np.clip(grid_dirs[idx].dot(centers[i]), -1, 1)
+            angle = np.arccos(cos_angle)
+            w = np.exp(-angle**2/(2*sigma[i]**2))*area[idx]
+            rows.append(np.full(len(idx), i, dtype=np.int64))
+            cols.append(idx)
+            values.append(w/w.sum())
+
+        if rows:
+            rows, cols, values = [np.concatenate(a)
+                                  for a in (rows, cols, values)]
+        return sp.csr_matrix((np.asarray(values, dtype=self.dtype),
+                              (np.asarray(rows, dtype=np.int64),
+                               np.asarray(cols, dtype=np.int64))),
+                             shape=(num_rfs, len(grid_dirs)))
+
+    def filter(self, images):
+        '''
+            images: array of frames with shape (steps,) + grid shape
+            returns: array of inputs with shape (steps, photoreceptors)
+        '''
+        frames = np.asarray(images, dtype=self.dtype).reshape(
+            len(images), -1)
+        return np.ascontiguousarray(self.weights.dot(frames.T).T)
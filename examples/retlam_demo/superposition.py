@@ -0,0 +1,122 @@
+'''
+    Vectorized construction of the retina-lamina connection pattern.
+
+    The neural superposition rule (NeurokernelRFC#2) sends photoreceptor
+    Rk of ommatidium o to the Rk input of a neighboring cartridge. Instead
+    of walking the retina selectors one string at a time, the whole
+    ommatidium x photoreceptor -> cartridge mapping is kept as integer
+    arrays and the Pattern is assembled directly from port index arrays.
+'''
+import numpy as np
+import pandas as pd
+
+from neurokernel.pattern import Pattern
+
+from naming import PHOTOR_NAMES
+AGG_SUFFIX = '_agg'
+
+
+def _selector_prefix(selector):
+    # format should be '/<lpu>/<id>/<neuronname>'
+    return selector.split('/')[1]
+
+
+def superposition_table(rulemap, num_ommatidia, names=PHOTOR_NAMES):
+    '''
+        Returns an integer array of shape (num_ommatidia, len(names)) whose
+        entry [o, k] is the cartridge that receives photoreceptor names[k]
+        of ommatidium o.
+
+        The rule map only answers scalar queries, so it is consulted once
+        per (ommatidium, photoreceptor) pair on plain integers; everything
+        downstream operates on the resulting table.
+    '''
+    table = np.empty((num_ommatidia, len(names)), dtype=np.int64)
+    for k, name in enumerate(names):
+        table[:, k] = np.fromiter(
+            (rulemap.neighbor_for_photor(ommid, name)
+             for ommid in range(num_ommatidia)),
+            dtype=np.int64, count=num_ommatidia)
+    return table
+
+
+def superposition_arrays(retina, names=PHOTOR_NAMES):
+    '''
+        Flattened form of `superposition_table`.
+
+        Returns
+        -------
+        ommids, cartids: integer arrays of the source ommatidium and
+            target cartridge of every photoreceptor
+        name_idx: index in `names` of every photoreceptor
+    '''
+    num_ommatidia = retina.num_elements
+    table = superposition_table(retina.rulemap, num_ommatidia, names)
+    ommids = np.repeat(np.arange(num_ommatidia), len(names))
+    name_idx = np.tile(np.arange(len(names)), num_ommatidia)
+    return ommids, table.ravel(), name_idx
+
+
+def build_retina_lamina_pattern(retina, lamina, agg=True,
+                                names=PHOTOR_NAMES):
+    '''
+        Builds the Pattern between retina and lamina without parsing
+        selector strings.
+
+        Parameters
+        ----------
+        retina: retina array object
+        lamina: lamina array object
+        agg: if True also connect the '<name>_agg' feedback ports from
+            each lamina cartridge back to the originating photoreceptor
+        names: photoreceptor names that project to the lamina
+
+        Returns
+        -------
+        pattern: Pattern with interface 0 the retina and 1 the lamina
+    '''
+    ret_prefix = _selector_prefix(retina.get_all_selectors()[0])
+    lam_prefix = _selector_prefix(lamina.get_selector(0, names[0]))
+
+    ommids, cartids, name_idx = superposition_arrays(retina, names)
+    num = len(ommids)
+    photor_names = np.array(names, dtype=object)[name_idx]
+    ret_tokens = np.full(num, ret_prefix, dtype=object)
+    lam_tokens = np.full(num, lam_prefix, dtype=object)
+
+    # each entry is (interface, prefixes, ids, names) of a group of ports
+    from_ports = [(0, ret_tokens, ommids, photor_names)]
+    to_ports = [(1, lam_tokens, cartids, photor_names)]
+    if agg:
+        agg_names = np.array([n + AGG_SUFFIX for n in names],
+                             dtype=object)[name_idx]
+        from_ports.append((1, lam_tokens, cartids, agg_names))
+        to_ports.append((0, ret_tokens, ommids, agg_names))
+
+    def _concat(groups, field):
+        return np.concatenate([g[field] for g in groups])
+
+    # a pattern port receiving data from an LPU is an input port of the
+    # pattern and vice versa, this matches `Pattern.from_concat`
+    int_groups = from_ports + to_ports
+    interface = np.repeat([g[0] for g in int_groups], num)
+    io = np.repeat(np.array(['in']*len(from_ports) + ['out']*len(to_ports),
+                            dtype=object), num)
+
+    int_index = pd.MultiIndex.from_arrays(
+        [_concat(int_groups, 1), _concat(int_groups, 2),
+         _concat(int_groups, 3)], names=[0, 1, 2])
+    df_int = pd.DataFrame({'interface': interface, 'io': io,
+                           'type': np.full(len(io), 'gpot', dtype=object)},
+                          index=int_index,
+                          columns=['interface', 'io', 'type'])
+
+    pat_index = pd.MultiIndex.from_arrays(
+        [_concat(from_ports, 1), _concat(from_ports, 2),
+         _concat(from_ports, 3),
+         _concat(to_ports, 1), _concat(to_ports, 2), _concat(to_ports, 3)],
+        names=['from_0', 'from_1', 'from_2', 'to_0', 'to_1', 'to_2'])
+    df_pat = pd.DataFrame({'conn': np.ones(len(pat_index), dtype=np.int64)},
+                          index=pat_index)
+
+    return Pattern.from_df(df_int, df_pat)
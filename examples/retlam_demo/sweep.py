@@ -0,0 +1,349 @@
+'''
+    Runs a sweep of retina/lamina simulations.
+
+    The sweep is a grid of configuration overrides, e.g.
+
+        $ python sweep.py -p General.dt=5e-4,1e-3,2e-3 -p Retina.rings=10,14
+
+    runs the 6 combinations. Input files are generated once for all
+    points with the same stimulus. Each point then runs in a child
+    process of its own, which does its own MPI relaunch, and up to
+    `-j` points run at the same time on disjoint sets of GPUs.
+    Children share the retina, lamina and pattern structures through
+    the on-disk connectivity cache ([Cache] enabled = true). Outputs
+    of point i are written with file suffix `<file_suffix>__<i>` and
+    the overrides of each point are listed in `sweep<file_suffix>.json`.
+'''
+import argparse
+import ast
+import collections
+import copy
+import itertools
+import json
+import os
+import subprocess
+import sys
+import time
+import traceback
+
+import neurokernel.core_gpu as core
+
+import catalog as ct
+import conncache as cc
+import export as ex
+import flatspec as fs
+import gen_input as gi
+import naming
+import placement as pl
+import retlam_demo as rd
+import tracing as tr
+
+# GPUs of an eye of a point, one for the retina and one for the lamina
+DEVICES_PER_EYE = 2
+# seconds between checks of running points
+POLL_INTERVAL = 0.5
+
+# configuration values input files depend on, [InputType]
+# configures the stimulus
+INPUT_DEPENDENCIES = {'General': ['dt', 'steps', 'eye_num'],
+                      'Retina': None, 'Screen': None, 'InputType': None}
+
+
+def parse_value(text):
+    try:
+        return ast.literal_eval(text)
+    except (ValueError, SyntaxError):
+        return text
+
+
+def parse_parameter(text):
+    '''
+        'Section.key=v1,v2' or 'Section.key=[v1, v2]'
+        to ('Section.key', [v1, v2])
+    '''
+    name, _, values = text.partition('=')
+    if not values:
+        raise ValueError('Expected Section.key=values, got {}'.format(text))
+    values = values.strip()
+    if values.startswith('['):
+        values = ast.literal_eval(values)
+    else:
+        values = [parse_value(v.strip()) for v in values.split(',')]
+    return name.strip(), values
+
+
+def expand_grid(grid):
+    '''
+        List of override dictionaries, one per combination of the values
+        of `grid` (list of (name, values) pairs)
+    '''
+    names = [name for name, _ in grid]
+    return [dict(zip(names, values))
+            for values in itertools.product(*[v for _, v in grid])]
+
+
+def apply_overrides(config, overrides):
+    '''
+        Copy of `config` with values 'Section.key' of `overrides`
+    '''
+    point_config = config.dict() if hasattr(config, 'dict') \
+        else copy.deepcopy(config)
+    for name, value in overrides.items():
+        section, _, key = name.rpartition('.')
+        target = point_config
+        for part in section.split('.'):
+            if part not in target:
+                raise KeyError('No section {} in configuration'.format(
+                    section))
+            target = target[part]
+        if key not in target:
+            raise KeyError('No option {} in configuration'.format(name))
+        target[key] = value
+    return point_config
+
+
+def _input_files(config, suffix):
+    input_filename = config['Retina']['input_file']
+    for i in range(config['General']['eye_num']):
+        yield naming.data_file(input_filename, i, suffix)
+        yield 'intensities{}{}.h5'.format(suffix, i)
+
+
+def _link(source, target):
+    if os.path.lexists(target):
+        os.remove(target)
+    os.symlink(os.path.basename(source), target)
+
+
+def input_digest(config):
+    '''
+        Hash of the configuration values the input files depend on,
+        points with the same hash share their input files
+    '''
+    return cc.config_digest(config, INPUT_DEPENDENCIES)
+
+
+class SharedInputs(object):
+    '''
+        Input files of a sweep, written once per distinct stimulus
+    '''
+    def __init__(self):
+        self._inputs = {}
+
+    def prepare_input(self, config, timings=None):
+        '''
+            Writes input files of `config`, or links them to those of an
+            earlier point with the same stimulus
+        '''
+        if config['Retina']['inputmethod'] != 'read':
+            return
+        suffix = config['General']['file_suffix']
+        digest = input_digest(config)
+        if digest not in self._inputs:
+            rd.prepare_input(config, timings)
+            self._inputs[digest] = suffix
+            return
+        for source, target in zip(
+                _input_files(config, self._inputs[digest]),
+                _input_files(config, suffix)):
+            _link(source, target)
+
+
+def device_slots(config, points, max_parallel):
+    '''
+        Disjoint lists of GPUs, one per point that runs at the same
+        time, at most `max_parallel` and as many as the GPUs of
+        [Placement] (by default all) allow
+    '''
+    devices = list(config['Placement']['devices'] or pl.get_devices())
+    per_point = DEVICES_PER_EYE*max(p['config']['General']['eye_num']
+                                    for p in points)
+    num_slots = max(1, min(max_parallel, len(devices) // per_point))
+    return [devices[k*per_point:(k + 1)*per_point]
+            for k in range(num_slots)]
+
+
+def point_file(suffix):
+    return 'sweep_point{}.json'.format(suffix)
+
+
+def point_command(filename):
+    '''
+        Command that runs the point of `filename` in a child process
+    '''
+    script = os.path.splitext(os.path.abspath(__file__))[0] + '.py'
+    return [sys.executable, script, '--point', filename]
+
+
+def run_point(config, timings):
+    '''
+        Simulates one point, structures are looked up in the
+        connectivity cache of the configuration
+    '''
+    cache = cc.ConnectivityCache.from_config(config)
+    exporter = ex.GraphExporter.from_config(config)
+    manager = core.Manager()
+    with tr.span('sweep point', suffix=config['General']['file_suffix']):
+        with ct.timed(timings, 'instantiation of retina and lamina'):
+            arrays = [rd.get_arrays(config, i)
+                      for i in range(config['General']['eye_num'])]
+            rd.add_LPUs(config, arrays, manager, cache=cache,
+                        exporter=exporter)
+        rd.start_simulation(config, manager, timings)
+    with tr.span('waiting for graph export'):
+        exporter.wait()
+    print('Connectivity cache hits: {}, misses: {}'.format(cache.hits,
+                                                          cache.misses))
+
+
+def run_point_file(filename):
+    '''
+        Runs the point written to `filename` by `run_sweep` and adds
+        its timings and error (None if it completed) to the file
+    '''
+    with open(filename) as f:
+        point = json.load(f)
+    config = point['config']
+    rd.setup_logging(config)
+    tr.configure(config)
+    fs.setup_transfer(config)
+    try:
+        run_point(config, point['timings'])
+    except Exception:
+        point['error'] = traceback.format_exc()
+        print('Point {} failed:\n{}'.format(point['suffix'],
+                                            point['error']))
+    with open(filename, 'w') as f:
+        json.dump(point, f)
+    tr.write_trace(config)
+    return point
+
+
+def _finish(point, returncode):
+    # results written by the child, if it got that far
+    with open(point_file(point['suffix'])) as f:
+        point.update(json.load(f))
+    if point['error'] is None and returncode != 0:
+        point['error'] = 'Point process exited with code {}'.format(
+            returncode)
+    if point['error'] is not None:
+        print('Point {} failed'.format(point['suffix']))
+
+
+def run_sweep(config, grid, max_parallel=1):
+    '''
+        Runs a simulation per point of `grid` in child processes, up to
+        `max_parallel` at a time, and returns the list of points,
+        dictionaries with the file suffix, overrides and error (None if
+        the point completed) of each point.
+
+        --
+        config: base configuration
+        grid: list of ('Section.key', values) pairs
+        max_parallel: maximum number of points run at the same time
+    '''
+    base_suffix = config['General']['file_suffix']
+    points = []
+    for i, overrides in enumerate(expand_grid(grid)):
+        point_config = apply_overrides(config, overrides)
+        point_config['General']['file_suffix'] = '{}__{}'.format(
+            base_suffix, i)
+        points.append({'suffix': point_config['General']['file_suffix'],
+                       'overrides': overrides, 'config': point_config,
+                       'timings': {}, 'error': None})
+
+    # the stimulus is generated in order, so inputs are prepared
+    # before points run
+    inputs = SharedInputs()
+    for point in points:
+        inputs.prepare_input(point['config'], point['timings'])
+    # receptive fields of points that generate inputs ahead of their
+    # simulation, those of points that read inputs are cached above
+    ahead = [p['config']['Retina'] for p in points
+             if p['config']['Retina']['inputmethod'] == 'generate' and
+             p['config']['Retina']['lookahead'] > 0]
+    if ahead and config['Cache']['enabled']:
+        with tr.span('prewarming receptive fields', geometries=len(ahead)):
+            gi.prewarm_receptive_fields(config, ahead)
+
+    free = device_slots(config, points, max_parallel)
+    pending = collections.deque(points)
+    running = {}
+    with tr.span('sweep points', points=len(points), parallel=len(free)):
+        while pending or running:
+            while pending and free:
+                point = pending.popleft()
+                devices = free.pop(0)
+                point['config']['Placement']['devices'] = devices
+                filename = point_file(point['suffix'])
+                with open(filename, 'w') as f:
+                    json.dump(point, f)
+                print('Starting point {} on GPUs {}'.format(
+                    point['suffix'], devices))
+                process = subprocess.Popen(point_command(filename))
+                running[process] = (point, devices)
+            time.sleep(POLL_INTERVAL)
+            for process in list(running):
+                if process.poll() is not None:
+                    point, devices = running.pop(process)
+                    _finish(point, process.returncode)
+                    free.append(devices)
+
+    # graph files are complete when the points exit
+    for point in points:
+        status = 'completed' if point['error'] is None else 'failed'
+        for i in range(point['config']['General']['eye_num']):
+            ct.register_run(point['config'], point['timings'],
+                            status=status, index=i)
+
+    with open('sweep{}.json'.format(base_suffix), 'w') as f:
+        json.dump([dict((k, p[k]) for k in ['suffix', 'overrides', 'error'])
+                   for p in points], f, indent=2)
+    return points
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-c', '--config', default='default',
+                        help='configuration file')
+    parser.add_argument('-p', '--param', action='append', default=[],
+                        help='swept parameter, Section.key=v1,v2,...')
+    parser.add_argument('-g', '--grid', default=None,
+                        help='json file with a {"Section.key": [values]} '
+                             'grid, combined with --param')
+    parser.add_argument('-j', '--parallel', type=int, default=1,
+                        help='maximum number of simultaneous points, '
+                             'also limited by the number of GPUs')
+    parser.add_argument('--point', default=None,
+                        help='run the point of a sweep written to this '
+                             'file, used by the sweep itself')
+
+    args = parser.parse_args()
+
+    if args.point is not None:
+        # every point relaunches itself with MPI to spawn its LPUs
+        import neurokernel.mpi_relaunch
+        point = run_point_file(args.point)
+        sys.exit(0 if point['error'] is None else 1)
+
+    grid = []
+    if args.grid is not None:
+        with open(args.grid) as f:
+            grid.extend(sorted(json.load(f).items()))
+    grid.extend(parse_parameter(p) for p in args.param)
+
+    with tr.span('getting configuration'):
+        config = rd.get_config_obj(args).conf
+
+    rd.setup_logging(config)
+    tr.configure(config)
+
+    points = run_sweep(config, grid, max_parallel=args.parallel)
+    failed = [p['suffix'] for p in points if p['error'] is not None]
+    print('Sweep of {} points done, {} failed {}'.format(
+        len(points), len(failed), ' '.join(failed)))
+    tr.write_trace(config)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,69 @@
+import os
+
+import pytest
+
+np = pytest.importorskip('numpy')
+h5py = pytest.importorskip('h5py')
+
+import analysis as an
+import naming
+
+STEPS = 25
+NUM_ELEMENTS = 7
+
+
+def write_output(filename, uids, data):
+    with h5py.File(filename, 'w') as f:
+        f.create_dataset('V/uids', data=np.array(uids, dtype='S'))
+        f.create_dataset('V/data', data=data)
+
+
+def write_files(directory, index=0, suffix=''):
+    # values encode step and column
+    def values(columns):
+        return np.arange(STEPS)[:, None]*100. + np.arange(columns)[None]
+    uids = naming.photoreceptor_uids(NUM_ELEMENTS)
+    with h5py.File(os.path.join(directory, naming.data_file(
+            'retina_input', index, suffix)), 'w') as f:
+        f.create_dataset('array', data=values(len(uids)))
+    write_output(os.path.join(directory, naming.data_file(
+        'retina_output', index, suffix)), uids, values(len(uids)))
+    lamina_uids = ['lam_{}_{}'.format(name, i) for i in range(NUM_ELEMENTS)
+                   for name in naming.PHOTOR_NAMES + ['L1', 'L2']] + \
+        ['lam_Am']
+    write_output(os.path.join(directory, naming.data_file(
+        'lamina_output', index, suffix)), lamina_uids,
+        values(len(lamina_uids)))
+    return lamina_uids
+
+
+def test_read_columns_in_requested_order(tmpdir):
+    write_files(str(tmpdir))
+    filename = os.path.join(str(tmpdir), 'retina_output0.h5')
+    with an.NeuronFile(filename) as nfile:
+        columns = nfile.get_columns('R2', [3, 0])
+        assert columns.tolist() == [19, 1]
+        data = an.collect(an.iter_neurons(nfile, 'R2', [3, 0], step=5,
+                                          chunk_steps=2))
+        np.testing.assert_array_equal(
+            data, np.arange(0, STEPS, 5)[:, None]*100. + [[19, 1]])
+        assert nfile.elements('R1') == list(range(NUM_ELEMENTS))
+        with pytest.raises(KeyError):
+            nfile.get_columns('R1', [NUM_ELEMENTS])
+
+
+def test_summarize_reads_files_of_the_demo(tmpdir):
+    cwd = os.getcwd()
+    os.chdir(str(tmpdir))
+    try:
+        write_files(str(tmpdir), index=1, suffix='__2')
+        output_file = an.summarize(index=1, suffix='__2', step=10)
+        assert output_file == 'analysis1__2.h5'
+        with h5py.File(output_file, 'r') as f:
+            assert f['R1input'].shape == (3, NUM_ELEMENTS)
+            assert f['L1'].shape == (3, NUM_ELEMENTS)
+            # average of R1-R6 columns 8*i to 8*i+5 at step 0
+            np.testing.assert_allclose(
+                f['Rb'][0], [8*i + 2.5 for i in range(NUM_ELEMENTS)])
+    finally:
+        os.chdir(cwd)
@@ -0,0 +1,85 @@
+import threading
+
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+import pytest
+
+np = pytest.importorskip('numpy')
+pytest.importorskip('h5py')
+pytest.importorskip('neurokernel')
+
+import async_output as ao
+
+
+def test_chunk_shape():
+    # 8 byte values, 1000 neurons: 131 steps fit in 1 MB
+    assert ao.get_chunk_shape(1000, 1000, 8, 'time') == (131, 1000)
+    assert ao.get_chunk_shape(100, 1000, 8, 'time') == (100, 1000)
+    assert ao.get_chunk_shape(1000, 1000, 8, 'neuron') == (1000, 131)
+    assert ao.get_chunk_shape(1000, 0, 8, 'time')[1] == 1
+
+
+def get_processor(write_block, block_steps=2, queue_blocks=1):
+    # the writer thread without the file of FileOutputProcessor
+    p = ao.AsyncFileOutputProcessor.__new__(ao.AsyncFileOutputProcessor)
+    p.block_steps = block_steps
+    p.variables = {'V': {'output': np.zeros(3)}}
+    p.blocks = {'V': np.zeros((block_steps, 3))}
+    p.block_row = 0
+    p.stats = {'blocks': 0, 'max_queue_depth': 0, 'queue_depth': 0,
+               'flush_time': 0., 'max_flush_time': 0., 'wait_time': 0.}
+    p._queue = queue.Queue(maxsize=queue_blocks)
+    p._error = None
+    p._write_block = write_block
+    p._thread = threading.Thread(target=p._run)
+    p._thread.daemon = True
+    p._thread.start()
+    return p
+
+
+def run_with_timeout(func, timeout=10):
+    result = {}
+
+    def target():
+        try:
+            func()
+        except Exception as e:
+            result['error'] = e
+    thread = threading.Thread(target=target)
+    thread.daemon = True
+    thread.start()
+    thread.join(timeout)
+    assert not thread.is_alive(), 'output processor hangs'
+    return result.get('error')
+
+
+def test_blocks_are_written_in_order():
+    written = []
+    p = get_processor(lambda block: written.append(block['V'][:, 0].copy()))
+    for step in range(7):
+        p.variables['V']['output'][:] = step
+        p.process_output()
+    p._submit_block()
+    p._queue.put(None)
+    p._thread.join()
+    assert np.concatenate(written).tolist() == list(range(7))
+
+
+def test_writer_error_does_not_hang():
+    def write_block(block):
+        raise IOError('disk full')
+    p = get_processor(write_block)
+
+    def simulate():
+        for _ in range(20):
+            p.process_output()
+    error = run_with_timeout(simulate)
+    assert isinstance(error, IOError)
+
+    # the remaining block is dropped and the writer thread exits
+    p._queue.put(None)
+    p._thread.join(10)
+    assert not p._thread.is_alive()
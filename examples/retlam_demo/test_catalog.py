@@ -0,0 +1,122 @@
+import os
+
+import pytest
+
+np = pytest.importorskip('numpy')
+h5py = pytest.importorskip('h5py')
+nx = pytest.importorskip('networkx')
+
+import catalog as ct
+import export as ex
+import naming
+
+SUFFIX = '_test'
+
+
+def get_config(**general):
+    config = {'General': {'file_suffix': SUFFIX, 'dt': 1e-4,
+                          'steps': 10},
+              'Retina': {'inputmethod': 'read', 'gexf_file': 'retina',
+                         'input_file': 'retina_input',
+                         'output_file': 'retina_output', 'rings': 2},
+              'Lamina': {'gexf_file': 'lamina',
+                         'output_file': 'lamina_output'},
+              'Catalog': {'enabled': True, 'path': 'runs.sqlite',
+                          'metrics': True}}
+    config['General'].update(general)
+    return config
+
+
+def write_data(filename, data):
+    with h5py.File(filename, 'w') as f:
+        f.create_dataset('V/data', data=data)
+
+
+def write_run(config, index=0):
+    '''
+        Writes the files of eye `index` of a run under the names
+        used by the demo and gen_input, returns their names
+    '''
+    suffix = config['General']['file_suffix']
+    written = []
+    for section in ['Retina', 'Lamina']:
+        filename = naming.data_file(config[section]['output_file'], index,
+                                    suffix)
+        write_data(filename, np.arange(12, dtype=np.double).reshape(4, 3))
+        written.append(filename)
+    filename = naming.data_file(config['Retina']['input_file'], index,
+                                suffix)
+    write_data(filename, np.zeros((4, 6)))
+    written.append(filename)
+    for template in ['intensities{}{}.h5'.format(suffix, index),
+                     'retina_elev{}.h5', 'retina_azim{}.h5',
+                     'grid_dima{}.h5', 'grid_dimb{}.h5',
+                     'retina_dima{}.h5', 'retina_dimb{}.h5']:
+        filename = template.format(index)
+        write_data(filename, np.zeros(3))
+        written.append(filename)
+
+    exporter = ex.GraphExporter('sync')
+    comp_dict = {'Model': {'id': ['a', 'b'], 'name': ['R1', 'R2']}}
+    for section in ['Retina', 'Lamina']:
+        exporter.export_dicts(comp_dict, [('a', 'b')], '{}{}{}'.format(
+            config[section]['gexf_file'], index, suffix))
+    G = nx.DiGraph()
+    G.add_edge('a', 'b')
+    exporter.export_graph(G, naming.pattern_id(index))
+    written.extend(f for f in os.listdir('.')
+                   if f.endswith(ex.GEXF_EXT))
+    return set(os.path.abspath(f) for f in written)
+
+
+def test_run_files_finds_every_written_file(tmpdir, monkeypatch):
+    monkeypatch.chdir(tmpdir)
+    config = get_config()
+    written = write_run(config)
+    files = ct.run_files(config)
+    assert set(os.path.abspath(f) for f in files.values()) == written
+    assert files['pattern'] == 'retina0_lamina0' + ex.GEXF_EXT
+
+    run_id = ct.register_run(config, timings={'simulation': 1.5})
+    run, = ct.Catalog('runs.sqlite').find()
+    assert run['id'] == run_id
+    assert set(run['files'].values()) == written
+    assert run['timings'] == {'simulation': 1.5}
+    assert run['metrics']['retina_output.steps'] == 4
+    assert run['metrics']['lamina_output.mean'] == pytest.approx(5.5)
+
+
+def test_register_run_is_opt_in(tmpdir, monkeypatch):
+    monkeypatch.chdir(tmpdir)
+    config = get_config()
+    config['Catalog']['enabled'] = False
+    assert ct.register_run(config) is None
+    assert not os.path.exists('runs.sqlite')
+
+
+def test_find(tmpdir):
+    catalog = ct.Catalog(str(tmpdir.join('runs.sqlite')))
+    ids = [catalog.register(get_config(dt=dt, steps=steps))
+           for dt, steps in [(1e-4, 10), (1e-3, 10), (1e-3, 20)]]
+    failed = catalog.register(get_config(), status='failed')
+
+    def found(where=None, status=None):
+        return [run['id'] for run in catalog.find(where, status)]
+
+    assert found({'General.dt': 1e-3}) == ids[1:]
+    assert found({'General.dt': 1e-3, 'General.steps': ('>', 10)}) == \
+        ids[2:]
+    assert found({'General.dt': ('!=', 1e-3)}, status='completed') == \
+        ids[:1]
+    assert found(status='failed') == [failed]
+    with pytest.raises(ValueError):
+        found({'General.dt': ('LIKE', 1e-3)})
+
+
+def test_parse_condition():
+    assert ct.parse_condition('Retina.rings>=14') == \
+        ('Retina.rings', ('>=', 14))
+    assert ct.parse_condition('General.file_suffix=_a') == \
+        ('General.file_suffix', ('=', '_a'))
+    with pytest.raises(ValueError):
+        ct.parse_condition('Retina.rings')
@@ -0,0 +1,88 @@
+import os
+
+import conncache as cc
+
+
+def get_config(**retina):
+    config = {'Retina': {'rings': 3, 'radius': 1.0,
+                         'eulerangles': [0., 0., 0.], 'model': 'retina_model',
+                         'micro': 300, 'worker_num': 1,
+                         'acceptance_factor': 1., 'screentype': 'Sphere'},
+              'Lamina': {'model': 'lamina_model', 'composition': 'Original',
+                         'relative_am': 'custom', 'number_am': 10},
+              'Composition': {}, 'Screen': {'SphereScreen': {}}}
+    config['Retina'].update(retina)
+    return config
+
+
+def test_key_depends_on_dependencies(tmpdir):
+    cache = cc.ConnectivityCache(str(tmpdir))
+    key = cache.key('retina', get_config())
+    assert key == cache.key('retina', get_config())
+    assert key != cache.key('retina', get_config(rings=4))
+    assert key != cache.key('retina', get_config(), index=1)
+    # acceptance angle does not change the graph of the retina
+    assert key == cache.key('retina', get_config(acceptance_factor=2.))
+    assert key.startswith('retina_')
+
+
+def test_key_depends_on_builder_modules(tmpdir, monkeypatch):
+    versions = {}
+    monkeypatch.setattr(cc, '_module_fingerprint',
+                        lambda name: versions.get(name, '0'))
+    cache = cc.ConnectivityCache(str(tmpdir))
+    config = get_config()
+    keys = dict((kind, cache.key(kind, config)) for kind in cc.BUILDERS)
+
+    versions['sparse_rf'] = '1'
+    assert cache.key('rfweights', config) != keys['rfweights']
+    assert cache.key('rf', config) == keys['rf']
+    assert cache.key('retina', config) == keys['retina']
+
+    versions['vision_models.lamina_model'] = '1'
+    assert cache.key('lamina', config) != keys['lamina']
+    assert cache.key('pattern', config) != keys['pattern']
+    assert cache.key('retina', config) == keys['retina']
+
+
+def test_get_or_build(tmpdir):
+    cache = cc.ConnectivityCache(str(tmpdir))
+    calls = []
+
+    def build():
+        calls.append(1)
+        return {'a': [1, 2]}
+    assert cache.get_or_build('k', build) == {'a': [1, 2]}
+    assert cache.get_or_build('k', build) == {'a': [1, 2]}
+    assert len(calls) == 1
+    assert (cache.hits, cache.misses) == (1, 1)
+
+
+def test_disabled_cache_stores_nothing(tmpdir):
+    cache = cc.ConnectivityCache(str(tmpdir), enabled=False)
+    cache.put('k', 1)
+    assert cache.get('k') is None
+    assert os.listdir(str(tmpdir)) == []
+
+
+def test_corrupted_entry_is_removed(tmpdir):
+    cache = cc.ConnectivityCache(str(tmpdir))
+    with open(os.path.join(str(tmpdir), 'k' + cc.ENTRY_EXT), 'wb') as f:
+        f.write(b'not a pickle')
+    assert cache.get('k') is None
+    assert cache.size() == 0
+
+
+def test_eviction_removes_least_recently_used(tmpdir):
+    cache = cc.ConnectivityCache(str(tmpdir))
+    for i, key in enumerate(['a', 'b', 'c']):
+        cache.put(key, b'x'*1000)
+        os.utime(cache._path(key), (i, i))
+    # a is used after b and c were written
+    os.utime(cache._path('a'), (10, 10))
+    entry_size = os.path.getsize(cache._path('a'))
+    cache.max_size = 2*entry_size
+    cache.evict()
+    assert os.path.exists(cache._path('a'))
+    assert not os.path.exists(cache._path('b'))
+    assert os.path.exists(cache._path('c'))
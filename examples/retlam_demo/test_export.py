@@ -0,0 +1,69 @@
+import os
+
+import pytest
+
+nx = pytest.importorskip('networkx')
+
+import export as ex
+
+
+def get_dicts():
+    comp_dict = {'MorrisLecar': {'id': ['lam_L1_0', 'lam_L2_0'],
+                                 'name': ['L1', 'L2'], 'V1': [0.1, 0.2]}}
+    conns = [('lam_L1_0', 'lam_L2_0', {'delay': 1})]
+    return comp_dict, conns
+
+
+def export_all(mode):
+    exporter = ex.GraphExporter(mode)
+    G = nx.DiGraph()
+    G.add_edge('a', 'b', weight=1.)
+    exporter.export_graph(G, 'retina0')
+    exporter.export_dicts(get_dicts()[0], get_dicts()[1], 'lamina0')
+    return exporter
+
+
+def test_none(tmpdir, monkeypatch):
+    monkeypatch.chdir(tmpdir)
+    export_all('none').wait()
+    assert os.listdir('.') == []
+
+
+def test_sync(tmpdir, monkeypatch):
+    monkeypatch.chdir(tmpdir)
+    exporter = export_all('sync')
+    # written before the calls return
+    assert sorted(os.listdir('.')) == ['lamina0' + ex.GEXF_EXT,
+                                       'retina0' + ex.GEXF_EXT]
+    exporter.wait()
+    G = nx.read_gexf('lamina0' + ex.GEXF_EXT)
+    assert sorted(G.nodes()) == ['lam_L1_0', 'lam_L2_0']
+    assert G.nodes['lam_L1_0']['class'] == 'MorrisLecar'
+
+
+def test_async(tmpdir, monkeypatch):
+    monkeypatch.chdir(tmpdir)
+    exporter = export_all('async')
+    exporter.wait()
+    assert sorted(os.listdir('.')) == ['lamina0' + ex.GEXF_EXT,
+                                       'retina0' + ex.GEXF_EXT]
+    assert exporter.errors == []
+    assert list(nx.read_gexf('retina0' + ex.GEXF_EXT).edges()) == \
+        [('a', 'b')]
+
+
+def test_binary(tmpdir, monkeypatch):
+    monkeypatch.chdir(tmpdir)
+    exporter = export_all('binary')
+    exporter.wait()
+    assert sorted(os.listdir('.')) == ['lamina0' + ex.BINARY_EXT,
+                                       'retina0' + ex.BINARY_EXT]
+    G = ex.load_graph('lamina0' + ex.BINARY_EXT)
+    assert G.nodes['lam_L2_0']['V1'] == 0.2
+    assert list(G.edges(data=True)) == [('lam_L1_0', 'lam_L2_0',
+                                         {'delay': 1})]
+
+
+def test_invalid_mode():
+    with pytest.raises(ValueError):
+        ex.GraphExporter('gexf')
@@ -0,0 +1,65 @@
+import threading
+
+import pytest
+
+np = pytest.importorskip('numpy')
+pytest.importorskip('h5py')
+pytest.importorskip('neurokernel')
+
+from file_input import ChunkPrefetcher
+
+
+def read_rows(start, end):
+    return np.arange(start, end)[:, None]*np.ones((1, 3))
+
+
+def test_rows_in_order():
+    prefetcher = ChunkPrefetcher(read_rows, 25, 4)
+    rows = [prefetcher.next_row() for _ in range(25)]
+    prefetcher.close()
+    np.testing.assert_array_equal(np.array(rows), read_rows(0, 25))
+    stats = prefetcher.stats()
+    assert stats['hits'] + stats['stalls'] == 7
+
+
+def test_error_is_raised_to_consumer():
+    def read_chunk(start, end):
+        if start >= 8:
+            raise IOError('bad chunk')
+        return read_rows(start, end)
+    prefetcher = ChunkPrefetcher(read_chunk, 20, 4)
+    for _ in range(8):
+        prefetcher.next_row()
+    with pytest.raises(IOError):
+        prefetcher.next_row()
+    prefetcher.close()
+
+
+def test_close_with_full_queue_after_error():
+    # the consumer stops before reading the error, the thread exits
+    started = threading.Event()
+
+    def read_chunk(start, end):
+        # the first chunk fills the queue
+        if start >= 2:
+            started.set()
+            raise IOError('bad chunk')
+        return read_rows(start, end)
+    prefetcher = ChunkPrefetcher(read_chunk, 20, 2, depth=2)
+    started.wait(5)
+    prefetcher.close()
+    assert not prefetcher._thread.is_alive()
+
+
+def test_error_of_on_start_is_raised_to_consumer():
+    exited = []
+
+    def on_start():
+        raise RuntimeError('no context')
+    prefetcher = ChunkPrefetcher(read_rows, 20, 4, on_start=on_start,
+                                 on_exit=lambda: exited.append(True))
+    with pytest.raises(RuntimeError):
+        prefetcher.next_row()
+    prefetcher.close()
+    # nothing was started, so nothing is undone
+    assert exited == []
@@ -0,0 +1,135 @@
+import pickle
+
+import pytest
+
+np = pytest.importorskip('numpy')
+
+import flatspec as fs
+
+
+def get_config(mode, directory):
+    return {'General': {'file_suffix': '_test'},
+            'Transfer': {'mode': mode, 'directory': directory}}
+
+
+def set_mode(monkeypatch, mode, directory):
+    # as setup_transfer, without changing limits of the process
+    monkeypatch.setitem(fs._mode, 'mode', mode)
+    monkeypatch.setitem(fs._mode, 'directory', directory)
+    return get_config(mode, directory)
+
+
+def get_specs():
+    comp_dict = {
+        'PhotoreceptorModel': {
+            'id': ['ret_R1_0', 'ret_R2_0', 'ret_R1_1'],
+            'name': ['R1', 'R2', 'R1'],
+            'num_microvilli': [30000, 30000, 29000],
+            'init_V': [-0.07, -0.07, -0.065],
+            'gain': [np.float32(1.5), np.float32(2.), np.float32(0.5)]},
+        'MorrisLecar': {
+            'id': ['lam_L1_0', 'lam_L2_0'],
+            # mixed int and float, kept as they are
+            'V1': [0, 0.03],
+            'selected': [True, False],
+            'weights': [np.arange(3.), np.ones(2)],
+            'params': [{'a': 1}, None]},
+        'Empty': {}}
+    conns = [('ret_R1_0', 'lam_L1_0', {'delay': 1, 'weight': 0.5}),
+             ('ret_R2_0', 'lam_L2_0', {'delay': 2}),
+             ('lam_L1_0', 'lam_L2_0', {'weight': 1.5, 'tag': 'halo'})]
+    return comp_dict, conns
+
+
+def assert_columns_equal(actual, expected):
+    assert len(actual) == len(expected)
+    for a, e in zip(actual, expected):
+        if isinstance(e, np.ndarray):
+            np.testing.assert_array_equal(a, e)
+        else:
+            assert a == e
+            assert type(a) == type(e) or \
+                np.asarray(a).dtype == np.asarray(e).dtype
+
+
+def assert_specs_equal(comp_dict, conns, expected_dict, expected_conns):
+    assert set(comp_dict) == set(expected_dict)
+    for model, attrs in expected_dict.items():
+        assert set(comp_dict[model]) == set(attrs)
+        for attr, values in attrs.items():
+            assert_columns_equal(comp_dict[model][attr], values)
+    assert len(conns) == len(expected_conns)
+    for conn, expected in zip(conns, expected_conns):
+        assert type(conn) == type(expected)
+        assert conn[:2] == expected[:2]
+        assert set(conn[2]) == set(expected[2])
+        for key, value in expected[2].items():
+            assert conn[2][key] == value
+            assert np.asarray(conn[2][key]).dtype == \
+                np.asarray(value).dtype
+
+
+@pytest.mark.parametrize('mode', ['buffer', 'mmap', 'pickle'])
+def test_round_trip(mode, tmpdir, monkeypatch):
+    config = set_mode(monkeypatch, mode, str(tmpdir))
+    comp_dict, conns = get_specs()
+    packed = fs.pack(config, 'retina0', comp_dict, conns)
+    assert_specs_equal(packed[0], packed[1], comp_dict, conns)
+    loaded_dict, loaded_conns = pickle.loads(pickle.dumps(packed))
+    assert_specs_equal(loaded_dict, loaded_conns, *get_specs())
+
+
+def test_columns_keep_dtypes():
+    comp_dict, _ = get_specs()
+    arrays, meta = fs.flatten_components(comp_dict)
+    loaded = fs.unflatten_components(arrays, meta)
+    retina = loaded['PhotoreceptorModel']
+    assert retina['num_microvilli'].dtype.kind == 'i'
+    assert retina['gain'].dtype == np.float32
+    lamina = loaded['MorrisLecar']
+    assert [type(v) for v in lamina['V1']] == [int, float]
+    assert lamina['selected'].dtype == bool
+
+
+def test_mmap_keeps_arrays_mapped(tmpdir):
+    comp_dict, _ = get_specs()
+    directory = str(tmpdir.join('components'))
+    fs.write_arrays(directory, *fs.flatten_components(comp_dict))
+    loaded = fs.unflatten_components(*fs.read_arrays(directory))
+    assert isinstance(loaded['PhotoreceptorModel']['init_V'], np.memmap)
+
+
+def test_connections_without_attributes():
+    conns = [['a', 'b'], ['b', 'c']]
+    assert fs.unflatten_connections(*fs.flatten_connections(conns)) == conns
+
+
+@pytest.mark.parametrize('mode', ['buffer', 'mmap'])
+def test_pattern_round_trip(mode, tmpdir, monkeypatch):
+    pytest.importorskip('pandas')
+    pytest.importorskip('neurokernel')
+    from neurokernel.pattern import Pattern
+
+    pattern = Pattern('/ret[0:2]', '/lam[0:2]')
+    pattern['/ret[0]', '/lam[1]'] = 1
+    pattern['/ret[1]', '/lam[0]'] = 1
+    config = set_mode(monkeypatch, mode, str(tmpdir))
+    packed = fs.pack_pattern(config, 'retina0_lamina0', pattern)
+    assert packed.data is pattern.data
+    loaded = pickle.loads(pickle.dumps(packed))
+    assert type(loaded) is Pattern
+    assert loaded.data.index.equals(pattern.data.index)
+    assert loaded.interface.data.equals(pattern.interface.data)
+    # patterns that are not packed are pickled as usual
+    assert type(pickle.loads(pickle.dumps(pattern))) is Pattern
+
+
+def test_report_starts_counting_again(tmpdir, monkeypatch, capsys):
+    config = set_mode(monkeypatch, 'buffer', str(tmpdir))
+    monkeypatch.setattr(fs, '_stats', {'objects': 0, 'bytes': 0,
+                                       'seconds': 0.})
+    pickle.dumps(fs.pack(config, 'retina0', *get_specs()))
+    assert fs._stats['objects'] == 2
+    fs.report()
+    assert 'Transferred 2 LPU specifications' in capsys.readouterr().out
+    assert fs._stats['objects'] == 0
@@ -0,0 +1,223 @@
+import os
+
+import pytest
+
+np = pytest.importorskip('numpy')
+h5py = pytest.importorskip('h5py')
+pytest.importorskip('neurokernel')
+pytest.importorskip('retina')
+
+import gen_input as gi
+import naming
+
+
+class Screen(object):
+    # frame i is filled with i
+    def __init__(self, pixels=4):
+        self.pixels = pixels
+        self.step = 0
+
+    def get_screen_intensity_steps(self, steps):
+        im = np.arange(self.step, self.step + steps, dtype=np.double)
+        self.step += steps
+        return np.repeat(im[:, None], self.pixels, axis=1)
+
+
+class Writer(object):
+    def __init__(self):
+        self.rows = {}
+
+    def write(self, data, start):
+        for i, row in enumerate(data):
+            self.rows[start + i] = row[0]
+
+
+def test_array_writer(tmpdir):
+    filename = os.path.join(str(tmpdir), 'array.h5')
+    writer = gi.ArrayWriter(filename, 10, chunk_rows=4)
+    data = np.arange(30, dtype=np.double).reshape(10, 3)
+    writer.write(data[:4])
+    writer.write(data[4:7])
+    writer.write(data[7:], start=7)
+    writer.close()
+    with h5py.File(filename, 'r') as f:
+        assert f['array'].chunks == (4, 3)
+        np.testing.assert_array_equal(f['array'][:], data)
+
+
+@pytest.mark.parametrize('batch_steps', [1, 3, 7, 100])
+@pytest.mark.parametrize('write_step', [1, 2, 5])
+def test_screen_batches(batch_steps, write_step):
+    writer = Writer()
+    batches = list(gi._screen_batches(Screen(), 23, batch_steps, writer,
+                                      write_step))
+    starts = [start for start, _ in batches]
+    assert starts == list(range(0, 23, batch_steps))
+    frames = np.concatenate([im[:, 0] for _, im in batches])
+    np.testing.assert_array_equal(frames, np.arange(23))
+    # every write_step-th frame at its index in the subsampled array
+    expected = dict((i, i*write_step) for i in range((22 // write_step) + 1))
+    assert writer.rows == expected
+
+
+class Scale(object):
+    def __init__(self, factor):
+        self.factor = factor
+
+    def filter(self, im):
+        return self.factor*im[:, :2]
+
+
+def get_config(memory):
+    return {'Retina': {'input_memory': memory}}
+
+
+def test_batch_steps_fit_memory():
+    # 1 MB, steps of 100 + 28 values of 8 bytes
+    steps = gi.get_batch_steps(get_config(1), 100, 28)
+    assert steps == 2**20 // (8*128*gi.BATCHES_IN_FLIGHT)
+    # at least one step whatever the budget
+    assert gi.get_batch_steps(get_config(1e-6), 10**6, 10**6) == 1
+
+
+@pytest.mark.parametrize('workers', [1, 2])
+def test_filter_batches_keeps_order(workers):
+    batches = [(start, np.full((3, 4), start, dtype=np.double))
+               for start in range(0, 30, 3)]
+    results = list(gi.filter_batches(Scale(2.), iter(batches), workers))
+    assert [start for start, _ in results] == list(range(0, 30, 3))
+    for start, inputs in results:
+        np.testing.assert_array_equal(inputs, np.full((3, 2), 2.*start))
+
+
+class EyeScreen(object):
+    # screen of 6 pixels whose intensities change every step
+    grid = (np.zeros((2, 3)), np.ones((2, 3)))
+    radius = 1.
+
+    def __init__(self, config):
+        self.step = 0
+
+    def get_screen_intensity_steps(self, steps):
+        t = np.arange(self.step, self.step + steps, dtype=np.double)
+        self.step += steps
+        return np.sin(np.outer(t, np.arange(1., 7.)))
+
+
+class EyeRetina(object):
+    acceptance_angle = 1.
+    num_photoreceptors = 2
+
+    def get_ommatidia_pos(self):
+        return np.zeros(1), np.ones(1)
+
+
+class EyeFields(object):
+    # receptive fields of eye `index`, weighted sums of 2 pixels
+    def __init__(self, index):
+        self.index = index
+        self.refa = self.refb = np.full(2, float(index))
+
+    def filter(self, im):
+        return im[:, self.index:self.index + 2]*(self.index + 1)
+
+
+def get_input_config(eye_num=1, workers=1):
+    return {'General': {'eye_num': eye_num, 'file_suffix': '_t',
+                        'steps': 23},
+            'Retina': {'filtermethod': 'nogpu', 'input_workers': workers,
+                       'input_file': 'retina_input', 'screen_write_step': 2,
+                       'screentype': 'Sphere', 'input_memory': 1e-3,
+                       'eulerangles': [0.]*(3*eye_num)},
+            'Cache': {'directory': 'cache', 'max_size': 1,
+                      'enabled': False}}
+
+
+@pytest.fixture
+def eyes(monkeypatch):
+    monkeypatch.setattr(gi.cls_map, 'get_screen_cls',
+                        lambda screen_type: EyeScreen, raising=False)
+    monkeypatch.setattr(gi, 'get_retina',
+                        lambda config, index=0: EyeRetina())
+    monkeypatch.setattr(gi, 'get_receptive_fields',
+                        lambda config, retina, screen, index=0, cache=None:
+                        EyeFields(index))
+
+
+def test_inputs_do_not_depend_on_workers(tmpdir, monkeypatch, eyes):
+    contents = []
+    for workers in [1, 2]:
+        monkeypatch.chdir(tmpdir.mkdir('workers{}'.format(workers)))
+        gi.gen_input(get_input_config(workers=workers))
+        with open(naming.data_file('retina_input', 0, '_t'), 'rb') as f:
+            contents.append(f.read())
+    assert contents[0] == contents[1]
+
+
+def test_get_eulerangles():
+    config = get_input_config(eye_num=2)
+    config['Retina']['eulerangles'] = [0., 1., 2., 3., 4., 5.]
+    assert gi.get_eulerangles(config, 1) == [3., 4., 5.]
+    config['Retina']['eulerangles'] = [0., 1., 2.]
+    with pytest.raises(ValueError):
+        gi.get_eulerangles(config, 0)
+
+
+def test_eyes_filter_shared_screen(tmpdir, monkeypatch, eyes):
+    monkeypatch.chdir(tmpdir)
+    config = get_input_config(eye_num=2)
+    gi.gen_input(config)
+    screen = EyeScreen(config).get_screen_intensity_steps(23)
+    for i in range(2):
+        with h5py.File(naming.data_file('retina_input', i, '_t'), 'r') as f:
+            np.testing.assert_array_equal(f['array'][:],
+                                          EyeFields(i).filter(screen))
+    # the screen is written once, later eyes link to it
+    assert not os.path.islink('intensities_t0.h5')
+    assert os.readlink('intensities_t1.h5') == 'intensities_t0.h5'
+    with h5py.File('intensities_t1.h5', 'r') as f:
+        np.testing.assert_array_equal(f['array'][:], screen[::2])
+
+
+class Fields(object):
+    def load_parameters(self, **params):
+        self.params = params
+
+
+def test_prewarm_fills_cache(tmpdir, monkeypatch):
+    monkeypatch.setattr(gi.cls_map, 'get_screen_cls',
+                        lambda screen_type: EyeScreen, raising=False)
+    monkeypatch.setattr(gi.cls_map, 'get_vrf_cls',
+                        lambda screen_type: lambda grid: Fields(),
+                        raising=False)
+    monkeypatch.setattr(gi, 'get_retina',
+                        lambda config, index=0: EyeRetina())
+    built, cuda = [], []
+
+    def get_rf_parameters(retina, screen, screen_type):
+        built.append(retina)
+        return {'refa': np.zeros(2), 'refb': np.ones(2),
+                'acceptance_angle': 1.}
+    monkeypatch.setattr(gi, '_get_rf_parameters', get_rf_parameters)
+    monkeypatch.setattr(gi, '_init_cuda', lambda: cuda.append(1))
+    config = {'General': {'eye_num': 1},
+              'Retina': {'rings': 2, 'radius': 1., 'eulerangles': [0.]*3,
+                         'acceptance_factor': 1., 'screentype': 'Sphere',
+                         'filtermethod': 'gpu'},
+              'Screen': {},
+              'Cache': {'directory': str(tmpdir), 'max_size': 10,
+                        'enabled': True}}
+    gi.prewarm_receptive_fields(config, [{'rings': 3}, {'rings': 4}])
+    assert len(built) == 2 and len(cuda) == 1
+    assert config['Retina']['rings'] == 2
+
+    config['Retina']['rings'] = 4
+    cache = gi.cc.ConnectivityCache.from_config(config)
+    rfs = gi.get_receptive_fields(config, EyeRetina(), EyeScreen(config),
+                                  cache=cache)
+    assert len(built) == 2 and cache.hits == 1
+    np.testing.assert_array_equal(rfs.params['refb'], np.ones(2))
+
+    config['Cache']['enabled'] = False
+    with pytest.raises(ValueError):
+        gi.prewarm_receptive_fields(config, [{'rings': 3}])
@@ -0,0 +1,91 @@
+import threading
+import time
+
+import pytest
+
+np = pytest.importorskip('numpy')
+pytest.importorskip('h5py')
+pytest.importorskip('neurokernel')
+pytest.importorskip('retina')
+
+import gen_input as gi
+import lookahead_input as li
+
+
+class Screen(object):
+    # frame i is filled with i
+    radius = 1.
+
+    def __init__(self, config):
+        self.step = 0
+
+    def get_screen_intensity_steps(self, steps):
+        im = np.arange(self.step, self.step + steps, dtype=np.double)
+        self.step += steps
+        return np.repeat(im[:, None], 4, axis=1)
+
+
+class Fields(object):
+    '''
+        Writes inputs of 2 photoreceptors into the same output buffer
+        on every call, waits for `release` before the first batch
+    '''
+    def __init__(self):
+        self.release = threading.Event()
+        self.out = {}
+
+    def filter(self, im):
+        self.release.wait(5)
+        out = self.out.setdefault(len(im), np.empty((len(im), 2)))
+        out[:] = im[:, :2]
+        return out
+
+
+class Retina(object):
+    num_elements = 1
+
+
+@pytest.fixture
+def fields(monkeypatch):
+    fields = Fields()
+    monkeypatch.setattr(li.cls_map, 'get_screen_cls',
+                        lambda screen_type: Screen, raising=False)
+    monkeypatch.setattr(gi, 'get_receptive_fields',
+                        lambda config, retina, screen, index=0: fields)
+    return fields
+
+
+def get_processor(steps=12, lookahead=12):
+    config = {'General': {'steps': steps},
+              'Retina': {'lookahead': lookahead, 'screentype': 'Sphere',
+                         'filtermethod': 'nogpu'}}
+    return li.LookaheadRetinaInputProcessor(config, Retina())
+
+
+def wait_until_full(processor):
+    deadline = time.time() + 5
+    while not processor.producer._queue.full() and time.time() < deadline:
+        time.sleep(0.01)
+
+
+def test_stalls_and_copies(fields, capsys):
+    processor = get_processor()
+    # batches of 3 steps, 3 of the 4 batches wait in the buffer
+    assert processor.batch_steps == 3
+    processor.pre_run()
+    threading.Timer(0.05, fields.release.set).start()
+    inputs = []
+    processor.update_input()
+    inputs.append(processor.variables['photon']['input'].copy())
+    wait_until_full(processor)
+    while processor.is_input_available():
+        processor.update_input()
+        inputs.append(processor.variables['photon']['input'].copy())
+    # batches that waited in the buffer kept their own inputs
+    np.testing.assert_array_equal(
+        np.array(inputs), np.repeat(np.arange(12.)[:, None], 2, axis=1))
+    stats = processor.producer.stats()
+    assert (stats['stalls'], stats['hits']) == (1, 3)
+    assert stats['stall_time'] > 0.
+    processor.post_run()
+    assert 'waited on producer for 1 of 4 batches' in capsys.readouterr().out
@@ -0,0 +1,19 @@
+import naming
+
+
+def test_photoreceptor_uids():
+    assert naming.photoreceptor_uids(2) == [
+        'ret_R1_0', 'ret_R2_0', 'ret_R3_0', 'ret_R4_0', 'ret_R5_0',
+        'ret_R6_0', 'ret_R1_1', 'ret_R2_1', 'ret_R3_1', 'ret_R4_1',
+        'ret_R5_1', 'ret_R6_1']
+    assert naming.photoreceptor_uids([3, 5], ['R1']) == ['ret_R1_3',
+                                                         'ret_R1_5']
+
+
+def test_parse_uid():
+    assert naming.parse_uid('ret_R1_12') == ('R1', 12)
+    assert naming.parse_uid(b'lam_L1_3') == ('L1', 3)
+    assert naming.parse_uid('lam_Am') == ('Am', -1)
+    assert naming.uid_element('lam_Am') == -1
+    for uid in naming.photoreceptor_uids(3):
+        assert naming.parse_uid(uid)[0] in naming.PHOTOR_NAMES
@@ -0,0 +1,233 @@
+import pytest
+
+np = pytest.importorskip('numpy')
+pytest.importorskip('scipy')
+pd = pytest.importorskip('pandas')
+nx = pytest.importorskip('networkx')
+pytest.importorskip('neurokernel')
+
+import partition as pt
+
+
+def hex_points(rings):
+    '''
+        Positions of the elements of a planar hexagonal array
+        within `rings` rings of the center
+    '''
+    points = []
+    for q in range(-rings, rings + 1):
+        for r in range(max(-rings, -q - rings), min(rings, rings - q) + 1):
+            points.append((q + r/2., r*np.sqrt(3)/2., 0.))
+    return np.array(points)
+
+
+def get_weights(num, seed=0):
+    # photoreceptors of different numbers of microvilli
+    return np.random.RandomState(seed).randint(100, 300, size=num)
+
+
+def test_hex_edges():
+    points = hex_points(1)
+    edges = pt.hex_edges(points)
+    # 6 spokes and 6 sides of the ring
+    assert len(edges) == 12
+    assert np.all(edges[:, 0] < edges[:, 1])
+    center = np.argmin(np.linalg.norm(points, axis=1))
+    assert np.sum(edges == center) == 6
+
+
+@pytest.mark.parametrize('parts', [2, 3, 4, 7])
+def test_balance_within_tolerance(parts):
+    points = hex_points(8)
+    weights = get_weights(len(points))
+    tolerance = 0.05
+    assignment = pt.partition_elements(points, weights, parts,
+                                       tolerance=tolerance)
+    loads = np.bincount(assignment, weights=weights, minlength=parts)
+    mean = weights.sum()/parts
+    assert loads.max() <= mean*(1 + tolerance)
+    assert loads.min() >= mean*(1 - tolerance)
+
+
+@pytest.mark.parametrize('parts', [2, 5, 19])
+def test_all_parts_non_empty(parts):
+    points = hex_points(2)
+    # a large tolerance lets the refinement move most elements
+    assignment = pt.partition_elements(points, get_weights(len(points)),
+                                       parts, tolerance=1.)
+    assert set(assignment) == set(range(parts))
+
+
+def test_one_element_per_part():
+    points = hex_points(1)
+    assignment = pt.partition_elements(points, np.ones(len(points)),
+                                       len(points), tolerance=10.)
+    assert sorted(assignment) == list(range(len(points)))
+    with pytest.raises(ValueError):
+        pt.partition_elements(points, np.ones(len(points)),
+                              len(points) + 1)
+
+
+def test_deterministic():
+    points = hex_points(6)
+    weights = get_weights(len(points))
+    first = pt.partition_elements(points, weights, 4)
+    for _ in range(3):
+        np.testing.assert_array_equal(
+            pt.partition_elements(points, weights, 4), first)
+
+
+def test_regions_are_compact():
+    points = hex_points(8)
+    edges = pt.hex_edges(points)
+    assignment = pt.partition_elements(points, np.ones(len(points)), 2,
+                                       edges)
+    # a straight cut through 17 elements across the array
+    assert pt.cut_edges(edges, assignment) <= 2*17
+
+
+class Lamina(object):
+    '''
+        Lamina of one L1 neuron per cartridge that reads its R1 input
+        port and has an output port. Neighboring L1 neurons are
+        connected by synapses, and an amacrine cell exchanges synapses
+        with the L1 neurons of the first cartridges.
+    '''
+    def __init__(self, points):
+        self.G = G = nx.DiGraph()
+        for c in range(len(points)):
+            G.add_node('lam_L1_{}'.format(c), **{'class': 'MorrisLecar',
+                                                 'name': 'L1'})
+            for name, io in [('R1', 'in'), ('L1', 'out')]:
+                G.add_node('lam_{}_port_{}'.format(name, c),
+                           **{'class': 'Port', 'port_io': io,
+                              'selector': '/lam/{}/{}'.format(c, name)})
+            self.synapse('lam_R1_port_{}'.format(c), 'lam_L1_{}'.format(c))
+            G.add_edge('lam_L1_{}'.format(c), 'lam_L1_port_{}'.format(c))
+        for a, b in pt.hex_edges(points):
+            self.synapse('lam_L1_{}'.format(a), 'lam_L1_{}'.format(b))
+            self.synapse('lam_L1_{}'.format(b), 'lam_L1_{}'.format(a))
+        G.add_node('lam_Am', **{'class': 'MorrisLecar', 'name': 'Am'})
+        for c in range(3):
+            self.synapse('lam_Am', 'lam_L1_{}'.format(c))
+            self.synapse('lam_L1_{}'.format(c), 'lam_Am')
+
+    def synapse(self, pre, post):
+        synapse = 'syn_{}_{}'.format(pre, post)
+        self.G.add_node(synapse, **{'class': 'Synapse'})
+        self.G.add_edge(pre, synapse)
+        self.G.add_edge(synapse, post)
+
+    def get_graph(self):
+        return self.G
+
+    def get_selector(self, cartridge, name):
+        return '/lam/{}/{}'.format(cartridge, name)
+
+
+def is_input_port(attrs):
+    return attrs.get('class') == 'Port' and attrs['port_io'] == 'in'
+
+
+def port_selectors(G):
+    return set(a['selector'] for _, a in G.nodes(data=True)
+               if a.get('class') == 'Port')
+
+
+def pattern_ports(pattern, interface):
+    df_int = pattern.interface.data
+    return set(pt._port_key(p) for p, i in zip(df_int.index,
+                                               df_int['interface'])
+               if i == interface)
+
+
+@pytest.fixture
+def lamina_partition(monkeypatch):
+    monkeypatch.setattr(pt, 'synapse_classes', lambda model: {'Synapse'})
+    points = hex_points(2)
+    lamina = Lamina(points)
+    return lamina, pt.LaminaPartition(lamina, points, 3, 'model',
+                                      tolerance=0.2)
+
+
+def test_lamina_nodes_in_one_worker(lamina_partition):
+    lamina, partition = lamina_partition
+    for node, attrs in lamina.G.nodes(data=True):
+        workers = [w for w, m in enumerate(partition.members) if node in m]
+        if is_input_port(attrs):
+            assert len(workers) >= 1
+        else:
+            assert len(workers) == 1, node
+
+
+def test_lamina_halo_ports(lamina_partition):
+    lamina, partition = lamina_partition
+    owner = dict((n, w) for w, members in enumerate(partition.members)
+                 for n in members if not is_input_port(lamina.G.nodes[n]))
+    graphs = [partition.worker_graph(w) for w in range(3)]
+    crossing = [(u, v) for u, v in lamina.G.edges()
+                if u in owner and v in owner and owner[u] != owner[v]]
+    assert crossing
+    for u, v in crossing:
+        out_node, out_sel = partition._out_port(u)
+        in_node, in_sel = partition._in_port(u, owner[v])
+        source, target = graphs[owner[u]], graphs[owner[v]]
+        assert list(source.successors(u)).count(out_node) == 1
+        assert source.nodes[out_node]['port_io'] == 'out'
+        assert target.nodes[in_node]['port_io'] == 'in'
+        assert target.has_edge(in_node, v)
+        assert (out_sel, in_sel) == (source.nodes[out_node]['selector'],
+                                     target.nodes[in_node]['selector'])
+    # one output port per source of crossing edges
+    for w, G in enumerate(graphs):
+        outputs = [n for n, a in G.nodes(data=True)
+                   if a.get('name') == 'halo' and a['port_io'] == 'out']
+        assert len(outputs) == len(set(u for u, _ in crossing
+                                        if owner[u] == w))
+
+
+def test_lamina_halo_patterns(lamina_partition):
+    lamina, partition = lamina_partition
+    graphs = [partition.worker_graph(w) for w in range(3)]
+    halo_ports = [set(a['selector'] for _, a in G.nodes(data=True)
+                      if a.get('name') == 'halo') for G in graphs]
+    patterns = partition.halo_patterns()
+    assert set(patterns) == set((min(key), max(key))
+                                for key in partition.halo)
+    found = [set(), set(), set()]
+    for (a, b), pattern in patterns.items():
+        for interface, w in [(0, a), (1, b)]:
+            ports = pattern_ports(pattern, interface)
+            assert ports <= port_selectors(graphs[w])
+            found[w] |= ports
+    assert found == halo_ports
+
+
+def test_lamina_retina_pattern(lamina_partition):
+    from neurokernel.pattern import Pattern
+
+    lamina, partition = lamina_partition
+    cartridges = len(partition.assignment)
+    # retina R1 of each ommatidium to R1 input of its cartridge
+    ports = [('ret', str(c), 'R1') for c in range(cartridges)] + \
+        [('lam', str(c), 'R1') for c in range(cartridges)]
+    df_int = pd.DataFrame(
+        {'interface': [0]*cartridges + [1]*cartridges,
+         'io': ['in']*cartridges + ['out']*cartridges,
+         'type': ['gpot']*(2*cartridges)},
+        index=pd.MultiIndex.from_tuples(ports, names=[0, 1, 2]),
+        columns=['interface', 'io', 'type'])
+    df_pat = pd.DataFrame(
+        {'conn': np.ones(cartridges, dtype=np.int64)},
+        index=pd.MultiIndex.from_tuples(
+            [ports[c] + ports[cartridges + c] for c in range(cartridges)],
+            names=['from_0', 'from_1', 'from_2', 'to_0', 'to_1', 'to_2']))
+    pattern = Pattern.from_df(df_int, df_pat)
+    for w in range(3):
+        mine = [c for c in range(cartridges) if partition.assignment[c] == w]
+        part = partition.retina_pattern(pattern, w)
+        assert pattern_ports(part, 1) == \
+            set('/lam/{}/R1'.format(c) for c in mine)
+        assert pattern_ports(part, 0) == \
+            set('/ret/{}/R1'.format(c) for c in mine)
+        assert len(part.data) == len(mine)
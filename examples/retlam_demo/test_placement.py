@@ -0,0 +1,129 @@
+import subprocess
+
+import pytest
+
+import placement as pl
+
+
+class Manager(object):
+    def __init__(self):
+        self.added = []
+        self.connected = []
+
+    def add(self, lpu_cls, lpu_id, dt, comp_dict, conns, device=None,
+            **kwargs):
+        self.added.append((lpu_id, device))
+
+    def connect(self, id_0, id_1, pattern, *args, **kwargs):
+        self.connected.append((id_0, id_1))
+
+
+class Pattern(object):
+    def __init__(self, connections):
+        self.data = [None]*connections
+
+
+def retina_components(ommatidia, microvilli=300):
+    return {'PhotoreceptorModel': {
+        'id': ['ret_R{}_{}'.format(k + 1, i) for i in range(ommatidia)
+               for k in range(6)],
+        'num_microvilli': [microvilli]*(6*ommatidia)}}
+
+
+def lamina_components(cartridges):
+    return {'MorrisLecar': dict(
+        (attr, [0.]*(6*cartridges))
+        for attr in ['id', 'name', 'V1', 'V2', 'V3', 'V4', 'phi',
+                     'offset', 'initV', 'initn'])}
+
+
+def add_eye(placement, ommatidia=7, device=None):
+    placement.add(object, 'retina0', 1e-4, retina_components(ommatidia),
+                  [], device=device)
+    placement.add(object, 'lamina0', 1e-4, lamina_components(ommatidia), [])
+    placement.connect('retina0', 'lamina0', Pattern(6*ommatidia))
+
+
+def test_lpu_cost():
+    cost, memory = pl.lpu_cost(retina_components(1, microvilli=10))
+    # id and num_microvilli of 6 photoreceptors and their microvilli
+    assert cost == 6*2 + 6*10*pl.MICROVILLUS_VALUES
+    assert memory == cost*pl.VALUE_BYTES
+    assert pl.lpu_cost({}) == (0, 0)
+    # lamina components count in the same units as photoreceptors
+    assert pl.lpu_cost(lamina_components(1))[0] == 6*10
+
+
+def test_plan_balances_load():
+    assignment = pl.plan_placement([4, 3, 2, 1], [0]*4, {}, 2)
+    loads = [sum(c for c, d in zip([4, 3, 2, 1], assignment) if d == k)
+             for k in range(2)]
+    assert loads == [5, 5]
+
+
+def test_plan_avoids_traffic():
+    traffic = {(0, 1): 100, (2, 3): 100}
+    assignment = pl.plan_placement([1, 1, 1, 1], [0]*4, traffic, 2,
+                                   traffic_weight=1.)
+    assert assignment[0] == assignment[1]
+    assert assignment[2] == assignment[3]
+    assert assignment[0] != assignment[2]
+
+
+def test_plan_keeps_pins_and_memory():
+    assignment = pl.plan_placement([1, 1, 1], [0]*3, {}, 3,
+                                   pinned={0: 2, 1: 2})
+    assert assignment[:2] == [2, 2]
+    with pytest.raises(ValueError):
+        pl.plan_placement([1, 1], [10, 10], {}, 1, device_memory=15)
+
+
+def test_plan_keeps_baseline_unless_better():
+    costs, traffic = [10, 1], {(0, 1): 10}
+    # as good as the plan [0, 1] without traffic weight
+    assert pl.plan_placement(costs, [0, 0], traffic, 2, traffic_weight=0.,
+                             baseline=[1, 0]) == [1, 0]
+    # worse than both LPUs on one device with it
+    assert pl.plan_placement(costs, [0, 0], traffic, 2, traffic_weight=1.,
+                             baseline=[1, 0]) in ([0, 0], [1, 1])
+    # baselines that break pins are not used
+    assert pl.plan_placement([1, 1], [0, 0], {}, 2, pinned={0: 1},
+                             baseline=[0, 1]) == [1, 0]
+
+
+def test_apply_forwards_calls():
+    manager = Manager()
+    placement = pl.Placement(manager, [3, 5],
+                             baseline={'retina0': 0, 'lamina0': 1})
+    add_eye(placement)
+    devices = placement.apply()
+    assert devices == {'retina0': 3, 'lamina0': 5}
+    assert manager.added == [('retina0', 3), ('lamina0', 5)]
+    assert manager.connected == [('retina0', 'lamina0')]
+    report = placement.report()
+    assert report['traffic'] == 6*7*pl.VALUE_BYTES
+    assert sum(d['load'] for d in report['devices']) == pytest.approx(1)
+
+
+def test_pin_to_unknown_device():
+    placement = pl.Placement(Manager(), [0, 1])
+    add_eye(placement, device=2)
+    with pytest.raises(ValueError) as e:
+        placement.plan()
+    assert 'retina0' in str(e.value) and '[Placement]' in str(e.value)
+
+
+def test_from_config_devices(monkeypatch):
+    config = {'Placement': {'devices': [2, 3], 'traffic_weight': 0.,
+                            'device_memory': 0}}
+    assert pl.Placement.from_config(config, Manager()).devices == [2, 3]
+
+    def check_output(*args, **kwargs):
+        raise subprocess.CalledProcessError(1, args[0])
+    monkeypatch.setattr(subprocess, 'check_output', check_output)
+    config['Placement']['devices'] = []
+    assert pl.Placement.from_config(config, Manager()).devices == [0, 1]
+
+    monkeypatch.setattr(subprocess, 'check_output',
+                        lambda *args, **kwargs: b'4\n')
+    assert pl.get_devices() == [0, 1, 2, 3]
@@ -0,0 +1,54 @@
+import pytest
+
+np = pytest.importorskip('numpy')
+pytest.importorskip('h5py')
+pytest.importorskip('neurokernel')
+
+import recording as rec
+
+
+def rec_config(neurons=('L1', 'Am'), rings=-1, elements=()):
+    return {'enabled': True, 'neurons': list(neurons), 'rings': rings,
+            'elements': list(elements), 'sample_interval': 1}
+
+
+def get_comp_dict(num_elements=19):
+    # amacrine cells have no element
+    ids = ['lam_L1_{}'.format(i) for i in range(num_elements)] + \
+        ['lam_Am']*3
+    names = ['L1']*num_elements + ['Am']*3
+    return {'MorrisLecar': {'id': ids, 'name': names}}
+
+
+def test_num_elements_in_rings():
+    assert [rec.num_elements_in_rings(r) for r in range(3)] == [1, 7, 19]
+
+
+def test_all_elements():
+    uids = rec.component_uids(rec_config(), get_comp_dict())
+    assert len(uids) == 22
+
+
+def test_rings_exclude_neurons_of_no_element():
+    uids = rec.component_uids(rec_config(rings=1), get_comp_dict())
+    assert uids == ['lam_L1_{}'.format(i) for i in range(7)]
+
+
+def test_element_minus_one_selects_neurons_of_no_element():
+    uids = rec.component_uids(rec_config(rings=0, elements=[0, -1]),
+                              get_comp_dict())
+    assert uids == ['lam_L1_0'] + ['lam_Am']*3
+    uids = rec.component_uids(rec_config(elements=[2]), get_comp_dict())
+    assert uids == ['lam_L1_2']
+
+
+def test_retina_uids():
+    uids = rec.retina_uids(rec_config(neurons=['R1'], rings=1), 19)
+    assert uids == ['ret_R1_{}'.format(i) for i in range(7)]
+
+
+def test_empty_selection_records_nothing():
+    config = {'Recording': {'Lamina': rec_config(neurons=['L5']),
+                            'async_write': False}}
+    assert rec.get_output_processors(config, 'Lamina', 'out.h5',
+                                     comp_dict=get_comp_dict()) == []
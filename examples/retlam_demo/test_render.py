@@ -0,0 +1,107 @@
+import os
+
+import pytest
+
+np = pytest.importorskip('numpy')
+h5py = pytest.importorskip('h5py')
+matplotlib = pytest.importorskip('matplotlib')
+matplotlib.use('Agg')
+
+import render as rn
+
+OMMATIDIA = 7
+FRAMES = 2
+# steps between frames of the analysis file and between screen rows
+STEP = 10
+SCREEN_WRITE_STEP = 5
+
+
+def write(filename, data):
+    with h5py.File(filename, 'w') as f:
+        f.create_dataset('array', data=data)
+
+
+@pytest.fixture
+def run_files(tmpdir, monkeypatch):
+    '''
+        Coordinate, screen and analysis files of 2 frames
+    '''
+    monkeypatch.chdir(tmpdir)
+    angles = np.linspace(-1., 1., OMMATIDIA)
+    write('retina_elev0.h5', angles)
+    write('retina_azim0.h5', angles)
+    grid = np.meshgrid(np.linspace(-1., 1., 4), np.linspace(-1., 1., 3))
+    write('grid_dima0.h5', grid[0])
+    write('grid_dimb0.h5', grid[1])
+    # screen frame i is filled with i
+    rows = FRAMES*STEP // SCREEN_WRITE_STEP
+    write('intensities0.h5', np.repeat(np.arange(rows, dtype=np.double),
+                                       12).reshape(rows, 3, 4))
+    with h5py.File('analysis0.h5', 'w') as f:
+        for name, _ in rn.PANELS:
+            f.create_dataset(name, data=np.random.RandomState(0).rand(
+                FRAMES, OMMATIDIA))
+        f.attrs['step'] = STEP
+        f.attrs['start'] = 0
+    return 'analysis0.h5', 'intensities0.h5'
+
+
+class ReadLog(object):
+    '''
+        h5py.File that records the rows read from its datasets
+    '''
+    File = h5py.File
+    reads = []
+
+    def __init__(self, filename, mode='r'):
+        self.filename = filename
+        self.file = self.File(filename, mode)
+        self.attrs = self.file.attrs
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.file.close()
+
+    def __getitem__(self, name):
+        return Dataset(self.file[name], self.filename)
+
+
+class Dataset(object):
+    def __init__(self, dataset, filename):
+        self.dataset = dataset
+        self.filename = filename
+        self.shape = dataset.shape
+
+    def __getitem__(self, key):
+        ReadLog.reads.append((self.filename, key.start, key.stop))
+        return self.dataset[key]
+
+
+def test_render_frames(run_files):
+    analysis_file, screen_file = run_files
+    rendered = rn.render(analysis_file, screen_file, 'frames', processes=2,
+                         frames_per_task=1,
+                         screen_write_step=SCREEN_WRITE_STEP)
+    assert rendered == FRAMES
+    assert sorted(os.listdir('frames')) == [rn.FRAME_FORMAT.format(i)
+                                            for i in range(FRAMES)]
+
+
+def test_worker_reads_its_time_slice(run_files, monkeypatch):
+    analysis_file, screen_file = run_files
+    rn._init_worker(rn.get_geometry(0), {
+        'analysis_file': analysis_file, 'screen_file': screen_file,
+        'frames_dir': '.', 'screen_write_step': SCREEN_WRITE_STEP,
+        'dt': 1e-4, 'limits': rn.get_color_limits(analysis_file,
+                                                  screen_file),
+        'figsize': (4, 3), 'marker_size': 4})
+    monkeypatch.setattr(rn.h5py, 'File', ReadLog)
+    monkeypatch.setattr(ReadLog, 'reads', [])
+    assert rn._render_slice((1, 2)) == 1
+    # frame 1 is step 10, stored as screen row 2
+    expected = [(analysis_file, 1, 2)]*len(rn.PANELS) + \
+        [(screen_file, 2, 3)]
+    assert ReadLog.reads == expected
+    assert os.listdir('.').count(rn.FRAME_FORMAT.format(1)) == 1
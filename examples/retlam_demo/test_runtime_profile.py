@@ -0,0 +1,52 @@
+import json
+
+import pytest
+
+np = pytest.importorskip('numpy')
+pytest.importorskip('neurokernel')
+
+import runtime_profile as rp
+
+
+def get_samples(num=100):
+    # compute of step k takes k ms, the other components 1 ms
+    return [{'step': 10*k, 'input': 1e-3, 'compute': k*1e-3,
+             'output': 1e-3, 'exchange': 1e-3} for k in range(num)]
+
+
+def test_profile_report():
+    samples = get_samples()
+    report = rp.profile_report('retina0', samples, 10, slowest=3)
+    assert (report['lpu'], report['interval'], report['samples']) == \
+        ('retina0', 10, 100)
+    compute = report['components']['compute']
+    assert compute['mean'] == pytest.approx(49.5e-3)
+    assert compute['p50'] == pytest.approx(49.5e-3)
+    assert compute['p90'] == pytest.approx(89.1e-3)
+    assert compute['p99'] == pytest.approx(98.01e-3)
+    assert compute['max'] == pytest.approx(99e-3)
+    # 100 evenly spread values, 5 per bin
+    histogram = compute['histogram']
+    assert histogram['counts'] == [5]*rp.HISTOGRAM_BINS
+    assert len(histogram['edges']) == rp.HISTOGRAM_BINS + 1
+    # equal values fall in one bin
+    assert max(report['components']['input']['histogram']['counts']) == 100
+    # slowest first
+    assert [s['step'] for s in report['slowest_steps']] == [990, 980, 970]
+    assert report['slowest_steps'][0]['total'] == pytest.approx(102e-3)
+    # the samples are not changed
+    assert samples == get_samples()
+
+
+def test_summarize(tmpdir, monkeypatch, capsys):
+    monkeypatch.chdir(tmpdir)
+    config = {'General': {'profile_interval': 10, 'file_suffix': '_a'}}
+    with open(rp.get_profile_file('retina0', '_a'), 'w') as f:
+        json.dump(rp.profile_report('retina0', get_samples(), 10), f)
+    rp.summarize(config, ['retina0', 'lamina0'])
+    lines = capsys.readouterr().out.splitlines()
+    assert lines[0] == 'Runtime profile (every 10 steps)'
+    # the LPU without a report is left out
+    assert len(lines) == 3
+    assert lines[2].split()[:3] == ['retina0', '100', '1.000']
+    assert lines[2].endswith('990 (102.0 ms)')
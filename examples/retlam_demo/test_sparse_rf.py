@@ -0,0 +1,117 @@
+import pytest
+
+np = pytest.importorskip('numpy')
+pytest.importorskip('scipy')
+
+from sparse_rf import SparseReceptiveFields, screen_directions
+
+ACCEPTANCE_ANGLE = 0.1
+# relative to the range of the stimulus
+TOLERANCE = 0.02
+
+
+def get_grid(points=200):
+    # elevation and azimuth of a patch of the sphere screen
+    return np.meshgrid(np.linspace(-0.5, 0.5, points),
+                       np.linspace(-0.5, 0.5, points), indexing='ij')
+
+
+def get_centers():
+    refa, refb = np.meshgrid(np.linspace(-0.2, 0.2, 5),
+                             np.linspace(-0.2, 0.2, 5), indexing='ij')
+    return refa.ravel(), refb.ravel()
+
+
+def get_rfs(grid, screen_type='Sphere'):
+    refa, refb = get_centers()
+    rfs = SparseReceptiveFields(grid, screen_type)
+    rfs.load_parameters(refa=refa, refb=refb,
+                        acceptance_angle=ACCEPTANCE_ANGLE)
+    return rfs
+
+
+def smooth_screen(grid, steps=3):
+    dima, dimb = grid
+    return np.array([np.sin(2*dima + k) + np.cos(3*dimb - k)
+                     for k in range(steps)])
+
+
+def test_screen_directions_are_unit_vectors():
+    dima, dimb = get_grid(20)
+    for screen_type in ['Sphere', 'Cylinder']:
+        dirs = screen_directions(dima, dimb, screen_type)
+        np.testing.assert_allclose(np.linalg.norm(dirs, axis=1), 1)
+    with pytest.raises(ValueError):
+        screen_directions(dima, dimb, 'Cube')
+
+
+def test_uniform_screen_gives_its_intensity():
+    grid = get_grid()
+    rfs = get_rfs(grid)
+    np.testing.assert_allclose(rfs.weights.sum(axis=1), 1)
+    screen = np.full((2,) + grid[0].shape, 3.)
+    np.testing.assert_allclose(rfs.filter(screen), 3.)
+
+
+def test_point_response_is_largest_at_center():
+    grid = get_grid()
+    rfs = get_rfs(grid)
+    refa, refb = get_centers()
+    dima, dimb = grid
+    # each photoreceptor responds most to the grid point at its center
+    for i in [0, 12, 24]:
+        row = rfs.weights.getrow(i).toarray().ravel()
+        peak = np.argmax(row)
+        assert abs(dima.ravel()[peak] - refa[i]) < 0.01
+        assert abs(dimb.ravel()[peak] - refb[i]) < 0.01
+
+
+def test_weights_are_cut_off():
+    grid = get_grid()
+    rfs = get_rfs(grid)
+    # 3 standard deviations of a Gaussian with FWHM 0.1
+    cutoff = 3*ACCEPTANCE_ANGLE/(2*np.sqrt(2*np.log(2)))
+    dirs = screen_directions(*grid, screen_type='Sphere')
+    centers = screen_directions(*get_centers(), screen_type='Sphere')
+    rows, cols = rfs.weights.nonzero()
+    angles = np.arccos(np.clip(np.sum(dirs[cols]*centers[rows], axis=1),
+                               -1, 1))
+    assert angles.max() <= cutoff + 1e-9
+
+
+def test_nan_centers_get_no_input():
+    grid = get_grid()
+    rfs = SparseReceptiveFields(grid, 'Sphere')
+    rfs.load_parameters(refa=np.array([0., np.nan]),
+                        refb=np.array([0., 0.]),
+                        acceptance_angle=ACCEPTANCE_ANGLE)
+    out = rfs.filter(np.ones((1,) + grid[0].shape))
+    assert out[0, 0] == pytest.approx(1)
+    assert out[0, 1] == 0
+
+
+def test_matches_gpu_filter():
+    '''
+        Inputs of the nogpu filter agree with those of the receptive
+        fields of the retina package on a smooth stimulus within
+        TOLERANCE of its range
+    '''
+    pytest.importorskip('retina')
+    try:
+        import pycuda.autoinit
+    except Exception:
+        pytest.skip('needs a GPU')
+    import retina.classmapper as cls_map
+
+    grid = get_grid()
+    refa, refb = get_centers()
+    screen = smooth_screen(grid)
+
+    vrf_cls = cls_map.get_vrf_cls('Sphere')
+    gpu_rfs = vrf_cls(grid)
+    gpu_rfs.load_parameters(refa=refa, refb=refb,
+                            acceptance_angle=ACCEPTANCE_ANGLE, radius=1.)
+    expected = np.asarray(gpu_rfs.filter(screen))
+    actual = get_rfs(grid).filter(screen)
+    value_range = screen.max() - screen.min()
+    assert np.max(np.abs(actual - expected)) <= TOLERANCE*value_range
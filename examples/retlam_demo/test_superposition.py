@@ -0,0 +1,66 @@
+import pytest
+
+np = pytest.importorskip('numpy')
+pytest.importorskip('pandas')
+pytest.importorskip('neurokernel')
+
+import superposition as sp
+
+
+class RuleMap(object):
+    # photoreceptor k of ommatidium o goes to cartridge o + k + 1
+    def __init__(self, num):
+        self.num = num
+
+    def neighbor_for_photor(self, ommid, name):
+        return (ommid + sp.PHOTOR_NAMES.index(name) + 1) % self.num
+
+
+class Retina(object):
+    def __init__(self, num):
+        self.num_elements = num
+        self.rulemap = RuleMap(num)
+
+    def get_all_selectors(self):
+        return ['/ret/{}/R1'.format(i) for i in range(self.num_elements)]
+
+
+class Lamina(object):
+    def get_selector(self, cartid, name):
+        return '/lam/{}/{}'.format(cartid, name)
+
+
+def test_superposition_table():
+    table = sp.superposition_table(RuleMap(7), 7)
+    assert table.shape == (7, 6)
+    assert table[0].tolist() == [1, 2, 3, 4, 5, 6]
+    assert table[3, 5] == 2
+
+
+def test_superposition_arrays():
+    ommids, cartids, name_idx = sp.superposition_arrays(Retina(7))
+    assert len(ommids) == len(cartids) == len(name_idx) == 42
+    for o, c, k in zip(ommids, cartids, name_idx):
+        assert c == (o + k + 1) % 7
+
+
+@pytest.mark.parametrize('agg', [False, True])
+def test_pattern_connections(agg):
+    pattern = sp.build_retina_lamina_pattern(Retina(7), Lamina(), agg=agg)
+    conns = set(tuple(str(p) for p in c) for c in pattern.data.index)
+    expected = set()
+    for o in range(7):
+        for k, name in enumerate(sp.PHOTOR_NAMES):
+            c = (o + k + 1) % 7
+            expected.add(('ret', str(o), name, 'lam', str(c), name))
+            if agg:
+                expected.add(('lam', str(c), name + sp.AGG_SUFFIX,
+                              'ret', str(o), name + sp.AGG_SUFFIX))
+    assert conns == expected
+
+    df_int = pattern.interface.data
+    retina_ports = df_int[df_int['interface'] == 0]
+    lamina_ports = df_int[df_int['interface'] == 1]
+    assert len(retina_ports) == len(lamina_ports) == (84 if agg else 42)
+    # ports that receive data from an LPU are inputs of the pattern
+    assert set(retina_ports['io']) == ({'in', 'out'} if agg else {'in'})
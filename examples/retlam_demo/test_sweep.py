@@ -0,0 +1,123 @@
+import json
+import sys
+
+import pytest
+
+pytest.importorskip('numpy')
+pytest.importorskip('neurokernel')
+pytest.importorskip('retina')
+
+import sweep
+
+
+def get_config():
+    return {'General': {'dt': 1e-4, 'steps': 100, 'eye_num': 1,
+                        'file_suffix': ''},
+            'Retina': {'rings': 3, 'input_file': 'retina_input'},
+            'Screen': {'SphereScreen': {'radius': 10.}},
+            'InputType': {'shape': [128, 128],
+                          'Ball': {'speed': 1000., 'levels': [3e3, 3e5]}},
+            'Placement': {'devices': [0, 1, 2, 3, 4]},
+            'Cache': {'enabled': False}, 'Catalog': {'enabled': False}}
+
+
+def test_parse_parameter():
+    assert sweep.parse_parameter('General.dt=5e-4, 1e-3') == \
+        ('General.dt', [5e-4, 1e-3])
+    assert sweep.parse_parameter('Retina.intype=Ball,Bar') == \
+        ('Retina.intype', ['Ball', 'Bar'])
+    assert sweep.parse_parameter('Retina.eulerangles=[[0, 0, 0], [1, 0, 0]]') \
+        == ('Retina.eulerangles', [[0, 0, 0], [1, 0, 0]])
+    with pytest.raises(ValueError):
+        sweep.parse_parameter('General.dt')
+
+
+def test_expand_grid():
+    points = sweep.expand_grid([('a.x', [1, 2]), ('b.y', ['u', 'v', 'w'])])
+    assert len(points) == 6
+    assert points[0] == {'a.x': 1, 'b.y': 'u'}
+    assert points[-1] == {'a.x': 2, 'b.y': 'w'}
+    assert sweep.expand_grid([]) == [{}]
+
+
+def test_apply_overrides():
+    config = get_config()
+    point = sweep.apply_overrides(config, {'General.dt': 1e-3,
+                                           'InputType.Ball.speed': 500.})
+    assert point['General']['dt'] == 1e-3
+    assert point['InputType']['Ball']['speed'] == 500.
+    # the base configuration is not changed
+    assert config['General']['dt'] == 1e-4
+    with pytest.raises(KeyError):
+        sweep.apply_overrides(config, {'General.dtt': 1})
+    with pytest.raises(KeyError):
+        sweep.apply_overrides(config, {'Lamina.model': 'x'})
+
+
+def test_points_with_different_stimuli_have_different_inputs():
+    config = get_config()
+    slow = sweep.apply_overrides(config, {'InputType.Ball.speed': 500.})
+    fast = sweep.apply_overrides(config, {'InputType.Ball.speed': 2000.})
+    assert sweep.input_digest(slow) != sweep.input_digest(fast)
+    # the suffix of a point does not change its input
+    other = sweep.apply_overrides(config, {'General.file_suffix': '__1'})
+    assert sweep.input_digest(other) == sweep.input_digest(config)
+
+
+def test_device_slots():
+    config = get_config()
+    points = [{'config': config}]
+    assert sweep.device_slots(config, points, 4) == [[0, 1], [2, 3]]
+    assert sweep.device_slots(config, points, 1) == [[0, 1]]
+    # a point gets all GPUs if there are not enough for one
+    config['Placement']['devices'] = [3]
+    assert sweep.device_slots(config, points, 4) == [[3]]
+
+
+# stands for sweep.py --point, records when it ran and fails on dt 1
+POINT = '''
+import json, sys, time
+filename = sys.argv[1]
+with open(filename) as f:
+    point = json.load(f)
+point['timings'] = {'start': time.time()}
+time.sleep(0.3)
+point['timings']['end'] = time.time()
+if point['overrides']['General.dt'] == 1:
+    sys.exit(1)
+with open(filename, 'w') as f:
+    json.dump(point, f)
+'''
+
+
+def test_points_run_concurrently(tmpdir, monkeypatch):
+    monkeypatch.chdir(tmpdir)
+    monkeypatch.setattr(sweep, 'POLL_INTERVAL', 0.01)
+    monkeypatch.setattr(sweep, 'point_command',
+                        lambda filename: [sys.executable, '-c', POINT,
+                                          filename])
+    config = get_config()
+    config['Retina'].update(inputmethod='generate', lookahead=0)
+    points = sweep.run_sweep(config, [('General.dt', [1, 2, 3, 4, 5])],
+                             max_parallel=3)
+    assert [p['suffix'] for p in points] == ['__{}'.format(i)
+                                            for i in range(5)]
+    assert 'code 1' in points[0]['error']
+    assert all(p['error'] is None for p in points[1:])
+
+    # 2 points at a time on the 4 GPUs of their slots
+    def overlap(p, q):
+        return q['timings']['start'] < p['timings']['end'] and \
+            p['timings']['start'] < q['timings']['end']
+    completed = points[1:]
+    for p in completed:
+        running = [q for q in completed if overlap(p, q)]
+        assert len(running) <= 2
+        devices = sum([q['config']['Placement']['devices']
+                       for q in running], [])
+        assert len(devices) == len(set(devices))
+    assert any(p is not q and overlap(p, q)
+               for p in completed for q in completed)
+    with open('sweep.json') as f:
+        assert [p['error'] is None for p in json.load(f)] == \
+            [False] + [True]*4
@@ -0,0 +1,64 @@
+import json
+import threading
+
+import tracing as tr
+
+
+def run_phases(tracer, lpu):
+    with tracer.span('instantiation', lpu=lpu):
+        for _ in range(2):
+            with tracer.span('graph', cached=False):
+                pass
+
+
+def test_nested_spans_of_two_threads():
+    tracer = tr.Tracer()
+    thread = threading.Thread(target=run_phases, args=(tracer, 'lamina0'))
+    thread.start()
+    thread.join()
+    run_phases(tracer, 'retina0')
+
+    # inner spans end first, 3 per thread
+    assert len(tracer.spans) == 6
+    tids = set(s['tid'] for s in tracer.spans)
+    assert tids == set([thread.ident, threading.current_thread().ident])
+    for tid in tids:
+        spans = [s for s in tracer.spans if s['tid'] == tid]
+        assert [(s['path'], s['depth']) for s in spans] == \
+            [('instantiation/graph', 1)]*2 + [('instantiation', 0)]
+        outer = spans[-1]
+        for inner in spans[:2]:
+            assert outer['start'] <= inner['start']
+            assert inner['start'] + inner['wall'] <= \
+                outer['start'] + outer['wall']
+    assert set(s['args']['lpu'] for s in tracer.spans
+               if s['depth'] == 0) == set(['lamina0', 'retina0'])
+
+    # spans of both threads are aggregated by path
+    lines = tracer.summary().splitlines()
+    assert lines[0].split()[:2] == ['span', 'count']
+    assert [line.split()[:2] for line in lines[1:]] == \
+        [['instantiation', '2'], ['graph', '4']]
+    assert lines[2].startswith('  graph')
+
+
+def test_chrome_trace_is_valid_json(tmpdir):
+    tracer = tr.Tracer()
+    with tracer.span('run', steps=10, config={'dt': 1e-4}):
+        with tracer.span('step'):
+            pass
+    prefix = str(tmpdir.join('trace'))
+    tracer.write(prefix)
+    with open(prefix + '.json') as f:
+        trace = json.load(f)
+    events = trace['traceEvents']
+    assert [e['name'] for e in events] == ['run', 'step']
+    for event in events:
+        assert event['ph'] == 'X'
+        assert set(['pid', 'tid', 'ts', 'dur', 'args']) <= set(event)
+        assert event['dur'] >= 0
+    # values that are not numbers are written as strings
+    assert events[0]['args']['steps'] == 10
+    assert events[0]['args']['config'] == str({'dt': 1e-4})
+    with open(prefix + '.txt') as f:
+        assert f.read() == tracer.summary() + '\n'
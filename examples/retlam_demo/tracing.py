@@ -0,0 +1,183 @@
+'''
+    Hierarchical tracing of the phases of a run.
+
+    Phases are wrapped in nested spans that record wall time, CPU time of
+    the thread and the change of resident memory. Spans are kept in memory
+    (a few system calls per span, so tracing can stay on) and written at
+    the end of a run as a Chrome trace (open in chrome://tracing or
+    Perfetto) and as a summary table that aggregates spans by their path.
+
+        configure(config)
+        with span('instantiation of retina and lamina'):
+            with span('retina LPU', lpu='retina0'):
+                ...
+        write_trace(config)
+'''
+from __future__ import division
+
+import collections
+import contextlib
+import json
+import os
+import resource
+import threading
+import time
+
+# thread CPU time where available
+_cpu_time = getattr(time, 'thread_time', None) or \
+    getattr(time, 'process_time', None) or time.clock
+_clock = getattr(time, 'perf_counter', time.time)
+
+PAGE_SIZE = resource.getpagesize()
+
+
+def get_rss():
+    '''
+        Resident memory of the process in bytes
+    '''
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1])*PAGE_SIZE
+    except (IOError, OSError, ValueError, IndexError):
+        # peak instead of current value where /proc is missing
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss*1024
+
+
+class Tracer(object):
+    '''
+        Collects spans of all threads of a process
+
+        --
+        verbose: print the duration of each span when it ends,
+            like neurokernel's Timer
+    '''
+    def __init__(self, verbose=False):
+        self.verbose = verbose
+        self.spans = []
+        self._origin = _clock()
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    def _stack(self):
+        stack = getattr(self._local, 'stack', None)
+        if stack is None:
+            stack = self._local.stack = []
+        return stack
+
+    @contextlib.contextmanager
+    def span(self, name, **args):
+        '''
+            Records the enclosed block as a span named `name`, `args` are
+            stored with it. Yields the span dictionary, whose 'wall',
+            'cpu' and 'rss_delta' are set when the block ends.
+        '''
+        stack = self._stack()
+        record = {'name': name, 'args': args,
+                  'path': '/'.join([s['name'] for s in stack] + [name]),
+                  'depth': len(stack), 'tid': threading.current_thread().ident}
+        stack.append(record)
+        rss = get_rss()
+        cpu = _cpu_time()
+        start = _clock()
+        try:
+            yield record
+        finally:
+            end = _clock()
+            record['start'] = start - self._origin
+            record['wall'] = end - start
+            record['cpu'] = _cpu_time() - cpu
+            record['rss'] = get_rss()
+            record['rss_delta'] = record['rss'] - rss
+            stack.pop()
+            with self._lock:
+                self.spans.append(record)
+            if self.verbose:
+                print('{}{}: {:.3f}s wall, {:.3f}s cpu, {:+.1f} MB'.format(
+                    '  '*record['depth'], name, record['wall'],
+                    record['cpu'], record['rss_delta']/2**20))
+
+    def chrome_trace(self):
+        '''
+            Spans in the Chrome trace event format
+        '''
+        pid = os.getpid()
+        events = []
+        for s in sorted(self.spans, key=lambda s: s['start']):
+            args = dict(s['args'])
+            args.update({'cpu_ms': s['cpu']*1e3,
+                         'rss_delta_mb': s['rss_delta']/2**20,
+                         'rss_mb': s['rss']/2**20})
+            events.append({'name': s['name'], 'ph': 'X', 'pid': pid,
+                           'tid': s['tid'], 'ts': s['start']*1e6,
+                           'dur': s['wall']*1e6,
+                           'args': dict((k, v if isinstance(
+                               v, (int, float, bool)) else str(v))
+                               for k, v in args.items())})
+        return {'traceEvents': events, 'displayTimeUnit': 'ms'}
+
+    def summary(self):
+        '''
+            Table of spans aggregated by path in order of first start
+        '''
+        rows = collections.OrderedDict()
+        for s in sorted(self.spans, key=lambda s: s['start']):
+            row = rows.setdefault(s['path'], {'depth': s['depth'],
+                                              'name': s['name'],
+                                              'count': 0, 'wall': 0.,
+                                              'cpu': 0., 'rss_delta': 0})
+            row['count'] += 1
+            row['wall'] += s['wall']
+            row['cpu'] += s['cpu']
+            row['rss_delta'] += s['rss_delta']
+        lines = ['{:<56} {:>6} {:>10} {:>10} {:>10}'.format(
+            'span', 'count', 'wall (s)', 'cpu (s)', 'rss (MB)')]
+        for row in rows.values():
+            label = '  '*row['depth'] + row['name']
+            lines.append('{:<56} {:>6} {:>10.3f} {:>10.3f} {:>+10.1f}'.format(
+                label[:56], row['count'], row['wall'], row['cpu'],
+                row['rss_delta']/2**20))
+        return '\n'.join(lines)
+
+    def write(self, prefix):
+        '''
+            Writes <prefix>.json (Chrome trace) and <prefix>.txt (summary)
+        '''
+        with open(prefix + '.json', 'w') as f:
+            json.dump(self.chrome_trace(), f)
+        with open(prefix + '.txt', 'w') as f:
+            f.write(self.summary() + '\n')
+
+
+_tracer = Tracer()
+
+
+def get_tracer():
+    return _tracer
+
+
+def configure(config):
+    '''
+        Applies the [General] tracing options to the tracer of the process
+    '''
+    _tracer.verbose = config['General']['trace_verbose']
+
+
+def span(name, **args):
+    '''
+        Span of the tracer of the process (see `Tracer.span`)
+    '''
+    return _tracer.span(name, **args)
+
+
+def write_trace(config, tracer=None):
+    '''
+        Writes the trace of the run to trace<file_suffix>.json and
+        its summary to trace<file_suffix>.txt if [General] trace is set
+    '''
+    if not config['General']['trace']:
+        return
+    tracer = _tracer if tracer is None else tracer
+    prefix = 'trace{}'.format(config['General']['file_suffix'])
+    tracer.write(prefix)
+    print(tracer.summary())
+    print('Trace written to {}.json'.format(prefix))
@@ -0,0 +1,251 @@
+#!/usr/bin/env python
+'''
+    Chooses worker_num and partition of the multiworker retina with short
+    calibration simulations.
+
+    Every combination of the candidate worker counts and partitions of
+    the [Autotune] section runs for a few hundred steps with every
+    profile_interval-th step profiled. The setting whose profiled steps
+    are the fastest is stored in the [Autotune] path under the number of
+    rings, microvilli and the retina model, and later runs with the same
+    values use it instead of the configured one, e.g.
+
+        $ python autotune.py
+        $ python retlam_multiworker_demo.py
+
+    or in one step
+
+        $ python retlam_multiworker_demo.py --autotune
+'''
+from __future__ import division
+
+import argparse
+import copy
+import datetime
+import itertools
+import json
+import os
+import traceback
+
+import neurokernel.core_gpu as core
+
+import export as ex
+import flatspec as fs
+import runtime_profile as rp
+import tracing as tr
+
+
+def tuning_key(config):
+    '''
+        Key of the tuned setting of `config`
+    '''
+    return 'rings={},micro={},model={}'.format(
+        config['Retina']['rings'], config['Retina']['micro'],
+        config['Retina']['model'])
+
+
+def load_settings(path):
+    if not os.path.exists(path):
+        return {}
+    with open(path) as f:
+        return json.load(f)
+
+
+def save_setting(path, key, setting):
+    settings = load_settings(path)
+    settings[key] = setting
+    with open(path, 'w') as f:
+        json.dump(settings, f, indent=2, sort_keys=True)
+
+
+def apply_tuned(config):
+    '''
+        Sets worker_num and partition of `config` to the tuned setting
+        of its rings, microvilli and model if there is one and
+        [Autotune] use_tuned is set, returns the setting or None
+    '''
+    at_config = config['Autotune']
+    if not at_config['use_tuned']:
+        return None
+    setting = load_settings(at_config['path']).get(tuning_key(config))
+    if setting is None:
+        return None
+    config['Retina']['worker_num'] = setting['worker_num']
+    config['Retina']['partition'] = setting['partition']
+    print('Using tuned setting {} workers, {} partition ({})'.format(
+        setting['worker_num'], setting['partition'], at_config['path']))
+    return setting
+
+
+def calibration_config(config, worker_num, partition):
+    '''
+        Copy of `config` for a calibration run
+    '''
+    at_config = config['Autotune']
+    cal_config = config.dict() if hasattr(config, 'dict') \
+        else copy.deepcopy(config)
+    cal_config['Retina']['worker_num'] = worker_num
+    cal_config['Retina']['partition'] = partition
+    cal_config['General']['steps'] = at_config['steps']
+    cal_config['General']['profile_interval'] = at_config['profile_interval']
+    cal_config['General']['file_suffix'] = '{}__autotune'.format(
+        config['General']['file_suffix'])
+    cal_config['General']['export'] = 'none'
+    cal_config['Catalog']['enabled'] = False
+    return cal_config
+
+
+def _profile_components(lpu_ids, suffix):
+    # components of the profile reports of LPUs `lpu_ids` that have one
+    for lpu_id in lpu_ids:
+        filename = rp.get_profile_file(lpu_id, suffix)
+        if os.path.exists(filename):
+            with open(filename) as f:
+                yield json.load(f)['components']
+
+
+def exchange_overhead(lpu_ids, suffix):
+    '''
+        Fraction of the profiled time of LPUs `lpu_ids` spent
+        exchanging data, None without profile reports
+    '''
+    exchange, total = 0., 0.
+    for components in _profile_components(lpu_ids, suffix):
+        exchange += components['exchange']['mean']
+        total += sum(components[c]['mean'] for c in rp.COMPONENTS)
+    return exchange/total if total > 0 else None
+
+
+def profiled_step_time(lpu_ids, suffix):
+    '''
+        Mean time of a step of the slowest of LPUs `lpu_ids` from
+        their profile reports, None without profile reports
+    '''
+    times = [sum(components[c]['mean'] for c in rp.COMPONENTS)
+             for components in _profile_components(lpu_ids, suffix)]
+    return max(times) if times else None
+
+
+def calibrate(config, arrays):
+    '''
+        Runs `config` and returns its steps per second
+        and exchange overhead
+    '''
+    # the demo imports this module
+    import retlam_multiworker_demo as rmd
+
+    retina, lamina = arrays
+    exporter = ex.GraphExporter.from_config(config)
+    manager = core.Manager()
+    rmd.add_LPUs(config, retina, lamina, manager, exporter)
+    manager.spawn()
+    # process start-up is not part of the rate
+    with tr.span('calibration run') as record:
+        manager.start(steps=config['General']['steps'])
+        manager.wait()
+
+    lpu_ids = [rmd.get_master_id(0)] + rmd.get_lamina_ids(config, 0) + \
+        [rmd.get_worker_id(j) for j in range(config['Retina']['worker_num'])]
+    suffix = config['General']['file_suffix']
+    # LPUs step together, so the slowest one sets the rate; the
+    # profiled steps leave out the set-up of the LPUs after start
+    step_time = profiled_step_time(lpu_ids, suffix)
+    if step_time:
+        steps_per_second = 1/step_time
+    else:
+        steps_per_second = config['General']['steps']/record['wall']
+    return {'steps_per_second': steps_per_second,
+            'exchange_overhead': exchange_overhead(lpu_ids, suffix)}
+
+
+def autotune(config):
+    '''
+        Calibrates all candidates of [Autotune], stores the fastest
+        setting in [Autotune] path and returns it
+    '''
+    import retlam_multiworker_demo as rmd
+
+    at_config = config['Autotune']
+    candidates = list(itertools.product(at_config['worker_nums'],
+                                        at_config['partitions']))
+    results = []
+    with tr.span('autotune', candidates=len(candidates)):
+        base_config = calibration_config(config, 1, 'contiguous')
+        # input and arrays do not depend on the split of the retina
+        rmd.prepare_input(base_config)
+        arrays = rmd.get_arrays(base_config)
+
+        for worker_num, partition in candidates:
+            if partition != 'contiguous' and worker_num == 1:
+                continue
+            print('Calibrating {} workers, {} partition'.format(
+                worker_num, partition))
+            result = {'worker_num': worker_num, 'partition': partition,
+                      'error': None}
+            try:
+                result.update(calibrate(
+                    calibration_config(config, worker_num, partition),
+                    arrays))
+            except Exception:
+                result['error'] = traceback.format_exc()
+                print('Calibration failed:\n{}'.format(result['error']))
+            results.append(result)
+
+    completed = [r for r in results if r['error'] is None]
+    if not completed:
+        raise RuntimeError('All calibration runs failed')
+    # fewer workers if equally fast
+    best = max(completed, key=lambda r: (r['steps_per_second'],
+                                         -r['worker_num']))
+    print_results(results, best)
+
+    setting = {'worker_num': best['worker_num'],
+               'partition': best['partition'],
+               'steps_per_second': best['steps_per_second'],
+               'exchange_overhead': best['exchange_overhead'],
+               'steps': at_config['steps'],
+               'created': datetime.datetime.now().isoformat(),
+               'candidates': results}
+    save_setting(at_config['path'], tuning_key(config), setting)
+    return setting
+
+
+def print_results(results, best):
+    print('{:>7} {:>12} {:>12} {:>10}'.format('workers', 'partition',
+                                              'steps/s', 'exchange'))
+    for r in results:
+        if r['error'] is not None:
+            print('{:>7} {:>12} {:>12}'.format(r['worker_num'],
+                                               r['partition'], 'failed'))
+            continue
+        overhead = r['exchange_overhead']
+        print('{:>7} {:>12} {:>12.1f} {:>10}{}'.format(
+            r['worker_num'], r['partition'], r['steps_per_second'],
+            '-' if overhead is None else '{:.1%}'.format(overhead),
+            ' *' if r is best else ''))
+
+
+def main():
+    import neurokernel.mpi_relaunch
+    import retlam_multiworker_demo as rmd
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-c', '--config', default='default',
+                        help='configuration file')
+    args = parser.parse_args()
+
+    with tr.span('getting configuration'):
+        config = rmd.get_config_obj(args).conf
+
+    rmd.setup_logging(config)
+    tr.configure(config)
+    fs.setup_transfer(config)
+    setting = autotune(config)
+    print('Stored {} workers, {} partition for {} in {}'.format(
+        setting['worker_num'], setting['partition'], tuning_key(config),
+        config['Autotune']['path']))
+    tr.write_trace(config)
+
+
+if __name__ == '__main__':
+    main()
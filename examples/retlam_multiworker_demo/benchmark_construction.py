@@ -0,0 +1,290 @@
+#!/usr/bin/env python
+'''
+    Benchmarks the construction phases of the multiworker demo on the CPU
+    for a range of eye sizes, numbers of retina workers and lamina
+    compositions, and writes the results to a JSON file.
+
+    Each configuration runs in a fresh process, so that the peak resident
+    memory reported after every phase belongs to that configuration only.
+    The exponent of a power law fit of each phase duration against the
+    number of ommatidia shows which phases grow superlinearly.
+
+    Example:
+        python benchmark_construction.py -r 4 8 14 20 30 40 -w 1 2 4
+'''
+from __future__ import division
+
+import argparse
+import datetime
+import itertools
+import json
+import math
+import multiprocessing
+import os
+import platform
+import resource
+import shutil
+import tempfile
+import time
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+import networkx as nx
+
+from neurokernel.LPU.LPU import LPU
+
+import retina.retina as ret
+import lamina.lamina as lam
+import retina.geometry.hexagon as r_hx
+import lamina.geometry.hexagon as l_hx
+from retina.screen.map.mapimpl import AlbersProjectionMap
+from retina.configreader import ConfigReader
+
+import gen_input as gi
+import superposition as sp
+
+PHASES = ['retina_array', 'lamina_array', 'graphs', 'graph_to_dicts',
+          'gexf_export', 'pattern', 'update_pattern_master_worker',
+          'input_generation']
+
+
+class PhaseRecorder(object):
+    '''
+        Records duration and memory of named phases
+
+        --
+        trace_memory: also record the peak of memory allocated by
+            Python objects during each phase (slows phases down)
+    '''
+    def __init__(self, trace_memory=False):
+        self.trace_memory = trace_memory and tracemalloc is not None
+        self.results = {}
+
+    def run(self, name, func, *args):
+        if self.trace_memory:
+            tracemalloc.start()
+        start = time.time()
+        result = func(*args)
+        duration = time.time() - start
+        phase = {'seconds': duration,
+                 # kilobytes on Linux
+                 'max_rss': resource.getrusage(
+                     resource.RUSAGE_SELF).ru_maxrss*1024}
+        if self.trace_memory:
+            phase['traced_peak'] = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+        self.results[name] = phase
+        return result
+
+
+def _get_arrays(config):
+    num_rings = config['Retina']['rings']
+    radius = config['Retina']['radius']
+    eulerangles = gi.get_eulerangles(config, 0)
+    transform = AlbersProjectionMap(radius, eulerangles).invmap
+
+    def retina_array():
+        r_hexagon = r_hx.HexagonArray(num_rings=num_rings, radius=radius,
+                                      transform=transform)
+        return ret.RetinaArray(r_hexagon, config)
+
+    def lamina_array():
+        l_hexagon = l_hx.HexagonArray(num_rings=num_rings, radius=radius,
+                                      transform=transform)
+        return lam.LaminaArray(l_hexagon, config)
+
+    return retina_array, lamina_array
+
+
+def _get_graphs(retina, lamina, worker_num):
+    graphs = [retina.get_master_graph()]
+    graphs.extend(retina.get_worker_graph(j+1, worker_num)
+                  for j in range(worker_num))
+    graphs.append(lamina.get_graph())
+    return graphs
+
+
+def _write_gexf(graphs, directory):
+    for i, G in enumerate(graphs):
+        nx.write_gexf(G, os.path.join(directory,
+                                      'graph{}.gexf.gz'.format(i)))
+
+
+def _update_patterns(retina, worker_num):
+    for j in range(worker_num):
+        retina.update_pattern_master_worker(j+1, worker_num)
+
+
+def run_case(config, options):
+    '''
+        Runs all phases for one configuration and
+        returns the results as a dictionary
+    '''
+    worker_num = config['Retina']['worker_num']
+    recorder = PhaseRecorder(options['trace_memory'])
+    directory = tempfile.mkdtemp()
+    cwd = os.getcwd()
+    try:
+        os.chdir(directory)
+        retina_array, lamina_array = _get_arrays(config)
+        retina = recorder.run('retina_array', retina_array)
+        lamina = recorder.run('lamina_array', lamina_array)
+        graphs = recorder.run('graphs', _get_graphs, retina, lamina,
+                              worker_num)
+        recorder.run('graph_to_dicts',
+                     lambda: [LPU.graph_to_dicts(G) for G in graphs])
+        if options['gexf']:
+            recorder.run('gexf_export', _write_gexf, graphs, directory)
+        recorder.run('pattern', sp.build_retina_lamina_pattern,
+                     retina, lamina, False)
+        recorder.run('update_pattern_master_worker', _update_patterns,
+                     retina, worker_num)
+        if options['input_steps'] > 0:
+            recorder.run('input_generation', gi.gen_input, config)
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(directory)
+
+    return {'rings': config['Retina']['rings'], 'worker_num': worker_num,
+            'composition': config['Lamina']['composition'],
+            'num_ommatidia': retina.num_elements,
+            'num_photoreceptors': retina.num_photoreceptors,
+            'phases': recorder.results}
+
+
+def fit_exponent(sizes, durations):
+    '''
+        Exponent k of the least squares fit duration ~ size^k
+        in log-log scale, None if there are too few points
+    '''
+    points = [(math.log(s), math.log(d)) for s, d in zip(sizes, durations)
+              if s > 0 and d > 0]
+    if len(points) < 2:
+        return None
+    mx = sum(x for x, _ in points)/len(points)
+    my = sum(y for _, y in points)/len(points)
+    sxx = sum((x - mx)**2 for x, _ in points)
+    if sxx == 0:
+        return None
+    return sum((x - mx)*(y - my) for x, y in points)/sxx
+
+
+def scaling(results):
+    '''
+        Fitted exponent of each phase per (worker_num, composition)
+    '''
+    summary = []
+    key = lambda r: (r['worker_num'], r['composition'])
+    for (worker_num, composition), group in itertools.groupby(
+            sorted(results, key=key), key=key):
+        group = sorted(group, key=lambda r: r['num_ommatidia'])
+        exponents = {}
+        for phase in PHASES:
+            cases = [r for r in group if phase in r['phases']]
+            exponents[phase] = fit_exponent(
+                [r['num_ommatidia'] for r in cases],
+                [r['phases'][phase]['seconds'] for r in cases])
+        summary.append({'worker_num': worker_num,
+                        'composition': composition,
+                        'exponents': exponents})
+    return summary
+
+
+def print_summary(results, summary):
+    phases = [p for p in PHASES if any(p in r['phases'] for r in results)]
+    print(' '.join(['{:>6} {:>3} {:>10}'.format('rings', 'wrk', 'comp')] +
+                   ['{:>14}'.format(p[:14]) for p in phases] +
+                   ['{:>10}'.format('rss (MB)')]))
+    for r in results:
+        rss = max(p['max_rss'] for p in r['phases'].values())
+        print(' '.join(
+            ['{:>6} {:>3} {:>10}'.format(r['rings'], r['worker_num'],
+                                         r['composition'][:10])] +
+            ['{:>14.3f}'.format(r['phases'][p]['seconds'])
+             if p in r['phases'] else '{:>14}'.format('-') for p in phases] +
+            ['{:>10.0f}'.format(rss/2**20)]))
+    for s in summary:
+        print('Scaling exponents, {} workers, {}: {}'.format(
+            s['worker_num'], s['composition'], ', '.join(
+                '{} {:.2f}'.format(p, k) for p, k in
+                sorted(s['exponents'].items()) if k is not None)))
+
+
+def benchmark(config, rings_list, worker_nums, compositions, options):
+    results = []
+    for rings, worker_num, composition in itertools.product(
+            rings_list, worker_nums, compositions):
+        case_config = config.dict() if hasattr(config, 'dict') else config
+        case_config['Retina']['rings'] = rings
+        case_config['Retina']['worker_num'] = worker_num
+        case_config['Lamina']['composition'] = composition
+        print('rings {}, {} workers, {} composition'.format(
+            rings, worker_num, composition))
+        # a fresh process per case for separate peak memory
+        pool = multiprocessing.Pool(1)
+        try:
+            results.append(pool.apply(run_case, (case_config, options)))
+        finally:
+            pool.close()
+            pool.join()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-c', '--config', default='default',
+                        help='configuration file')
+    parser.add_argument('-r', '--rings', type=int, nargs='+',
+                        default=[4, 8, 14, 20, 30, 40],
+                        help='ring counts to benchmark')
+    parser.add_argument('-w', '--worker_num', type=int, nargs='+',
+                        default=[1], help='numbers of retina workers')
+    parser.add_argument('--composition', nargs='+', default=None,
+                        help='lamina compositions, default the configured '
+                             'one')
+    parser.add_argument('-s', '--input_steps', type=int, default=100,
+                        help='steps of generated input, 0 to skip '
+                             'input generation')
+    parser.add_argument('--no-gexf', action='store_true',
+                        help='skip GEXF export')
+    parser.add_argument('--trace-memory', action='store_true',
+                        help='record peak Python allocations of each '
+                             'phase (slower)')
+    parser.add_argument('-o', '--output', default='construction.json',
+                        help='result file')
+    args = parser.parse_args()
+
+    conf_name = args.config
+    conf_filename = conf_name if '.' in conf_name else ''.join(
+        [conf_name, '.cfg'])
+    conf_specname = os.path.join('..', 'template_spec.cfg')
+    config = ConfigReader(conf_filename, conf_specname).conf
+
+    # construction is measured from scratch and on the CPU
+    config['Cache']['enabled'] = False
+    config['General']['steps'] = max(args.input_steps, 1)
+    config['Retina']['filtermethod'] = 'nogpu'
+    config['Retina']['inputmethod'] = 'read'
+    compositions = args.composition or [config['Lamina']['composition']]
+
+    options = {'gexf': not args.no_gexf, 'input_steps': args.input_steps,
+               'trace_memory': args.trace_memory}
+    results = benchmark(config, args.rings, args.worker_num, compositions,
+                        options)
+    summary = scaling(results)
+    print_summary(results, summary)
+
+    with open(args.output, 'w') as f:
+        json.dump({'created': datetime.datetime.now().isoformat(),
+                   'host': platform.node(),
+                   'python': platform.python_version(),
+                   'options': options, 'results': results,
+                   'scaling': summary}, f, indent=2)
+    print('Wrote {}'.format(args.output))
+
+
+if __name__ == '__main__':
+    main()
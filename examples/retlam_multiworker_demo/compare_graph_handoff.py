@@ -0,0 +1,104 @@
+#!/usr/bin/env python
+'''
+    Compares the time it takes to get LPU components and connections
+    from the graphs of the multiworker demo either directly from memory
+    or through a GEXF file that is written and parsed again.
+
+    Example:
+        python compare_graph_handoff.py -r 4 8 14 20 -w 2
+'''
+import os
+import argparse
+import shutil
+import tempfile
+import time
+
+import networkx as nx
+
+from neurokernel.LPU.LPU import LPU
+
+import retina.retina as ret
+import lamina.lamina as lam
+import retina.geometry.hexagon as r_hx
+import lamina.geometry.hexagon as l_hx
+from retina.screen.map.mapimpl import AlbersProjectionMap
+from retina.configreader import ConfigReader
+
+import gen_input as gi
+
+
+def get_graphs(config, worker_num):
+    num_rings = config['Retina']['rings']
+    radius = config['Retina']['radius']
+    eulerangles = gi.get_eulerangles(config, 0)
+
+    transform = AlbersProjectionMap(radius, eulerangles).invmap
+    r_hexagon = r_hx.HexagonArray(num_rings=num_rings, radius=radius,
+                                  transform=transform)
+    l_hexagon = l_hx.HexagonArray(num_rings=num_rings, radius=radius,
+                                  transform=transform)
+    retina = ret.RetinaArray(r_hexagon, config)
+    lamina = lam.LaminaArray(l_hexagon, config)
+
+    graphs = [retina.get_master_graph()]
+    graphs.extend(retina.get_worker_graph(j+1, worker_num)
+                  for j in range(worker_num))
+    graphs.append(lamina.get_graph())
+    return graphs
+
+
+def time_in_memory(graphs):
+    start = time.time()
+    for G in graphs:
+        LPU.graph_to_dicts(G)
+    return time.time() - start
+
+
+def time_gexf(graphs, directory):
+    start = time.time()
+    for i, G in enumerate(graphs):
+        gexf_file = os.path.join(directory, 'graph{}.gexf.gz'.format(i))
+        nx.write_gexf(G, gexf_file)
+        LPU.lpu_parser(gexf_file)
+    return time.time() - start
+
+
+def compare(config, rings_list, worker_num, directory):
+    print('{:>6} {:>12} {:>12} {:>8}'.format('rings', 'memory (s)',
+                                            'gexf (s)', 'speedup'))
+    for rings in rings_list:
+        config['Retina']['rings'] = rings
+        graphs = get_graphs(config, worker_num)
+        t_memory = time_in_memory(graphs)
+        t_gexf = time_gexf(graphs, directory)
+        print('{:>6} {:>12.3f} {:>12.3f} {:>8.1f}'.format(
+            rings, t_memory, t_gexf, t_gexf/max(t_memory, 1e-9)))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-c', '--config', default='default',
+                        help='configuration file')
+    parser.add_argument('-r', '--rings', type=int, nargs='+',
+                        default=[4, 8, 14, 20],
+                        help='ring counts to compare')
+    parser.add_argument('-w', '--worker_num', type=int, default=1,
+                        help='number of retina workers')
+    args = parser.parse_args()
+
+    conf_name = args.config
+    conf_filename = conf_name if '.' in conf_name else ''.join(
+        [conf_name, '.cfg'])
+    conf_specname = os.path.join('..', 'template_spec.cfg')
+    config = ConfigReader(conf_filename, conf_specname).conf
+    config['Retina']['worker_num'] = args.worker_num
+
+    directory = tempfile.mkdtemp()
+    try:
+        compare(config, args.rings, args.worker_num, directory)
+    finally:
+        shutil.rmtree(directory)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,25 +1,35 @@
 #!/usr/bin/env python
 
-import os, resource, sys
+import os
 import argparse
 
 import networkx as nx
 import numpy as np
 
 import neurokernel.core_gpu as core
-from neurokernel.pattern import Pattern
 from neurokernel.tools.logging import setup_logger
-from neurokernel.tools.timing import Timer
 from neurokernel.LPU.LPU import LPU
 
 import retina.retina as ret
 import lamina.lamina as lam
 import retina.geometry.hexagon as r_hx
 import lamina.geometry.hexagon as l_hx
+import autotune as at
+import catalog as ct
+import export as ex
+import flatspec as fs
 import gen_input as gi
+import naming
+import partition as pt
+import placement as pl
+import recording as rec
+import runtime_profile as rp
+import superposition as sp
+import tracing as tr
 
 from retina.InputProcessors.RetinaInputProcessor import RetinaInputProcessor
-from neurokernel.LPU.OutputProcessors.FileOutputProcessor import FileOutputProcessor
+from file_input import RetinaFileInputProcessor
+from lookahead_input import LookaheadRetinaInputProcessor
 from retina.screen.map.mapimpl import AlbersProjectionMap
 from retina.configreader import ConfigReader
 from retina.NDComponents.MembraneModels.Photoreceptor import Photoreceptor
@@ -28,7 +38,6 @@ from retina.NDComponents.MembraneModels.BufferVoltage import BufferVoltage
 
 
 dtype = np.double
-RECURSION_LIMIT = 80000
 
 
 def setup_logging(config):
@@ -43,14 +52,32 @@ def setup_logging(config):
     logger = setup_logger(file_name=file_name, screen=screen)
 
 def get_master_id(i):
-    return 'retina{}'.format(i)
+    return naming.retina_id(i)
 
 
 def get_worker_id(i):
     return 'retina{}'.format(i+1)
 
 def get_lamina_id(i):
-    return 'lamina{}'.format(i)
+    return naming.lamina_id(i)
+
+
+def get_lamina_ids(config, i):
+    '''
+        ids of the lamina LPUs of eye `i`, one per lamina worker
+    '''
+    worker_num = config['Lamina']['worker_num']
+    if worker_num == 1:
+        return [get_lamina_id(i)]
+    return ['{}_{}'.format(get_lamina_id(i), w) for w in range(worker_num)]
+
+
+def get_lamina_output_file(config, i, worker=None):
+    '''
+        Output file of the lamina of eye `i`, or of its worker `worker`
+    '''
+    return naming.data_file(config['Lamina']['output_file'], i,
+                            config['General']['file_suffix'], worker)
 
 # number of neurons of `j`th worker out of `worker_num`
 # with `total_neurons` neurons overall
@@ -59,7 +86,7 @@ def get_worker_num_neurons(j, total_neurons, worker_num):
     return min(num_neurons, total_neurons - j*num_neurons)
 
 
-def add_master_LPU(config, retina_index, retina, manager):
+def add_master_LPU(config, retina_index, retina, manager, exporter):
     dt = config['General']['dt']
     debug = config['Retina']['debug']
     time_sync = config['Retina']['time_sync']
@@ -69,38 +96,51 @@ def add_master_LPU(config, retina_index, retina, manager):
     gexf_filename = config['Retina']['gexf_file']
     suffix = config['General']['file_suffix']
 
-    output_file = '{}{}{}.h5'.format(output_filename, retina_index, suffix)
-    gexf_file = '{}{}{}.gexf.gz'.format(gexf_filename, retina_index, suffix)
-
-    inputmethod = config['Retina']['inputmethod']
-    if inputmethod == 'read':
-        print('Generating input files')
-        with Timer('input generation'):
-            input_processor = RetinaFileInputProcessor(config, retina)
-    else:
-        print('Using input generating function')
-        input_processor = RetinaInputProcessor(config, retina)
+    output_file = naming.data_file(output_filename, retina_index, suffix)
+    graph_file = '{}{}{}'.format(gexf_filename, retina_index, suffix)
 
-    input_processor = get_input_gen(config, retina)
-    uids_to_record = ['ret_{}_{}'.format(name, i) for i in range(retina.num_elements)
-                for name in ['R1', 'R2', 'R3', 'R4', 'R5', 'R6']]
-    output_processor = FileOutputProcessor([('V',uids_to_record)], output_file, sample_interval=1)
+    input_processor = get_input_gen(config, retina, retina_index)
+    uids_to_record = naming.photoreceptor_uids(retina.num_elements)
+    output_processors = rec.get_output_processors(
+        config, 'Retina', output_file, uids=uids_to_record,
+        num_elements=retina.num_elements)
 
-    G = retina.get_master_graph()
-    nx.write_gexf(G, gexf_file)
-
-    (comp_dict, conns) = LPU.lpu_parser(gexf_file)
     master_id = get_master_id(retina_index)
+    with tr.span('LPU graph', lpu=master_id):
+        G = retina.get_master_graph()
+        exporter.export_graph(G, graph_file)
+        (comp_dict, conns) = LPU.graph_to_dicts(G)
 
     extra_comps = [BufferPhoton, BufferVoltage]
 
-    manager.add(LPU, master_id, dt, comp_dict, conns,
-                device = retina_index, input_processors = [input_processor],
-                output_processors = [output_processor],
-                debug=debug, time_sync=time_sync, extra_comps = extra_comps)
+    comp_dict, conns = fs.pack(config, master_id, comp_dict, conns)
+    lpu_cls, profile_args = rp.get_lpu(config, master_id)
+    manager.add(lpu_cls, master_id, dt, comp_dict, conns,
+                input_processors = [input_processor],
+                output_processors = output_processors,
+                debug=debug, time_sync=time_sync, extra_comps = extra_comps,
+                **profile_args)
 
 
-def add_worker_LPU(config, retina_index, retina, manager):
+def get_partition(config, retina):
+    '''
+        Spatial partition of the photoreceptors among workers, or None
+        for the contiguous index ranges of the retina package
+    '''
+    if config['Retina']['partition'] != 'spatial':
+        return None
+    worker_num = config['Retina']['worker_num']
+    with tr.span('partition of retina'):
+        partition = pt.RetinaPartition(
+            retina, worker_num, config['Retina']['partition_tolerance'])
+    print(partition.format_report())
+    partition.write_report('partition{}.json'.format(
+        config['General']['file_suffix']))
+    return partition
+
+
+def add_worker_LPU(config, retina_index, retina, manager, exporter,
+                   partition=None):
     gexf_filename = config['Retina']['gexf_file']
     suffix = config['General']['file_suffix']
 
@@ -109,24 +149,48 @@ def add_worker_LPU(config, retina_index, retina, manager):
     time_sync = config['Retina']['time_sync']
 
     worker_num = config['Retina']['worker_num']
-    gexf_file = '{}{}_{}{}.gexf.gz'.format(gexf_filename, 0, retina_index, suffix)
-
-    G = retina.get_worker_graph(retina_index+1, worker_num)
-    #G = nx.convert_node_labels_to_integers(G)
-    nx.write_gexf(G, gexf_file)
-
-    worker_dev = retina_index
+    graph_file = '{}{}_{}{}'.format(gexf_filename, 0, retina_index, suffix)
 
-    (comp_dict, conns) = LPU.lpu_parser(gexf_file)
     worker_id = get_worker_id(retina_index)
-    
+    with tr.span('LPU graph', lpu=worker_id):
+        if partition is None:
+            G = retina.get_worker_graph(retina_index+1, worker_num)
+        else:
+            G = partition.worker_graph(retina_index)
+        #G = nx.convert_node_labels_to_integers(G)
+        exporter.export_graph(G, graph_file)
+        (comp_dict, conns) = LPU.graph_to_dicts(G)
+
     extra_comps = [Photoreceptor]
-    manager.add(LPU, worker_id, dt, comp_dict, conns,
-                device=worker_dev, debug=debug, time_sync=time_sync,
-                extra_comps = extra_comps)
+    comp_dict, conns = fs.pack(config, worker_id, comp_dict, conns)
+    lpu_cls, profile_args = rp.get_lpu(config, worker_id)
+    manager.add(lpu_cls, worker_id, dt, comp_dict, conns,
+                debug=debug, time_sync=time_sync,
+                extra_comps = extra_comps, **profile_args)
 
 
-def add_lamina_LPU(config, lamina_index, lamina, manager):
+def get_lamina_partition(config, retina, lamina):
+    '''
+        Partition of the lamina into regions of cartridges, or None
+        for a single lamina LPU
+    '''
+    worker_num = config['Lamina']['worker_num']
+    if worker_num == 1:
+        return None
+    with tr.span('partition of lamina'):
+        # cartridges are at the positions of the ommatidia
+        points = pt.element_points(*retina.get_ommatidia_pos())
+        partition = pt.LaminaPartition(
+            lamina, points, worker_num, config['Lamina']['model'],
+            config['Lamina']['partition_tolerance'])
+    print(partition.format_report())
+    partition.write_report('lamina_partition{}.json'.format(
+        config['General']['file_suffix']))
+    return partition
+
+
+def add_lamina_LPU(config, lamina_index, lamina, manager, exporter,
+                   partition=None, worker=0):
     '''
         This method adds Lamina LPU and its parameters to the manager
         so that it can be initialized later.
@@ -137,10 +201,11 @@ def add_lamina_LPU(config, lamina_index, lamina, manager):
         lamina: lamina array object required for the generation of
             graph.
         manager: manager object to which LPU will be added
-        generator: generator object or None
+        exporter: graph exporter object
+        partition: LaminaPartition if the lamina is split among workers
+        worker: worker of `partition` to add
     '''
 
-    output_filename = config['Lamina']['output_file']
     gexf_filename = config['Lamina']['gexf_file']
     suffix = config['General']['file_suffix']
 
@@ -148,24 +213,35 @@ def add_lamina_LPU(config, lamina_index, lamina, manager):
     debug = config['Lamina']['debug']
     time_sync = config['Lamina']['time_sync']
 
-    output_file = '{}{}{}.h5'.format(output_filename, lamina_index, suffix)
-    gexf_file = '{}{}{}.gexf.gz'.format(gexf_filename, lamina_index, suffix)
-    G = lamina.get_graph()
-    nx.write_gexf(G, gexf_file)
-
-    comp_dict, conns = LPU.lpu_parser(gexf_file)
-    lamina_id = get_lamina_id(lamina_index)
+    lamina_id = get_lamina_ids(config, lamina_index)[worker]
+    if partition is None:
+        output_file = get_lamina_output_file(config, lamina_index)
+        graph_file = '{}{}{}'.format(gexf_filename, lamina_index, suffix)
+    else:
+        output_file = get_lamina_output_file(config, lamina_index, worker)
+        graph_file = '{}{}_{}{}'.format(gexf_filename, lamina_index, worker,
+                                        suffix)
+    with tr.span('LPU graph', lpu=lamina_id):
+        if partition is None:
+            G = lamina.get_graph()
+        else:
+            G = partition.worker_graph(worker)
+        exporter.export_graph(G, graph_file)
+        comp_dict, conns = LPU.graph_to_dicts(G)
     
-    output_processor = FileOutputProcessor(
-                            [('V', None)], output_file,
-                            sample_interval=1)
+    output_processors = rec.get_output_processors(
+        config, 'Lamina', output_file, comp_dict=comp_dict)
 
-    manager.add(LPU, lamina_id, dt, comp_dict, conns,
-                output_processors = [output_processor],
-                device=lamina_index+1, debug=debug, time_sync=time_sync)
+    comp_dict, conns = fs.pack(config, lamina_id, comp_dict, conns)
+    lpu_cls, profile_args = rp.get_lpu(config, lamina_id)
+    manager.add(lpu_cls, lamina_id, dt, comp_dict, conns,
+                output_processors = output_processors,
+                debug=debug, time_sync=time_sync,
+                **profile_args)
 
 
-def connect_master_worker(config, worker_index, retina, manager):
+def connect_master_worker(config, worker_index, retina, manager,
+                          partition=None):
     total_neurons = retina.num_photoreceptors
 
     worker_num = config['Retina']['worker_num']
@@ -174,14 +250,20 @@ def connect_master_worker(config, worker_index, retina, manager):
     worker_id = get_worker_id(worker_index)
     print('Connecting {} and {}'.format(master_id, worker_id))
 
-    with Timer('update of connections in Pattern object'):
-        pattern = retina.update_pattern_master_worker(worker_index+1, worker_num)
+    with tr.span('update of connections in Pattern object'):
+        if partition is None:
+            pattern = retina.update_pattern_master_worker(worker_index+1,
+                                                          worker_num)
+        else:
+            pattern = partition.worker_pattern(worker_index)
 
-    with Timer('update of connections in Manager'):
-        manager.connect(master_id, worker_id, pattern)
+    with tr.span('update of connections in Manager'):
+        manager.connect(master_id, worker_id, fs.pack_pattern(
+            config, '{}_{}'.format(master_id, worker_id), pattern))
 
 
-def connect_retina_lamina(config, index, retina, lamina, manager):
+def connect_retina_lamina(config, index, retina, lamina, manager, exporter,
+                          partition=None):
     '''
         The connections between Retina and Lamina follow
         the neural superposition rule of the fly's compound eye.
@@ -194,50 +276,72 @@ def connect_retina_lamina(config, index, retina, lamina, manager):
         retina: retina array object
         lamina: lamina array object
         manager: manager object to which connection pattern will be added
+        exporter: graph exporter object
+        partition: LaminaPartition if the lamina is split among workers,
+            each worker gets the connections to its cartridges
     '''
     retina_id = get_master_id(index)
-    lamina_id = get_lamina_id(index)
-    print('Connecting {} and {}'.format(retina_id, lamina_id))
-
-    retina_selectors = retina.get_all_selectors()
-    lamina_selectors = lamina.get_all_selectors()
-    with Timer('creation of Pattern object'):
-        from_list = []
-        to_list = []
+    lamina_ids = get_lamina_ids(config, index)
 
+    with tr.span('creation of Pattern object'):
         # accounts neural superposition
-        rulemap = retina.rulemap
-        for ret_sel in retina_selectors:
-            # format should be '/ret/<ommid>/<neuronname>'
-            _, lpu, ommid, n_name = ret_sel.split('/')
-            # find neighbor of neural superposition
-            neighborid = rulemap.neighbor_for_photor(int(ommid), n_name)
-            # format should be '/lam/<cartid>/<neuronname>'
-            lam_sel = lamina.get_selector(neighborid, n_name)
-
-            # setup connection from retina to lamina
-            from_list.append(ret_sel)
-            to_list.append(lam_sel)
-
-        pattern = Pattern.from_concat(','.join(retina_selectors),
-                                      ','.join(lamina_selectors),
-                                      from_sel=','.join(from_list),
-                                      to_sel=','.join(to_list),
-                                      gpot_sel=','.join(from_list+to_list))
-        nx.write_gexf(pattern.to_graph(), retina_id+'_'+lamina_id+'.gexf.gz',
-                      prettyprint=True)
-
-    with Timer('update of connections in Manager'):
-        manager.connect(retina_id, lamina_id, pattern)
-
-
-def start_simulation(config, manager):
+        pattern = sp.build_retina_lamina_pattern(retina, lamina, agg=False)
+        exporter.export_pattern(pattern, naming.pattern_id(index))
+
+    for w, lamina_id in enumerate(lamina_ids):
+        print('Connecting {} and {}'.format(retina_id, lamina_id))
+        with tr.span('update of connections in Manager'):
+            if partition is not None:
+                lamina_pattern = partition.retina_pattern(pattern, w)
+            else:
+                lamina_pattern = pattern
+            manager.connect(retina_id, lamina_id, fs.pack_pattern(
+                config, '{}_{}'.format(retina_id, lamina_id), lamina_pattern))
+
+
+def connect_lamina_workers(config, index, partition, manager):
+    '''
+        Connects the halo ports of lamina workers that exchange
+        outputs of neurons
+    '''
+    lamina_ids = get_lamina_ids(config, index)
+    with tr.span('creation of halo patterns'):
+        patterns = partition.halo_patterns()
+    for (v, w), pattern in sorted(patterns.items()):
+        print('Connecting {} and {}'.format(lamina_ids[v], lamina_ids[w]))
+        manager.connect(lamina_ids[v], lamina_ids[w], fs.pack_pattern(
+            config, '{}_{}'.format(lamina_ids[v], lamina_ids[w]), pattern))
+
+
+def merge_lamina_outputs(config, index):
+    '''
+        Merges the output files of lamina workers into the
+        output file of a single lamina
+    '''
+    worker_num = config['Lamina']['worker_num']
+    if worker_num == 1:
+        return
+    with tr.span('merge of lamina outputs'):
+        rec.merge_output_files(
+            [get_lamina_output_file(config, index, w)
+             for w in range(worker_num)],
+            get_lamina_output_file(config, index))
+
+
+def start_simulation(config, manager, timings=None):
     steps = config['General']['steps']
-    with Timer('retina simulation'):
+    timings = {} if timings is None else timings
+    with ct.timed(timings, 'retina simulation'):
         manager.spawn()
         print('Manager spawned')
         manager.start(steps=steps)
         manager.wait()
+    fs.report()
+    merge_lamina_outputs(config, 0)
+    worker_ids = [get_worker_id(j)
+                  for j in range(config['Retina']['worker_num'])]
+    rp.summarize(config, [get_master_id(0)] + worker_ids +
+                 get_lamina_ids(config, 0))
 
 
 def change_config(config, index):
@@ -262,16 +366,77 @@ def change_config(config, index):
         config['General']['file_suffix'] = suffixes[index]
         config['Retina']['worker_num'] = values[index]
 
-def get_input_gen(config, retina):
+def prepare_input(config, timings=None):
+    '''
+        Generates input files if the retina reads its input from them
+    '''
+    if config['Retina']['inputmethod'] == 'read':
+        print('Generating input files')
+        with ct.timed({} if timings is None else timings,
+                      'input generation'):
+            gi.gen_input(config)
+
+
+def get_arrays(config):
+    '''
+        Retina and lamina arrays of the configured geometry
+    '''
+    num_rings = config['Retina']['rings']
+    radius = config['Retina']['radius']
+    eulerangles = gi.get_eulerangles(config, 0)
+
+    transform = AlbersProjectionMap(radius, eulerangles).invmap
+    r_hexagon = r_hx.HexagonArray(num_rings=num_rings, radius=radius,
+                                  transform=transform)
+    l_hexagon = l_hx.HexagonArray(num_rings=num_rings, radius=radius,
+                                  transform=transform)
+
+    retina = ret.RetinaArray(r_hexagon, config)
+    lamina = lam.LaminaArray(l_hexagon, config)
+    return retina, lamina
+
+
+def add_LPUs(config, retina, lamina, manager, exporter):
+    '''
+        Adds master, workers and lamina (workers) and their
+        connections to `manager`, placed on the GPUs of [Placement]
+    '''
+    worker_num = config['Retina']['worker_num']
+    partition = get_partition(config, retina)
+    # master and first worker on the first GPU, worker j on GPU j and
+    # the lamina on the second GPU unless the placement is better
+    baseline = dict((get_worker_id(j), j) for j in range(worker_num))
+    baseline[get_master_id(0)] = 0
+    baseline.update((lamina_id, 1)
+                    for lamina_id in get_lamina_ids(config, 0))
+    placement = pl.Placement.from_config(config, manager, baseline=baseline)
+
+    add_master_LPU(config, 0, retina, placement, exporter)
+    for j in range(worker_num):
+        add_worker_LPU(config, j, retina, placement, exporter, partition)
+        connect_master_worker(config, j, retina, placement, partition)
+
+    lamina_partition = get_lamina_partition(config, retina, lamina)
+    for w in range(config['Lamina']['worker_num']):
+        add_lamina_LPU(config, 0, lamina, placement, exporter,
+                       lamina_partition, w)
+
+    connect_retina_lamina(config, 0, retina, lamina, placement, exporter,
+                          lamina_partition)
+    if lamina_partition is not None:
+        connect_lamina_workers(config, 0, lamina_partition, placement)
+    placement.apply()
+
+
+def get_input_gen(config, retina, index=0):
     inputmethod = config['Retina']['inputmethod']
 
     if inputmethod == 'read':
-        print('Generating input files')
-        with Timer('input generation'):
-            gi.gen_input(config)
-        return None
+        return RetinaFileInputProcessor(config, retina, index)
     else:
         print('Using input generating function')
+        if config['Retina']['lookahead'] > 0:
+            return LookaheadRetinaInputProcessor(config, retina, index)
 
         return RetinaInputProcessor(config, retina)
 
@@ -289,11 +454,6 @@ def get_config_obj(args):
 
 def main():
     import neurokernel.mpi_relaunch
-    # default limit is low for pickling
-    # the data structures passed through mpi
-    sys.setrecursionlimit(RECURSION_LIMIT)
-    resource.setrlimit(resource.RLIMIT_STACK,
-                       (resource.RLIM_INFINITY, resource.RLIM_INFINITY))
 
     parser = argparse.ArgumentParser()
     parser.add_argument('-c', '--config', default='default',
@@ -303,43 +463,46 @@ def main():
                              'by changing this script accordingly. '
                              'It is useful when need to run this script '
                              'repeatedly for different configuration')
+    parser.add_argument('--autotune', action='store_true',
+                        help='run short calibration simulations to choose '
+                             'worker_num and partition before the run '
+                             '(see [Autotune])')
 
     args = parser.parse_args()
 
-    with Timer('getting configuration'):
+    with tr.span('getting configuration'):
         conf_obj = get_config_obj(args)
         config = conf_obj.conf
         change_config(config, args.value)
 
     setup_logging(config)
+    tr.configure(config)
+    fs.setup_transfer(config)
+    if config['General']['eye_num'] != 1:
+        raise ValueError('The multiworker demo simulates a single eye, '
+                         'use retlam_demo.py for more eyes')
+
+    if args.autotune:
+        at.autotune(config)
+    if args.value < 0:
+        at.apply_tuned(config)
+
+    exporter = ex.GraphExporter.from_config(config)
+    manager = core.Manager()
+    timings = {}
 
-    worker_num = config['Retina']['worker_num']
-    num_rings = config['Retina']['rings']
-    radius = config['Retina']['radius']
-    eulerangles = config['Retina']['eulerangles']
+    prepare_input(config, timings)
+    with ct.timed(timings, 'instantiation of retina and lamina'):
+        retina, lamina = get_arrays(config)
+        add_LPUs(config, retina, lamina, manager, exporter)
 
-    manager = core.Manager()
-    
-    with Timer('instantiation of retina and lamina'):
-        transform = AlbersProjectionMap(radius, eulerangles).invmap
-        r_hexagon = r_hx.HexagonArray(num_rings=num_rings, radius=radius,
-                                      transform=transform)
-        l_hexagon = l_hx.HexagonArray(num_rings=num_rings, radius=radius,
-                                      transform=transform)
-
-        retina = ret.RetinaArray(r_hexagon, config)
-        lamina = lam.LaminaArray(l_hexagon, config)
-        
-        add_master_LPU(config, 0, retina, manager)
-        for j in range(worker_num):
-            add_worker_LPU(config, j, retina, manager)
-            connect_master_worker(config, j, retina, manager)
-        
-        add_lamina_LPU(config, 0, lamina, manager)
-
-        connect_retina_lamina(config, 0, retina, lamina, manager)
-
-    start_simulation(config, manager)
+    start_simulation(config, manager, timings)
+
+    with ct.timed(timings, 'waiting for graph export'):
+        exporter.wait()
+
+    ct.register_run(config, timings)
+    tr.write_trace(config)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,80 @@
+import json
+
+import pytest
+
+pytest.importorskip('numpy')
+pytest.importorskip('networkx')
+pytest.importorskip('neurokernel')
+
+import autotune as at
+import runtime_profile as rp
+
+
+def get_config(**retina):
+    config = {'General': {'file_suffix': '_a', 'steps': 10000,
+                          'profile_interval': 0, 'export': 'sync'},
+              'Retina': {'rings': 14, 'micro': 30000, 'model': 'vision_model',
+                         'worker_num': 1, 'partition': 'contiguous'},
+              'Catalog': {'enabled': True},
+              'Autotune': {'use_tuned': True, 'path': 'autotune.json',
+                           'steps': 300, 'profile_interval': 10}}
+    config['Retina'].update(retina)
+    return config
+
+
+def test_tuning_key():
+    key = at.tuning_key(get_config())
+    assert key == 'rings=14,micro=30000,model=vision_model'
+    assert at.tuning_key(get_config(worker_num=4)) == key
+    for change in [{'rings': 15}, {'micro': 300}, {'model': 'other'}]:
+        assert at.tuning_key(get_config(**change)) != key
+
+
+def test_apply_tuned(tmpdir, monkeypatch):
+    monkeypatch.chdir(tmpdir)
+    config = get_config()
+    assert at.apply_tuned(config) is None
+    at.save_setting('autotune.json', at.tuning_key(config),
+                    {'worker_num': 3, 'partition': 'balanced'})
+    at.save_setting('autotune.json', at.tuning_key(get_config(rings=2)),
+                    {'worker_num': 2, 'partition': 'contiguous'})
+    assert at.apply_tuned(config)['worker_num'] == 3
+    assert config['Retina']['worker_num'] == 3
+    assert config['Retina']['partition'] == 'balanced'
+
+    config = get_config()
+    config['Autotune']['use_tuned'] = False
+    assert at.apply_tuned(config) is None
+    assert config['Retina']['worker_num'] == 1
+
+
+def test_calibration_config():
+    config = get_config()
+    cal_config = at.calibration_config(config, 2, 'balanced')
+    assert cal_config['Retina']['worker_num'] == 2
+    assert cal_config['General']['steps'] == 300
+    assert cal_config['General']['profile_interval'] == 10
+    assert cal_config['General']['file_suffix'] == '_a__autotune'
+    assert not cal_config['Catalog']['enabled']
+    # the configuration of the run is unchanged
+    assert config == get_config()
+
+
+def write_report(lpu_id, suffix, means):
+    components = dict((c, {'mean': means.get(c, 0.)})
+                      for c in rp.COMPONENTS)
+    with open(rp.get_profile_file(lpu_id, suffix), 'w') as f:
+        json.dump({'components': components}, f)
+
+
+def test_profiled_rates(tmpdir, monkeypatch):
+    monkeypatch.chdir(tmpdir)
+    assert at.profiled_step_time(['retina0'], '_a') is None
+    assert at.exchange_overhead(['retina0'], '_a') is None
+
+    write_report('retina0', '_a', {'compute': 3e-3, 'exchange': 1e-3})
+    write_report('retina1', '_a', {'compute': 1e-3, 'exchange': 1e-3})
+    lpu_ids = ['retina0', 'retina1', 'lamina0']
+    # the slowest LPU sets the time of a step
+    assert at.profiled_step_time(lpu_ids, '_a') == pytest.approx(4e-3)
+    assert at.exchange_overhead(lpu_ids, '_a') == pytest.approx(2/6.)
@@ -0,0 +1,33 @@
+import pytest
+
+pytest.importorskip('networkx')
+pytest.importorskip('neurokernel')
+pytest.importorskip('retina')
+
+import benchmark_construction as bc
+
+
+def test_fit_exponent():
+    sizes = [7, 19, 37, 61, 91]
+    # quadratic with a little noise
+    durations = [1e-6*s**2*(1 + 0.01*(-1)**i) for i, s in enumerate(sizes)]
+    assert bc.fit_exponent(sizes, durations) == pytest.approx(2., abs=0.05)
+    assert bc.fit_exponent([7], [1.]) is None
+    # phases that took no measurable time are left out
+    assert bc.fit_exponent([7, 19, 37], [0., 1., 1.]) == pytest.approx(0.)
+    assert bc.fit_exponent([7, 7], [1., 2.]) is None
+
+
+def test_scaling():
+    def result(num_ommatidia, seconds, worker_num=1):
+        return {'worker_num': worker_num, 'composition': 'Original',
+                'num_ommatidia': num_ommatidia,
+                'phases': {'graphs': {'seconds': seconds}}}
+    results = [result(n, 1e-3*n**2) for n in [7, 19, 37]] + \
+        [result(n, 1e-3*n, worker_num=2) for n in [7, 19, 37]]
+    summary = bc.scaling(results)
+    assert [s['worker_num'] for s in summary] == [1, 2]
+    assert summary[0]['exponents']['graphs'] == pytest.approx(2.)
+    assert summary[1]['exponents']['graphs'] == pytest.approx(1.)
+    # phases that were not measured have no exponent
+    assert summary[0]['exponents']['pattern'] is None